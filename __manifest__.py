@@ -1,6 +1,6 @@
 {
     'name': 'Panama Electronic Invoicing - HKA Integration',
-    'version': '17.0.1.0.29',
+    'version': '17.0.1.0.32',
     'category': 'Accounting/Localizations',
     'summary': 'Electronic Invoicing Integration for Panama with HKA',
     'description': """
@@ -28,11 +28,16 @@
         'data/ir_cron_data.xml',
         'wizard/account_move_cancel_reason_views.xml',
         'wizard/account_move_register_hka_views.xml',
+        'wizard/account_move_send_hka_views.xml',
         'views/res_company_views.xml',
         'views/res_config_settings_views.xml',
         'views/isfehka_configuration_views.xml',
         'views/res_partner_views.xml',
         'views/account_move_views.xml',
+        'views/hka_outbox_views.xml',
+        'views/hka_timing_views.xml',
+        'views/hka_number_range_views.xml',
+        'views/hka_journal_views.xml',
         'views/pos_config_views.xml',
         'views/pos_payment_method_views.xml',
         'views/account_journal_views.xml',
@@ -45,6 +50,9 @@
         'point_of_sale._assets_pos': [
             'isfehka/static/src/js/pos_partner_extension.js',
             'isfehka/static/src/xml/pos_partner_extension.xml',
+            'isfehka/static/src/js/hka_receipt.js',
+            'isfehka/static/src/js/hka_partner_cache.js',
+            'isfehka/static/src/xml/hka_receipt.xml',
         ],
     },
     'external_dependencies': {
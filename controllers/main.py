@@ -1,26 +1,34 @@
 from odoo import http
 from odoo.http import request
+import gzip
 import logging
-import base64
+
+from ..tools.receipt import RECEIPT_PROFILES
 
 _logger = logging.getLogger(__name__)
 
+# Receipt images never change for an invoice, only the ETag is checked after this
+RECEIPT_MAX_AGE = 86400
+MAX_RECEIPTS_PER_CALL = 500
+# Content-addressed, so it can be cached for as long as browsers allow
+CATALOG_MAX_AGE = 365 * 86400
+
 class PosHkaController(http.Controller):
     @http.route('/pos/get_order_invoice', type='json', auth='user')
     def get_order_invoice(self, pos_reference):
-        _logger.info('[HKA Debug] Getting invoice for POS reference: %s', pos_reference)
+        _logger.debug('[HKA Debug] Getting invoice for POS reference: %s', pos_reference)
         try:
             order = request.env['pos.order'].search([('pos_reference', '=', pos_reference)], limit=1)
             if not order:
-                _logger.warning('[HKA Debug] No order found for reference: %s', pos_reference)
+                _logger.debug('[HKA Debug] No order found for reference: %s', pos_reference)
                 return {'error': 'Order not found'}
             
-            _logger.info('[HKA Debug] Found order: %s', order.name)
+            _logger.debug('[HKA Debug] Found order: %s', order.name)
             if not order.account_move:
-                _logger.warning('[HKA Debug] No invoice found for order: %s', order.name)
+                _logger.debug('[HKA Debug] No invoice found for order: %s', order.name)
                 return {'error': 'No invoice found for order'}
             
-            _logger.info('[HKA Debug] Found invoice: %s', order.account_move.id)
+            _logger.debug('[HKA Debug] Found invoice: %s', order.account_move.id)
             return {
                 'success': True,
                 'invoice_id': order.account_move.id,
@@ -31,35 +39,98 @@ class PosHkaController(http.Controller):
             _logger.error('[HKA Debug] Error in get_order_invoice: %s', str(e))
             return {'error': str(e)}
 
+    @http.route('/pos/hka_receipts', type='json', auth='user')
+    def get_hka_receipts(self, pos_references, profile=None):
+        """Invoice status, CUFE, QR and receipt image URL for a batch of POS references"""
+        if profile and profile not in RECEIPT_PROFILES:
+            return {'error': 'Unknown receipt profile'}
+        if len(pos_references) > MAX_RECEIPTS_PER_CALL:
+            return {'error': 'At most %d references per call' % MAX_RECEIPTS_PER_CALL}
+        try:
+            return {
+                'success': True,
+                'receipts': request.env['pos.order']._get_hka_receipts_info(pos_references, profile),
+            }
+        except Exception as e:
+            _logger.error('[HKA Debug] Error in get_hka_receipts: %s', str(e))
+            return {'error': str(e)}
+
     @http.route('/pos/get_hka_pdf', type='json', auth='user')
-    def get_hka_pdf(self, invoice_id):
-        _logger.info('[HKA Debug] Getting HKA PDF for invoice: %s', invoice_id)
+    def get_hka_pdf(self, invoice_id, profile=None):
+        _logger.debug('[HKA Debug] Getting HKA PDF for invoice: %s', invoice_id)
         try:
             invoice = request.env['account.move'].browse(int(invoice_id))
             if not invoice.exists():
                 _logger.warning('[HKA Debug] Invoice not found: %s', invoice_id)
                 return {'error': 'Invoice not found'}
 
-            _logger.info('[HKA Debug] Found invoice: %s', invoice.name)
-            if not invoice.hka_pdf:
-                _logger.warning('[HKA Debug] No HKA PDF found for invoice: %s', invoice.name)
+            _logger.debug('[HKA Debug] Found invoice: %s', invoice.name)
+            if not invoice.with_context(bin_size=True).hka_pdf:
+                _logger.debug('[HKA Debug] No HKA PDF found for invoice: %s', invoice.name)
                 return {'error': 'No HKA PDF found for invoice'}
 
-            _logger.info('[HKA Debug] Converting HKA PDF to image')
-            import fitz  # PyMuPDF
-            pdf_data = base64.b64decode(invoice.hka_pdf)
-            doc = fitz.open(stream=pdf_data, filetype="pdf")
-            page = doc[0]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_data = pix.tobytes("png")
-            
-            image_base64 = base64.b64encode(img_data).decode('utf-8')
-            _logger.info('[HKA Debug] Successfully converted PDF to image. Data length: %d', len(image_base64))
-            
+            profile = profile or invoice._get_hka_receipt_profile()
+            attachment = invoice._get_hka_receipt_attachment(profile)
+            if not attachment:
+                return {'pending': True, 'error': 'The HKA receipt is not rendered yet'}
+
             return {
                 'success': True,
-                'image_data': f'data:image/png;base64,{image_base64}'
+                'image_data': f'data:image/png;base64,{attachment.datas.decode()}',
+                'image_url': '/pos/hka_receipt/%s/%s.png' % (invoice.id, profile),
             }
         except Exception as e:
             _logger.error('[HKA Debug] Error in get_hka_pdf: %s', str(e))
             return {'error': str(e)}
+
+    @http.route('/pos/hka_receipt/<int:invoice_id>/<string:profile>.png', type='http', auth='user', methods=['GET'])
+    def hka_receipt_image(self, invoice_id, profile):
+        """Receipt image of the invoice, revalidated by the browser with its ETag"""
+        if profile not in RECEIPT_PROFILES:
+            raise request.not_found()
+        invoice = self._get_readable_invoice(invoice_id)
+        return self._image_response(invoice._get_hka_receipt_attachment(profile))
+
+    @http.route('/pos/hka_qr/<int:invoice_id>.png', type='http', auth='user', methods=['GET'])
+    def hka_qr_image(self, invoice_id):
+        """DGI validation QR of the invoice, generated locally from hka_qr"""
+        invoice = self._get_readable_invoice(invoice_id)
+        return self._image_response(invoice._get_hka_qr_attachment())
+
+    @http.route('/pos/hka_locations/<string:version>.json', type='http', auth='user', methods=['GET'])
+    def hka_locations(self, version):
+        """Panama location catalog; the URL changes with its content"""
+        current, data = request.env['res.distrito.pa']._get_pos_location_catalog()
+        if version != current:
+            return request.redirect('/pos/hka_locations/%s.json' % current)
+        headers = [
+            ('Content-Type', 'application/json'),
+            ('Cache-Control', 'public, max-age=%d, immutable' % CATALOG_MAX_AGE),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if 'gzip' in request.httprequest.accept_encodings:
+            headers.append(('Content-Encoding', 'gzip'))
+        else:
+            data = gzip.decompress(data)
+        response = request.make_response(data, headers=headers)
+        response.set_etag(current)
+        return response.make_conditional(request.httprequest)
+
+    def _get_readable_invoice(self, invoice_id):
+        invoice = request.env['account.move'].browse(invoice_id).exists()
+        if not invoice:
+            raise request.not_found()
+        invoice.check_access_rights('read')
+        invoice.check_access_rule('read')
+        return invoice
+
+    def _image_response(self, attachment):
+        if not attachment:
+            raise request.not_found()
+        response = request.make_response(attachment.raw, headers=[
+            ('Content-Type', 'image/png'),
+            ('Cache-Control', 'private, max-age=%d' % RECEIPT_MAX_AGE),
+        ])
+        response.set_etag(attachment.checksum)
+        # Answers 304 Not Modified when If-None-Match matches
+        return response.make_conditional(request.httprequest)
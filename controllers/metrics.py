@@ -0,0 +1,25 @@
+from odoo import http
+from odoo.http import request
+from odoo.tools import consteq
+
+
+class HkaMetricsController(http.Controller):
+    @http.route('/isfehka/metrics', type='http', auth='none', methods=['GET'], csrf=False, save_session=False)
+    def metrics(self, **kwargs):
+        """Prometheus scrape endpoint
+
+        Disabled unless the isfehka.metrics_token system parameter is set; the
+        scraper must send it as a bearer token.
+        """
+        if not request.db:
+            return request.not_found()
+        token = request.env['ir.config_parameter'].sudo().get_param('isfehka.metrics_token')
+        auth = request.httprequest.headers.get('Authorization', '')
+        if not token or not consteq(auth, 'Bearer %s' % token):
+            return request.make_response('Forbidden\n', status=403, headers=[('Content-Type', 'text/plain')])
+
+        body = request.env['hka.metric'].sudo()._render_prometheus()
+        return request.make_response(body, headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Cache-Control', 'no-store'),
+        ])
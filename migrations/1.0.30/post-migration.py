@@ -0,0 +1,31 @@
+def migrate(cr, version):
+    """Initialize hka_document_state from the existing attachments
+
+    Invoices sent more than 7 days ago that still miss a document were no
+    longer retried by the cron, so they start as failed.
+    """
+    if not version:
+        return
+
+    cr.execute("""
+        WITH docs AS (
+            SELECT res_id,
+                   bool_or(res_field = 'hka_pdf') AS has_pdf,
+                   bool_or(res_field = 'hka_xml') AS has_xml
+              FROM ir_attachment
+             WHERE res_model = 'account.move'
+               AND res_field IN ('hka_pdf', 'hka_xml')
+          GROUP BY res_id
+        )
+        UPDATE account_move m
+           SET hka_document_state = CASE
+                   WHEN d.has_pdf AND d.has_xml THEN 'complete'
+                   WHEN m.write_date < (now() AT TIME ZONE 'UTC') - interval '7 days' THEN 'failed'
+                   WHEN d.has_pdf OR d.has_xml THEN 'partial'
+                   ELSE 'pending'
+               END
+          FROM account_move m2
+     LEFT JOIN docs d ON d.res_id = m2.id
+         WHERE m.id = m2.id
+           AND m.hka_status = 'sent'
+    """)
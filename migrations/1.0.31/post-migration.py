@@ -0,0 +1,13 @@
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Document retrieval is now triggered after each send; poll hourly as a safety net"""
+    if not version:
+        return
+
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    cron = env.ref('isfehka.ir_cron_retrieve_hka_documents', raise_if_not_found=False)
+    # Keep intervals that were customized
+    if cron and (cron.interval_number, cron.interval_type) == (15, 'minutes'):
+        cron.write({'interval_number': 1, 'interval_type': 'hours'})
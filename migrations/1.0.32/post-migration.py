@@ -0,0 +1,10 @@
+def migrate(cr, version):
+    """RUCs are now stored upper case, as the POS RUC search expects"""
+    if not version:
+        return
+
+    cr.execute("""
+        UPDATE res_partner
+           SET ruc = upper(btrim(ruc))
+         WHERE ruc IS NOT NULL AND ruc <> upper(btrim(ruc))
+    """)
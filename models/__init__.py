@@ -5,10 +5,16 @@ from . import res_location_pa
 from . import res_partner
 from . import hka_service
 from . import account_move
+from . import hka_outbox
+from . import hka_number_range
+from . import hka_journal
+from . import hka_timing
+from . import hka_metric
 from . import account_journal
 from . import payment_provider
 from . import pos_config
 from . import pos_session
+from . import pos_hkapdf
 from . import pos_order
 from . import pos_payment_method
 from . import ir_ui_view
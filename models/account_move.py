@@ -2,11 +2,34 @@ from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
 import base64
 import logging
+import psycopg2
 import pytz
+import time
 from datetime import datetime, timedelta
 
+from odoo.tools import config as odoo_config
+
+from .hka_service import BREAKER_OPEN_SECONDS
+from ..tools import tracing
+from ..tools.pool import run_in_new_cursors
+from ..tools.receipt import RECEIPT_PROFILES, DEFAULT_RECEIPT_PROFILE
+
 _logger = logging.getLogger(__name__)
 
+# Download attempts before an invoice's documents are marked as failed, and the backoff cap
+DOCUMENT_MAX_ATTEMPTS = 24
+DOCUMENT_RETRY_MAX_MINUTES = 360
+# Missing-document cron: parallel downloads, seconds per run, largest batch and the
+# initial guess of seconds per invoice and worker (refined after each batch)
+DOCUMENT_CONCURRENCY = 4
+DOCUMENT_TIME_BUDGET = 240
+DOCUMENT_BATCH_MAX = 200
+DOCUMENT_SECONDS_ESTIMATE = 5.0
+# Delay between a successful send without documents and its document fetch
+DOCUMENT_FETCH_DELAY_SECONDS = 5
+# Pixels; prints at about 25 mm on 203 dpi thermal printers
+QR_IMAGE_SIZE = 200
+
 class AccountMove(models.Model):
     _inherit = 'account.move'
 
@@ -16,7 +39,7 @@ class AccountMove(models.Model):
         ('sent', 'Enviado'),
         ('cancelled', 'Anulado'),
         ('error', 'Error')
-    ], string='Estado HKA', default='draft', tracking=True)
+    ], string='Estado HKA', default='draft', tracking=True, index=True)
 
     hka_cufe = fields.Char(
         string='CUFE',
@@ -66,10 +89,40 @@ class AccountMove(models.Model):
         readonly=True
     )
 
+    # Generated from hka_qr as soon as HKA accepts the document, for the POS receipt
+    hka_qr_image = fields.Binary(
+        string='Imagen QR HKA',
+        readonly=True,
+        attachment=True,
+        copy=False
+    )
+
+    hka_document_state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('partial', 'Parcial'),
+        ('complete', 'Completo'),
+        ('failed', 'Fallido'),
+    ], string='Documentos HKA', readonly=True, copy=False, index='btree_not_null',
+       help='Disponibilidad del PDF y XML de HKA para facturas enviadas. '
+            'Se mantiene al escribir los documentos, sin leer los archivos.')
+
+    hka_document_attempts = fields.Integer(
+        string='Intentos de Descarga',
+        readonly=True,
+        copy=False
+    )
+
+    hka_document_next_attempt = fields.Datetime(
+        string='Próximo Intento de Descarga',
+        readonly=True,
+        copy=False
+    )
+
     numero_documento_fiscal = fields.Char(
         string='Número Documento Fiscal',
         readonly=True,
         size=10,
+        index='btree_not_null',
         help='Número del documento fiscal asignado por HKA'
     )
 
@@ -78,6 +131,32 @@ class AccountMove(models.Model):
         readonly=True
     )
 
+    def init(self):
+        super().init()
+        # The hka_invoices gauge counts customer invoices by status from this index only
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS account_move_hka_status_invoice_index
+                ON account_move (hka_status)
+             WHERE move_type IN ('out_invoice', 'out_refund') AND hka_status IS NOT NULL
+        """)
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'hka_document_state' not in vals and not vals.keys().isdisjoint(('hka_status', 'hka_pdf', 'hka_xml')):
+            self._update_hka_document_state()
+        if 'hka_qr' in vals:
+            self._render_hka_qr_image()
+        if not vals.keys().isdisjoint(('hka_cufe', 'hka_document_state')):
+            self._notify_hka_pos()
+        if 'hka_pdf' in vals:
+            # Receipt images are rendered by the pos.hkapdf cron, never while sending
+            receipts = self.env['pos.hkapdf'].sudo()
+            if vals['hka_pdf']:
+                receipts._queue_for_moves(self)
+            else:
+                receipts.search([('move_id', 'in', self.ids)]).unlink()
+        return res
+
     @api.model
     def _default_tipo_documento(self):
         move_type = self.env.context.get('default_move_type', 'entry')
@@ -129,8 +208,13 @@ class AccountMove(models.Model):
         - POS invoices (tipo_documento/naturaleza set from POS config)
         - Subscription renewals
         - Any other automated invoicing flow
+
+        POS invoices are sent inline because the receipt needs the CUFE.
+        Every other invoice is queued in hka.outbox so posting returns
+        immediately and the sends are done by the outbox workers.
         """
         res = super().action_post()
+        to_queue = self.browse()
         for move in self.filtered(
             lambda m: m.move_type in ('out_invoice', 'out_refund')
             and m.state == 'posted'
@@ -153,82 +237,111 @@ class AccountMove(models.Model):
                             vals['naturaleza_operacion'] = pos_order.config_id.hka_naturaleza_operacion
                     if vals:
                         move.write(vals)
-            try:
-                move._send_to_hka()
-            except Exception as e:
-                _logger.warning('Auto-send to HKA failed for %s: %s', move.name or move.id, e)
-                move.write({
-                    'hka_status': 'error',
-                    'hka_message': str(e),
-                })
+            if move.pos_order_ids:
+                # POS receipts need the CUFE right away, send inline
+                try:
+                    move._send_to_hka()
+                except Exception as e:
+                    _logger.warning('Auto-send to HKA failed for %s: %s', move.name or move.id, e)
+                    move.write({
+                        'hka_status': 'error',
+                        'hka_message': str(e),
+                    })
+            else:
+                to_queue |= move
+        if to_queue:
+            self.env['hka.outbox'].sudo()._enqueue(to_queue)
         return res
 
     def _send_to_hka(self):
         """Send invoice to HKA"""
         self.ensure_one()
+        with tracing.trace_context(move_id=self.id, company_id=self.company_id.id), \
+                tracing.span(self.env.cr.dbname, 'send_to_hka'):
+            return self._send_to_hka_pipeline()
+
+    def _send_to_hka_pipeline(self):
+        """Validate, number, build and send the invoice, then store HKA's answer
+
+        Each step is recorded as a latency span (see tools/tracing.py).
+        """
+        if self.hka_status == 'sent':
+            raise UserError(_('Esta factura ya ha sido enviada a HKA'))
+
+        # Only one sender per invoice (outbox, button, wizard): lock the row for the whole send
+        # and look at the status again, another transaction may have sent it meanwhile
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("SELECT id FROM account_move WHERE id = %s FOR UPDATE NOWAIT", [self.id])
+        except psycopg2.OperationalError:
+            raise UserError(_('La factura %s se está enviando a HKA en otro proceso.') % self.name)
+        self.invalidate_recordset(['hka_status', 'numero_documento_fiscal', 'hka_cufe'])
         if self.hka_status == 'sent':
             raise UserError(_('Esta factura ya ha sido enviada a HKA'))
 
+        # HKA may already have accepted this invoice in an attempt whose transaction was
+        # lost: apply that answer instead of sending again with a new fiscal number
+        journaled = self.env['hka.journal'].sudo()._find_pending(self)
+        if journaled:
+            _logger.warning('Invoice %s already accepted by HKA (journal entry %s, CUFE %s), not resending',
+                            self.name, journaled['id'], journaled['cufe'])
+            self._apply_hka_journal_entry(journaled)
+            self.env['hka.journal'].sudo()._mark_applied_on_commit(journaled['id'])
+            return
+
         # Validate required data before sending
-        self._validate_hka_data()
-        self._get_hka_configuration()
+        with tracing.span(self.env.cr.dbname, 'validate'):
+            self._validate_hka_data()
+            self._get_hka_configuration()
 
         # Get the next fiscal number if needed
         if not self.numero_documento_fiscal:
-            fiscal_number = self._get_next_fiscal_number()
+            with tracing.span(self.env.cr.dbname, 'fiscal_number'):
+                fiscal_number = self._get_next_fiscal_number()
             if not fiscal_number:
                 raise UserError(_('No se pudo obtener el próximo número fiscal.'))
             self.numero_documento_fiscal = fiscal_number
 
+        accepted = False
         try:
             hka_service = self.env['hka.service'].with_company(self.company_id)
-            invoice_data = self._prepare_hka_data()
+            with tracing.span(self.env.cr.dbname, 'payload'):
+                invoice_data = self._prepare_hka_data()
             # Skip PDF/XML downloads if this is a POS order to avoid blocking
             skip_documents = bool(self.pos_order_ids)
-            result = hka_service.send_invoice(invoice_data, skip_documents=skip_documents)
+            with tracing.span(self.env.cr.dbname, 'send_invoice'):
+                result = hka_service.send_invoice(invoice_data, skip_documents=skip_documents)
 
             if result['success']:
-                # CRITICAL: Save essential HKA data first - never rollback after HKA succeeds
-                try:
-                    # Write critical fields that must be saved
-                    self.write({
-                        'hka_status': 'sent',
-                        'hka_cufe': result['data'].get('cufe', ''),
-                        'hka_qr': result['data'].get('qr', ''),
-                        'hka_nro_protocolo_autorizacion': result['data'].get('nroProtocoloAutorizacion', ''),
-                        'hka_message': _('Documento enviado exitosamente'),
-                    })
-                    self.env.cr.commit()  # Commit immediately - invoice exists in DGI now
-                    _logger.info(f"CRITICAL HKA DATA SAVED for invoice {self.name} - CUFE: {result['data'].get('cufe', '')}")
-                except Exception as e:
-                    # If even this fails, log and try to save just CUFE
-                    _logger.error(f"CRITICAL: Failed to save HKA data for {self.name}: {e}")
-                    try:
-                        self.write({
-                            'hka_status': 'sent',
-                            'hka_cufe': result['data'].get('cufe', ''),
-                            'hka_message': _('Documento enviado - datos parciales: %s') % str(e),
-                        })
-                        self.env.cr.commit()
-                    except:
-                        _logger.critical(f"FAILED TO SAVE CUFE for {self.name} - CUFE: {result['data'].get('cufe', '')} - MANUAL RECOVERY NEEDED")
-                
-                # Now try to save optional date field separately
+                accepted = True
+                # CRITICAL: the invoice exists in DGI now. Journal HKA's answer on its own
+                # cursor first; if this transaction never commits, the journal recovery
+                # cron applies it, so the invoice is written once, with the caller's commit.
+                journal_id = None
                 try:
-                    fecha_recepcion = False
-                    if result['data'].get('fechaRecepcionDGI'):
-                        # Parse ISO 8601 format: 2025-11-13T15:46:53-05:00
-                        fecha_str = result['data']['fechaRecepcionDGI']
-                        # Remove timezone info and parse
-                        if 'T' in fecha_str:
-                            fecha_str = fecha_str.split('-05:00')[0].split('+')[0]  # Remove timezone
-                            fecha_recepcion = datetime.strptime(fecha_str, '%Y-%m-%dT%H:%M:%S')
-                        
-                        self.write({'hka_fecha_recepcion_dgi': fecha_recepcion})
-                        self.env.cr.commit()
+                    with tracing.span(self.env.cr.dbname, 'journal'):
+                        journal_id = self.env['hka.journal'].sudo()._record(self, result['data'])
                 except Exception as e:
-                    _logger.warning(f"Could not save fechaRecepcionDGI for {self.name}: {e} - Continuing with other data")
-                    # Don't fail - we already saved the critical data
+                    _logger.critical("Could not journal HKA data for %s - CUFE: %s - %s",
+                                     self.name, result['data'].get('cufe', ''), e)
+
+                vals = self._prepare_hka_sent_vals(result['data'])
+                vals['hka_message'] = _('Documento enviado exitosamente')
+                if result.get('pdf'):
+                    vals.update({
+                        'hka_pdf': base64.b64encode(result['pdf']),
+                        'hka_pdf_filename': f'FACT_{self.numero_documento_fiscal}.pdf',
+                    })
+                if result.get('xml'):
+                    vals.update({
+                        'hka_xml': base64.b64encode(result['xml']),
+                        'hka_xml_filename': f'FACT_{self.numero_documento_fiscal}.xml',
+                    })
+                with tracing.span(self.env.cr.dbname, 'save'):
+                    self.write(vals)
+                if journal_id:
+                    self.env['hka.journal'].sudo()._mark_applied_on_commit(journal_id)
+                _logger.info("HKA data saved for invoice %s - CUFE: %s", self.name, vals['hka_cufe'])
 
                 # Trigger sync to POS orders if isfehka_cafe module is installed
                 try:
@@ -236,32 +349,9 @@ class AccountMove(models.Model):
                 except AttributeError:
                     # Method doesn't exist if isfehka_cafe module is not installed
                     pass
-
-                try:
-                    # Then handle PDF and XML files with proper filenames
-                    pdf_filename = f'FACT_{self.numero_documento_fiscal}.pdf'
-                    xml_filename = f'FACT_{self.numero_documento_fiscal}.xml'
-                    
-                    if result.get('pdf'):
-                        self.write({
-                            'hka_pdf': base64.b64encode(result['pdf']),
-                            'hka_pdf_filename': pdf_filename,
-                        })
-                        self.env.cr.commit()  # Commit PDF separately
-
-                    if result.get('xml'):
-                        self.write({
-                            'hka_xml': base64.b64encode(result['xml']),
-                            'hka_xml_filename': xml_filename,
-                        })
-                        self.env.cr.commit()  # Commit XML separately
-
                 except Exception as e:
-                    _logger.error('Error saving PDF/XML files: %s', str(e))
-                    # Don't raise the error since we already have the CUFE and status
-                    self.write({
-                        'hka_message': _('Documento enviado pero hubo un error al guardar PDF/XML: %s') % str(e)
-                    })
+                    # The acceptance is saved; a failed sync must not undo it
+                    _logger.error('Could not sync the CUFE of %s to its POS orders: %s', self.name, e)
 
             else:
                 # In case of error, keep status as draft and log the error
@@ -273,6 +363,11 @@ class AccountMove(models.Model):
                 raise UserError(result['message'])
 
         except Exception as e:
+            if accepted:
+                # The document exists in DGI: never reset it to draft. If this transaction
+                # is lost, the next send or the recovery cron applies the journal entry.
+                _logger.critical('Could not save the HKA acceptance of %s: %s', self.name, e)
+                raise
             # In case of any other error, keep as draft and rollback
             self.write({
                 'hka_status': 'draft',  # Keep as draft instead of error
@@ -281,6 +376,43 @@ class AccountMove(models.Model):
             self.env.cr.rollback()  # Rollback transaction to ensure draft state
             raise UserError(str(e))
 
+    def _prepare_hka_sent_vals(self, data):
+        """Invoice values for a document accepted by HKA, from the Enviar response data"""
+        vals = {
+            'hka_status': 'sent',
+            'hka_cufe': data.get('cufe', ''),
+            'hka_qr': data.get('qr', ''),
+            'hka_nro_protocolo_autorizacion': data.get('nroProtocoloAutorizacion', ''),
+        }
+        try:
+            fecha_str = data.get('fechaRecepcionDGI')
+            # Parse ISO 8601 format: 2025-11-13T15:46:53-05:00
+            if fecha_str and 'T' in fecha_str:
+                fecha_str = fecha_str.split('-05:00')[0].split('+')[0]  # Remove timezone
+                vals['hka_fecha_recepcion_dgi'] = datetime.strptime(fecha_str, '%Y-%m-%dT%H:%M:%S')
+        except Exception as e:
+            _logger.warning("Could not parse fechaRecepcionDGI for %s: %s - Continuing with other data", self.name, e)
+        return vals
+
+    def _apply_hka_journal_entry(self, entry):
+        """Write the HKA answer recorded in an hka.journal entry (record or dict) that was never applied"""
+        self.ensure_one()
+        vals = self._prepare_hka_sent_vals({
+            'cufe': entry['cufe'],
+            'qr': entry['qr'],
+            'nroProtocoloAutorizacion': entry['nro_protocolo_autorizacion'],
+            'fechaRecepcionDGI': entry['fecha_recepcion_dgi'],
+        })
+        vals.update({
+            'numero_documento_fiscal': entry['numero_documento_fiscal'],
+            'hka_message': _('Documento enviado - datos recuperados del diario de transacciones'),
+        })
+        self.write(vals)
+        try:
+            self._sync_cufe_to_pos_orders()
+        except AttributeError:
+            pass
+
     def button_register_hka_document(self):
         """Open wizard to register an existing HKA document without re-sending"""
         self.ensure_one()
@@ -413,7 +545,8 @@ class AccountMove(models.Model):
         """Prepare invoice data for HKA"""
         self.ensure_one()
         branch = self._get_hka_branch()
-            
+        compiled = self._compile_hka_lines()
+
         data = {
             'documento': {
                 'codigoSucursalEmisor': branch,
@@ -436,9 +569,9 @@ class AccountMove(models.Model):
                     'cliente': self._prepare_hka_client_data(),
                 },
                 'listaItems': {
-                    'item': self._prepare_hka_items_data()
+                    'item': compiled['items']
                 },
-                'totalesSubTotales': self._prepare_hka_totals_data()
+                'totalesSubTotales': self._prepare_hka_totals_data(compiled)
             }
         }
 
@@ -482,7 +615,7 @@ class AccountMove(models.Model):
         if self.hka_status not in ('draft', 'error'):
             return False
         config = self._get_hka_configuration()
-        return config.get_and_increment_next_number()
+        return config.get_and_increment_next_number(self._get_hka_pos_code())
 
     def _prepare_hka_client_data(self):
         """Prepare client data for HKA"""
@@ -562,14 +695,31 @@ class AccountMove(models.Model):
         return False
 
 
-    def _prepare_hka_items_data(self):
-        """Prepare invoice lines data for HKA"""
+    def _compile_hka_lines(self):
+        """Classify every invoice line once and accumulate the HKA totals
+
+        Returns a dict with the HKA 'items' (regular lines plus the rounding
+        line), the 'discount_lines', the 'rounding_amount', the 'nro_items'
+        count and the running totals, accumulated from the values already
+        rounded to the 2 decimals sent to HKA.
+        """
+        self.ensure_one()
         items = []
-        
-        # First process regular lines
+        discount_lines = []
+        lines_total = 0.0
+        regular_count = 0
+        total_todos_items = total_precio_neto = total_itbms = total_discounts = 0.0
+
         for line in self.invoice_line_ids:
-            # Skip lines with quantity 0 and discount lines (global, loyalty, coupon) for both invoices and credit notes
-            if not line.quantity or self._is_discount_line(line):
+            lines_total += line.price_total
+            if self._is_discount_line(line):
+                discount_lines.append(line)
+                total_discounts += line.price_total
+                continue
+            if line.quantity > 0:
+                regular_count += 1
+            # Skip lines with quantity 0
+            if not line.quantity:
                 continue
 
             # Format numeric values according to HKA specifications
@@ -584,7 +734,7 @@ class AccountMove(models.Model):
             if line.discount:
                 # Explicit discount: price_unit is before discount, calculate discount amount
                 discount_amount = (line.price_unit * line.discount) / 100
-                _logger.debug(f"Line {line.id} has explicit discount: {line.discount}% on {line.price_unit}")
+                _logger.debug("Line %s has explicit discount: %s%% on %s", line.id, line.discount, line.price_unit)
             elif line.product_id and line.product_id.lst_price > 0:
                 # Check for implicit pricelist discount
                 # Compare price_unit (actual selling price) with product list price
@@ -593,54 +743,68 @@ class AccountMove(models.Model):
                     # Pricelist applied a discount
                     original_price = list_price
                     discount_amount = list_price - line.price_unit
-                    implicit_discount_pct = (discount_amount / list_price) * 100
-                    _logger.debug(f"Line {line.id} has implicit pricelist discount: {implicit_discount_pct:.2f}% (list: {list_price}, actual: {line.price_unit})")
-            
-            precio_unitario = '{:.3f}'.format(original_price)
-            precio_unitario_descuento = '{:.3f}'.format(discount_amount)
+                    _logger.debug("Line %s has implicit pricelist discount: %.2f%% (list: %s, actual: %s)",
+                                  line.id, (discount_amount / list_price) * 100, list_price, line.price_unit)
 
             # Calculate price after discount per unit
             price_after_discount = original_price - discount_amount
 
             # Calculate total price for the line (quantity × price after discount)
             precio_item = price_after_discount * line.quantity
-            precio_item_str = '{:.2f}'.format(precio_item)
 
             # Calculate tax amount
             valor_itbms = line.price_total - line.price_subtotal
-            valor_itbms_str = '{:.2f}'.format(valor_itbms)
 
             # Calculate total value including taxes
             valor_total = precio_item + valor_itbms
-            valor_total_str = '{:.2f}'.format(valor_total)
+
+            # round(x, 2) is the float HKA reads back from the '{:.2f}' string
+            total_precio_neto += round(precio_item, 2)
+            total_itbms += round(valor_itbms, 2)
+            total_todos_items += round(valor_total, 2)
 
             items.append({
                 'descripcion': self._sanitize_hka_text(line.name),
                 'cantidad': cantidad,
-                'precioUnitario': precio_unitario,
-                'precioUnitarioDescuento': precio_unitario_descuento,
-                'precioItem': precio_item_str,
-                'valorTotal': valor_total_str,
+                'precioUnitario': '{:.3f}'.format(original_price),
+                'precioUnitarioDescuento': '{:.3f}'.format(discount_amount),
+                'precioItem': '{:.2f}'.format(precio_item),
+                'valorTotal': '{:.2f}'.format(valor_total),
                 'tasaITBMS': self._get_tax_rate(line),
-                'valorITBMS': valor_itbms_str,
+                'valorITBMS': '{:.2f}'.format(valor_itbms),
             })
 
         # Handle rounding
-        rounding_amount = self.amount_total - sum(l.price_total for l in self.invoice_line_ids)
-        if abs(rounding_amount) >= 0.01:  # Only process significant rounding
-            if rounding_amount > 0:  # Rounding up - add as a line item
-                items.append({
-                    'descripcion': 'Ajuste por Redondeo',
-                    'cantidad': '1.000',
-                    'precioUnitario': '{:.3f}'.format(abs(rounding_amount)),
-                    'precioUnitarioDescuento': '0.000',
-                    'precioItem': '{:.2f}'.format(abs(rounding_amount)),
-                    'valorTotal': '{:.2f}'.format(abs(rounding_amount)),
-                    'tasaITBMS': '00',  # No tax
-                    'valorITBMS': '0.00',
-                })
-        
-        return items
+        rounding_amount = self.amount_total - lines_total
+        if abs(rounding_amount) >= 0.01 and rounding_amount > 0:  # Rounding up - add as a line item
+            items.append({
+                'descripcion': 'Ajuste por Redondeo',
+                'cantidad': '1.000',
+                'precioUnitario': '{:.3f}'.format(abs(rounding_amount)),
+                'precioUnitarioDescuento': '0.000',
+                'precioItem': '{:.2f}'.format(abs(rounding_amount)),
+                'valorTotal': '{:.2f}'.format(abs(rounding_amount)),
+                'tasaITBMS': '00',  # No tax
+                'valorITBMS': '0.00',
+            })
+            total_precio_neto += round(abs(rounding_amount), 2)
+            total_todos_items += round(abs(rounding_amount), 2)
+
+        return {
+            'items': items,
+            'discount_lines': discount_lines,
+            'rounding_amount': rounding_amount,
+            # The rounding line only counts as an item above one cent
+            'nro_items': regular_count + (1 if rounding_amount > 0.01 else 0),
+            'total_todos_items': total_todos_items,
+            'total_precio_neto': total_precio_neto,
+            'total_itbms': total_itbms,
+            'total_discounts_with_tax': abs(total_discounts),
+        }
+
+    def _prepare_hka_items_data(self):
+        """Prepare invoice lines data for HKA"""
+        return self._compile_hka_lines()['items']
 
     def _sanitize_hka_text(self, text, max_length=50):
         """Sanitize text for HKA integration with length enforcement and ASCII normalization"""
@@ -706,48 +870,22 @@ class AccountMove(models.Model):
         
         return forma_pago, desc_forma_pago
 
-    def _prepare_hka_totals_data(self):
-        """Prepare totals data for HKA"""
-        # Calculate rounding amount
-        rounding_amount = self.amount_total - sum(l.price_total for l in self.invoice_line_ids)
-        has_rounding_line = rounding_amount > 0.01  # Track if we'll add a rounding line item
-        
-        # Prepare items data
-        items_data = self._prepare_hka_items_data()
-
-        # Calculate totalTodosItems as the sum of 'valorTotal' from all items
-        total_todos_items = sum(
-            float(item['valorTotal']) for item in items_data
-        )
-
-        # Calculate totalPrecioNeto as the sum of 'precioItem' from all items
-        total_precio_neto = sum(
-            float(item['precioItem']) for item in items_data
-        )
-
-        # Calculate totalITBMS as the sum of 'valorITBMS' from all items
-        total_itbms = sum(
-            float(item['valorITBMS']) for item in items_data
-        )
-
-        # Calculate all discounts (global, loyalty, coupon)
-        discount_lines = self.invoice_line_ids.filtered(
-            lambda l: self._is_discount_line(l)
-        )
-        # For totalDescuento field: use price_subtotal (without tax) to match listaDescBonificacion
-        total_discounts_subtotal = abs(sum(
-            line.price_subtotal
-            for line in discount_lines
-        ))
-        # For totalFactura calculation: use price_total (with tax) since totalTodosItems includes tax
-        total_discounts_with_tax = abs(sum(
-            line.price_total
-            for line in discount_lines
-        ))
+    def _prepare_hka_totals_data(self, compiled=None):
+        """Prepare totals data for HKA
+
+        :param compiled: result of _compile_hka_lines, compiled again when not given
+        """
+        if compiled is None:
+            compiled = self._compile_hka_lines()
+        rounding_amount = compiled['rounding_amount']
+        total_todos_items = compiled['total_todos_items']
+        total_precio_neto = compiled['total_precio_neto']
+        total_itbms = compiled['total_itbms']
+        discount_lines = compiled['discount_lines']
 
         # Handle rounding down as a discount
         # totalDescuento must include tax to match DGI's validation formula
-        total_discounts = total_discounts_with_tax
+        total_discounts = compiled['total_discounts_with_tax']
         if rounding_amount < -0.01:  # Only add negative rounding (rounding down)
             total_discounts += abs(rounding_amount)
 
@@ -756,9 +894,8 @@ class AccountMove(models.Model):
         # Must use this formula even if it differs slightly from amount_total due to rounding
         total_factura = total_todos_items - total_discounts
 
-        # Calculate number of items (including rounding line if present)
-        regular_items = len(self.invoice_line_ids.filtered(lambda l: l.quantity > 0 and not self._is_discount_line(l)))
-        total_items = regular_items + (1 if has_rounding_line else 0)
+        # Number of items (including rounding line if present)
+        total_items = compiled['nro_items']
 
         # Prepare payment methods data
         payment_methods = []
@@ -930,7 +1067,8 @@ class AccountMove(models.Model):
         
         # Only get a new number if we don't already have one
         if not self.numero_documento_fiscal:
-            fiscal_number = self._get_next_fiscal_number()
+            with tracing.span(self.env.cr.dbname, 'fiscal_number'):
+                fiscal_number = self._get_next_fiscal_number()
             if not fiscal_number:
                 raise UserError(_('No se pudo obtener el próximo número fiscal.'))
             self.numero_documento_fiscal = fiscal_number
@@ -944,6 +1082,75 @@ class AccountMove(models.Model):
             return False
         return self.hka_pdf
 
+    def _render_hka_qr_image(self):
+        """Store the QR image of hka_qr, or clear it"""
+        for move in self:
+            image = False
+            if move.hka_qr:
+                try:
+                    image = base64.b64encode(self.env['ir.actions.report'].barcode(
+                        'QR', move.hka_qr, width=QR_IMAGE_SIZE, height=QR_IMAGE_SIZE, quiet=False))
+                except Exception as e:
+                    _logger.warning('Could not generate the HKA QR image of %s: %s', move.name, e)
+            super(AccountMove, move).write({'hka_qr_image': image})
+
+    def _get_hka_qr_attachment(self):
+        """Attachment holding the QR image, generated now if missing"""
+        self.ensure_one()
+        domain = [
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'hka_qr_image'),
+            ('res_id', '=', self.id),
+        ]
+        Attachment = self.env['ir.attachment'].sudo()
+        attachment = Attachment.search(domain, limit=1)
+        if not attachment and self.hka_qr:
+            self.sudo()._render_hka_qr_image()
+            attachment = Attachment.search(domain, limit=1)
+        return attachment
+
+    def _notify_hka_pos(self):
+        """Push the HKA data of POS invoices to their sessions when the transaction commits"""
+        moves = self.filtered('pos_order_ids')
+        if not moves:
+            return
+        pending = self.env.cr.precommit.data.setdefault('isfehka.hka_pos_notify', set())
+        if not pending:
+            self.env.cr.precommit.add(self._send_hka_pos_notifications)
+        pending.update(moves.ids)
+
+    def _send_hka_pos_notifications(self):
+        # Once per invoice and transaction, with the final values
+        move_ids = self.env.cr.precommit.data.pop('isfehka.hka_pos_notify', set())
+        moves = self.browse(move_ids).exists().sudo()
+        for order in moves.pos_order_ids.filtered('session_id'):
+            try:
+                with self.env.cr.savepoint():
+                    info = order._get_hka_receipts_info([order.pos_reference])[0]
+                    self.env['bus.bus']._sendone(order.session_id._get_hka_bus_channel(),
+                                                 'isfehka/hka_document', info)
+            except Exception as e:
+                # Runs while committing: a failed push must never lose the invoice data
+                _logger.warning('Could not notify the POS of %s: %s', order.pos_reference, e)
+
+    def _get_hka_receipt_attachment(self, profile=None):
+        """Attachment holding the receipt image for profile, empty until it is rendered
+
+        Only invoices of the point of sale have receipt images; they are
+        rendered in the background by the pos.hkapdf cron.
+        """
+        self.ensure_one()
+        profile = profile or self._get_hka_receipt_profile()
+        if profile not in RECEIPT_PROFILES:
+            raise UserError(_('Perfil de recibo desconocido: %s') % profile)
+        return self.env['pos.hkapdf'].sudo()._get_for_move(self.sudo(), profile)._get_image_attachment()
+
+    def _get_hka_receipt_profile(self):
+        """Receipt profile of the point of sale that issued the invoice"""
+        self.ensure_one()
+        config = self.sudo().pos_order_ids[:1].config_id
+        return config.hka_receipt_profile if config else DEFAULT_RECEIPT_PROFILE
+
     def _validate_hka_data(self):
         """Validate required data before sending to HKA"""
         self.ensure_one()
@@ -1028,37 +1235,187 @@ class AccountMove(models.Model):
     def _needs_documents(self):
         """Check if the invoice needs PDF or XML documents"""
         self.ensure_one()
-        return (self.hka_status == 'sent' and 
-                (not self.hka_pdf or not self.hka_xml))
+        return self.hka_document_state in ('pending', 'partial')
+
+    def _get_hka_documents_presence(self):
+        """{move_id: (has_pdf, has_xml)} from the attachments, without reading the files"""
+        presence = {move_id: (False, False) for move_id in self.ids}
+        if not presence:
+            return presence
+        self.flush_recordset(['hka_pdf', 'hka_xml'])
+        self.env.cr.execute("""
+            SELECT res_id, bool_or(res_field = 'hka_pdf'), bool_or(res_field = 'hka_xml')
+              FROM ir_attachment
+             WHERE res_model = 'account.move'
+               AND res_field IN ('hka_pdf', 'hka_xml')
+               AND res_id IN %s
+          GROUP BY res_id
+        """, [tuple(self.ids)])
+        for move_id, has_pdf, has_xml in self.env.cr.fetchall():
+            presence[move_id] = (has_pdf, has_xml)
+        return presence
+
+    def _update_hka_document_state(self):
+        """Recompute hka_document_state after HKA status or documents changed"""
+        presence = self._get_hka_documents_presence()
+        fetch_at = fields.Datetime.now() + timedelta(seconds=DOCUMENT_FETCH_DELAY_SECONDS)
+        to_fetch = False
+        for move in self:
+            if move.hka_status != 'sent':
+                state = False
+            else:
+                has_pdf, has_xml = presence.get(move.id, (False, False))
+                state = 'complete' if has_pdf and has_xml else 'partial' if has_pdf or has_xml else 'pending'
+            if state == move.hka_document_state:
+                continue
+            vals = {'hka_document_state': state}
+            if state in ('pending', False) or move.hka_document_state in ('failed', False):
+                # New document to fetch: start over with the retries
+                vals.update({'hka_document_attempts': 0, 'hka_document_next_attempt': False})
+                if state in ('pending', 'partial'):
+                    # Fetch a few seconds later, once the sending transaction has committed
+                    vals['hka_document_next_attempt'] = fetch_at
+                    to_fetch = True
+            move.write(vals)
+        if to_fetch:
+            self._trigger_document_retrieval(fetch_at)
+
+    @api.model
+    def _trigger_document_retrieval(self, at=None):
+        cron = self.env.ref('isfehka.ir_cron_retrieve_hka_documents', raise_if_not_found=False)
+        if cron:
+            cron._trigger(at=at)
+
+    def _schedule_hka_document_retry(self):
+        """Count a failed download attempt and back off exponentially"""
+        for move in self:
+            attempts = move.hka_document_attempts + 1
+            vals = {
+                'hka_document_attempts': attempts,
+                'hka_document_next_attempt': fields.Datetime.now() + timedelta(
+                    minutes=min(2 ** attempts, DOCUMENT_RETRY_MAX_MINUTES)),
+            }
+            if attempts >= DOCUMENT_MAX_ATTEMPTS:
+                vals['hka_document_state'] = 'failed'
+                _logger.warning('[HKA CRON] Giving up on documents for invoice %s after %s attempts',
+                                move.name, attempts)
+            else:
+                # Wake the cron for the retry rather than waiting for its next periodic run
+                self._trigger_document_retrieval(vals['hka_document_next_attempt'])
+            move.write(vals)
+
+    @api.model
+    def _get_missing_documents_domain(self):
+        """Sent invoices still waiting for their PDF or XML"""
+        return [('hka_document_state', 'in', ('pending', 'partial'))]
+
+    @api.model
+    def _count_waiting_hka_documents(self):
+        return self.search_count(self._get_missing_documents_domain())
 
     @api.model
     def _cron_retrieve_missing_documents(self):
-        """Cron job to retrieve missing PDF/XML documents for invoices sent via POS"""
-        # Find invoices sent in the last 7 days that are missing documents
-        date_limit = fields.Datetime.now() - timedelta(days=7)
-        invoices = self.search([
-            ('hka_status', '=', 'sent'),
-            ('write_date', '>=', date_limit),
+        """Cron job to retrieve missing PDF/XML documents for invoices sent via POS
+
+        Downloads run in a bounded thread pool, one cursor per invoice. Each
+        batch is sized to what the workers are expected to finish within the
+        remaining time budget, based on the speed of the previous batch. When
+        the budget is spent and invoices are still due, the cron is triggered
+        again right away instead of waiting for its next interval.
+        """
+        started = time.monotonic()
+        budget = self._get_document_time_budget()
+        concurrency = self._get_document_concurrency()
+        seconds_per_round = DOCUMENT_SECONDS_ESTIMATE
+        processed = []
+        hka_unavailable = False
+
+        while True:
+            remaining = budget - (time.monotonic() - started)
+            # Only start a batch the workers are expected to finish within the budget
+            size = min(DOCUMENT_BATCH_MAX, concurrency * int(remaining / seconds_per_round))
+            if size < 1:
+                break
+            # An invoice whose worker crashed stays due; leave it for the next run
+            invoices = self.search(self._get_due_documents_domain() + [('id', 'not in', processed)],
+                                   order='hka_document_next_attempt, id', limit=size)
+            if not invoices:
+                break
+
+            batch_started = time.monotonic()
+            results = run_in_new_cursors(self.env, self._retrieve_documents_in_env, invoices.ids, concurrency)
+            rounds = -(-len(invoices) // concurrency)
+            seconds_per_round = max((time.monotonic() - batch_started) / rounds, 0.1)
+            processed += invoices.ids
+            # See the workers' changes in the next search
+            self.env.cr.commit()
+            self.env.invalidate_all()
+
+            if all(result == 'deferred' for _move_id, result, _error in results):
+                hka_unavailable = True
+                break
+
+        if processed:
+            _logger.info('[HKA CRON] Processed %d invoices with missing documents in %.1fs',
+                         len(processed), time.monotonic() - started)
+        due = self._get_due_documents_domain() + [('id', 'not in', processed)]
+        if not hka_unavailable and self.search_count(due, limit=1):
+            self._trigger_document_retrieval()
+
+    @api.model
+    def _get_due_documents_domain(self):
+        return self._get_missing_documents_domain() + [
             '|',
-            ('hka_pdf', '=', False),
-            ('hka_xml', '=', False),
-        ], limit=50)  # Process max 50 invoices per run
-        
-        if not invoices:
-            return
-            
-        _logger.info(f'[HKA CRON] Found {len(invoices)} invoices with missing documents')
-        
-        for invoice in invoices:
-            try:
-                if invoice._needs_documents():
-                    _logger.info(f'[HKA CRON] Retrieving documents for invoice {invoice.name}')
-                    invoice.action_get_documents()
-                    self.env.cr.commit()  # Commit after each invoice to avoid losing work
-            except Exception as e:
-                _logger.warning(f'[HKA CRON] Failed to retrieve documents for {invoice.name}: {e}')
-                # Continue with next invoice
-                continue
+            ('hka_document_next_attempt', '=', False),
+            ('hka_document_next_attempt', '<=', fields.Datetime.now()),
+        ]
+
+    @api.model
+    def _get_document_concurrency(self):
+        value = self.env['ir.config_parameter'].sudo().get_param('isfehka.document_concurrency')
+        try:
+            return max(1, int(value or DOCUMENT_CONCURRENCY))
+        except ValueError:
+            return DOCUMENT_CONCURRENCY
+
+    @api.model
+    def _get_document_time_budget(self):
+        """Seconds a run may spend downloading, within the cron's real time limit"""
+        value = self.env['ir.config_parameter'].sudo().get_param('isfehka.document_time_budget')
+        try:
+            budget = float(value or DOCUMENT_TIME_BUDGET)
+        except ValueError:
+            budget = DOCUMENT_TIME_BUDGET
+        # limit_time_real_cron: -1 (or unset) falls back to limit_time_real, 0 is no limit
+        limit = odoo_config.get('limit_time_real_cron')
+        if limit is None or limit < 0:
+            limit = odoo_config.get('limit_time_real')
+        if limit and limit > 0:
+            # Leave room for the batch in flight and the final commit
+            budget = min(budget, limit * 0.6)
+        return budget
+
+    @api.model
+    def _retrieve_documents_in_env(self, env, move_id):
+        """Download one invoice's documents in its own cursor
+
+        Returns 'done', 'retry', or 'deferred' when HKA's circuit breaker is
+        open; a deferred invoice does not use up an attempt.
+        """
+        move = env['account.move'].browse(move_id)
+        if not move._needs_documents():
+            return 'done'
+        if not env['hka.service'].with_company(move.company_id)._breaker_allows():
+            move.write({'hka_document_next_attempt': fields.Datetime.now() + timedelta(seconds=BREAKER_OPEN_SECONDS)})
+            return 'deferred'
+        try:
+            move.action_get_documents()
+        except Exception as e:
+            _logger.warning('[HKA CRON] Failed to retrieve documents for %s: %s', move.name, e)
+        if move._needs_documents():
+            move._schedule_hka_document_retry()
+            return 'retry'
+        return 'done'
 
     def action_get_documents(self):
         """Retrieve PDF and XML documents from HKA"""
@@ -1079,8 +1436,7 @@ class AccountMove(models.Model):
             }
 
             # Get PDF and XML
-            pdf_data = hka_service.get_pdf_document(datos_documento)
-            xml_data = hka_service.get_xml_document(datos_documento)
+            xml_data, pdf_data = hka_service.get_documents(datos_documento)
 
             # Update the record with any documents received
             update_vals = {}
@@ -0,0 +1,132 @@
+import logging
+from datetime import timedelta
+
+from odoo import models, fields, api, _
+
+_logger = logging.getLogger(__name__)
+
+# Pending entries younger than this may still be committed by the sending transaction
+RECOVERY_DELAY_MINUTES = 10
+RECOVERY_BATCH = 200
+
+
+class HkaJournal(models.Model):
+    _name = 'hka.journal'
+    _description = 'HKA Transaction Journal'
+    _order = 'date desc, id desc'
+    _log_access = False
+
+    # Rows are inserted with SQL on their own cursor by _record
+    date = fields.Datetime(string='Fecha', required=True, index=True)
+    # Not a many2one: the invoice may be rolled back after HKA accepted it
+    move_id = fields.Integer(string='ID de Factura', index=True)
+    company_id = fields.Many2one('res.company', string='Compañía', ondelete='cascade')
+    numero_documento_fiscal = fields.Char(string='Número Fiscal')
+    cufe = fields.Char(string='CUFE')
+    qr = fields.Char(string='QR')
+    nro_protocolo_autorizacion = fields.Char(string='Protocolo de Autorización')
+    fecha_recepcion_dgi = fields.Char(string='Fecha Recepción DGI')
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('applied', 'Aplicado'),
+        ('orphan', 'Sin Factura'),
+        ('conflict', 'Conflicto'),
+    ], string='Estado', required=True, default='pending', index=True)
+    date_applied = fields.Datetime(string='Fecha de Aplicación')
+    note = fields.Char(string='Nota')
+
+    @api.model
+    def _record(self, move, data):
+        """Durably append HKA's acceptance of move, independently of the caller's transaction
+
+        One INSERT on a separate cursor: if the sending transaction never
+        commits, _cron_recover_journal applies the entry to the invoice.
+        """
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                INSERT INTO hka_journal (date, move_id, company_id, numero_documento_fiscal, cufe, qr,
+                                         nro_protocolo_autorizacion, fecha_recepcion_dgi, state)
+                VALUES (now() AT TIME ZONE 'UTC', %s, %s, %s, %s, %s, %s, %s, 'pending')
+                RETURNING id
+            """, [
+                move.id, move.company_id.id, move.numero_documento_fiscal,
+                data.get('cufe') or '', data.get('qr') or '',
+                data.get('nroProtocoloAutorizacion') or '', data.get('fechaRecepcionDGI') or '',
+            ])
+            return cr.fetchone()[0]
+
+    @api.model
+    def _find_pending(self, move):
+        """Latest unapplied acceptance of move, as a dict, or None
+
+        Read on a fresh cursor, so entries committed after the caller's
+        transaction started are seen too.
+        """
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                SELECT id, numero_documento_fiscal, cufe, qr, nro_protocolo_autorizacion, fecha_recepcion_dgi
+                  FROM hka_journal
+                 WHERE move_id = %s AND state = 'pending' AND cufe IS DISTINCT FROM %s
+              ORDER BY date DESC, id DESC
+                 LIMIT 1
+            """, [move.id, move.hka_cufe or None])
+            return cr.dictfetchone()
+
+    @api.model
+    def _mark_applied_on_commit(self, entry_id):
+        """Mark an entry applied once the transaction that wrote it to the invoice commits
+
+        The entry was inserted after that transaction's snapshot, so it cannot
+        update it itself; if it never commits, the entry stays pending for
+        the next send or _cron_recover_journal.
+        """
+        entry_ids = self.env.cr.postcommit.data.setdefault('isfehka.hka_journal_applied', set())
+        if not entry_ids:
+            self.env.cr.postcommit.add(self._mark_applied)
+        entry_ids.add(entry_id)
+
+    def _mark_applied(self):
+        entry_ids = self.env.cr.postcommit.data.pop('isfehka.hka_journal_applied', set())
+        if not entry_ids:
+            return
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute("""
+                    UPDATE hka_journal
+                       SET state = 'applied', date_applied = now() AT TIME ZONE 'UTC'
+                     WHERE id IN %s AND state = 'pending'
+                """, [tuple(entry_ids)])
+        except Exception as e:
+            # The recovery cron marks them later, after checking the invoice
+            _logger.warning('Could not mark HKA journal entries %s applied: %s', sorted(entry_ids), e)
+
+    @api.model
+    def _cron_recover_journal(self):
+        """Apply pending journal entries whose invoice was never updated"""
+        entries = self.search([
+            ('state', '=', 'pending'),
+            ('date', '<', fields.Datetime.now() - timedelta(minutes=RECOVERY_DELAY_MINUTES)),
+        ], order='date, id', limit=RECOVERY_BATCH)
+        for entry in entries:
+            move = self.env['account.move'].browse(entry.move_id).exists()
+            if not move:
+                _logger.critical('HKA accepted fiscal number %s (CUFE %s) but invoice %s no longer exists',
+                                 entry.numero_documento_fiscal, entry.cufe, entry.move_id)
+                entry.write({'state': 'orphan', 'note': _('La factura ya no existe; revise el documento en HKA.')})
+                continue
+            if move.hka_cufe and move.hka_cufe != entry.cufe:
+                _logger.critical('HKA journal entry %s (CUFE %s) conflicts with CUFE %s of %s',
+                                 entry.id, entry.cufe, move.hka_cufe, move.name)
+                entry.write({'state': 'conflict', 'note': _('La factura tiene otro CUFE: %s') % move.hka_cufe})
+                continue
+            if not move.hka_cufe:
+                try:
+                    with self.env.cr.savepoint():
+                        move._apply_hka_journal_entry(entry)
+                except Exception as e:
+                    _logger.error('Could not apply HKA journal entry %s to %s: %s', entry.id, move.name, e)
+                    entry.write({'note': str(e)[:250]})
+                    continue
+                _logger.warning('Recovered HKA data for %s from journal entry %s (CUFE %s)',
+                                move.name, entry.id, entry.cufe)
+            entry.write({'state': 'applied', 'date_applied': fields.Datetime.now()})
@@ -0,0 +1,71 @@
+from odoo import models, fields, api
+import time
+
+from ..tools import metrics
+
+GAUGE_TTL = 60  # seconds
+
+# {dbname: (timestamp, [(name, labels, value)])}
+_GAUGE_CACHE = {}
+
+
+class HkaMetric(models.Model):
+    _name = 'hka.metric'
+    _description = 'HKA Metric Counter'
+    _log_access = False
+
+    # Rows are upserted with SQL by tools/metrics.py
+    name = fields.Char(required=True)
+    labels = fields.Char(required=True, default='')
+    value = fields.Float(default=0.0)
+
+    _sql_constraints = [
+        ('name_labels_uniq', 'unique(name, labels)', 'A metric series must be unique.'),
+    ]
+
+    @api.model
+    def _get_gauges(self):
+        """Gauges derived from invoice data, recomputed at most every GAUGE_TTL seconds"""
+        dbname = self.env.cr.dbname
+        cached = _GAUGE_CACHE.get(dbname)
+        if cached and time.monotonic() - cached[0] < GAUGE_TTL:
+            return cached[1]
+
+        gauges = []
+        self.env.cr.execute("""
+            SELECT hka_status, count(*)
+              FROM account_move
+             WHERE move_type IN ('out_invoice', 'out_refund')
+               AND hka_status IS NOT NULL
+             GROUP BY hka_status
+        """)
+        for status, count in self.env.cr.fetchall():
+            gauges.append(('hka_invoices', metrics.format_labels({'status': status}), count))
+        gauges.append(('hka_invoices_waiting_documents', '',
+                       self.env['account.move'].sudo()._count_waiting_hka_documents()))
+        _GAUGE_CACHE[dbname] = (time.monotonic(), gauges)
+        return gauges
+
+    @api.model
+    def _render_prometheus(self):
+        """Render every series in the Prometheus text exposition format"""
+        metrics.flush(self.env.cr.dbname)
+        self.env.cr.execute("SELECT name, labels, value FROM hka_metric ORDER BY name, labels")
+        series = self.env.cr.fetchall() + self._get_gauges()
+
+        lines = []
+        declared = set()
+        for name, labels, value in series:
+            family = name
+            for suffix in ('_bucket', '_sum', '_count'):
+                base = name[:-len(suffix)]
+                if name.endswith(suffix) and metrics.METRICS.get(base, ('',))[0] == 'histogram':
+                    family = base
+                    break
+            if family not in declared:
+                declared.add(family)
+                metric_type, help_text = metrics.METRICS.get(family, ('untyped', ''))
+                lines.append('# HELP %s %s' % (family, help_text))
+                lines.append('# TYPE %s %s' % (family, metric_type))
+            lines.append('%s%s %s' % (name, '{%s}' % labels if labels else '', repr(float(value))))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,188 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from odoo import models, fields, api, _, SUPERUSER_ID
+from odoo.exceptions import UserError
+
+from ..tools import metrics
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_RANGE_TTL_HOURS = 24
+# Fiscal numbers have 10 digits; the counter must never pass this
+MAX_FISCAL_NUMBER = 9999999999
+
+# Fiscal number blocks reserved by this worker:
+# {(dbname, configuration_id, pos_code): [next_number, last_number, range_id, reserved_at]}
+_BLOCKS = {}
+# One lock per key, so a reservation only blocks threads numbering the same point
+_BLOCK_LOCKS = {}
+_BLOCK_LOCKS_LOCK = threading.Lock()
+
+
+def _holder():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def raise_no_fiscal_number(cr, config_id):
+    """Raise why the counter UPDATE of config_id matched no row: invalid or exhausted"""
+    cr.execute("SELECT next_number ~ '^[0-9]+$' FROM isfehka_configuration WHERE id = %s", [config_id])
+    row = cr.fetchone()
+    if row and row[0]:
+        raise UserError(_('Se agotaron los números fiscales de la configuración de HKA (máximo %s).')
+                        % MAX_FISCAL_NUMBER)
+    raise UserError(_('Configure un próximo número fiscal válido en la configuración de HKA.'))
+
+
+class HkaNumberRange(models.Model):
+    _name = 'hka.number.range'
+    _description = 'HKA Fiscal Number Range'
+    _order = 'id desc'
+
+    configuration_id = fields.Many2one('isfehka.configuration', string='Configuración', required=True,
+                                       ondelete='cascade', index=True)
+    pos_code = fields.Char(string='Punto de Facturación')
+    holder = fields.Char(string='Proceso', help='Servidor y proceso que reservó el rango.')
+    first_number = fields.Char(string='Desde', required=True)
+    last_number = fields.Char(string='Hasta', required=True)
+    size = fields.Integer(string='Tamaño')
+    state = fields.Selection([
+        ('active', 'En Uso'),
+        ('exhausted', 'Agotado'),
+        ('expired', 'Vencido'),
+    ], string='Estado', default='active', required=True, index=True)
+    date_released = fields.Datetime(string='Fecha de Liberación')
+    used_count = fields.Integer(string='Usados', compute='_compute_usage')
+    unused_count = fields.Integer(string='No Usados', compute='_compute_usage')
+    unused_numbers = fields.Text(string='Números No Usados', compute='_compute_usage')
+
+    def _get_used_numbers(self):
+        """Fiscal numbers of this range already assigned to an invoice
+
+        A range scan of the numero_documento_fiscal index; only read by the
+        form view, the list view does not show the usage.
+        """
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT DISTINCT m.numero_documento_fiscal
+              FROM account_move m
+              JOIN res_company c ON c.id = m.company_id
+             WHERE c.hka_configuration_id = %s
+               AND m.numero_documento_fiscal BETWEEN %s AND %s
+        """, [self.configuration_id.id, self.first_number, self.last_number])
+        return {int(row[0]) for row in self.env.cr.fetchall() if row[0].isdigit()}
+
+    def _compute_usage(self):
+        for rng in self:
+            if not rng.id:
+                rng.used_count = rng.unused_count = 0
+                rng.unused_numbers = False
+                continue
+            used = rng._get_used_numbers()
+            rng.used_count = len(used)
+            rng.unused_count = rng.size - len(used)
+            if rng.state == 'active':
+                # Numbers still in the worker's memory are not "unused" yet
+                rng.unused_numbers = False
+                continue
+            gaps = []
+            start = None
+            for number in range(int(rng.first_number), int(rng.last_number) + 2):
+                if number <= int(rng.last_number) and number not in used:
+                    start = number if start is None else start
+                elif start is not None:
+                    end = number - 1
+                    gaps.append(str(start).zfill(10) if start == end
+                                else '%s - %s' % (str(start).zfill(10), str(end).zfill(10)))
+                    start = None
+            rng.unused_numbers = '\n'.join(gaps)
+
+    @api.model
+    def _next_number(self, config, pos_code, block_size):
+        """Pop the next fiscal number from this worker's block for config and pos_code
+
+        The database is only touched when the block is used up or expired.
+        """
+        key = (self.env.cr.dbname, config.id, pos_code or '')
+        ttl = float(self.env['ir.config_parameter'].sudo().get_param(
+            'isfehka.number_range_ttl_hours', DEFAULT_RANGE_TTL_HOURS)) * 3600
+        with _BLOCK_LOCKS_LOCK:
+            block_lock = _BLOCK_LOCKS.setdefault(key, threading.Lock())
+        with block_lock:
+            block = _BLOCKS.get(key)
+            if block and block[0] <= block[1] and time.time() - block[3] < ttl:
+                number = block[0]
+                block[0] += 1
+                return str(number).zfill(10)
+
+            # The block in memory is released as exhausted, or expired if numbers were left
+            previous = (block[2], 'exhausted' if block[0] > block[1] else 'expired') if block else None
+            start = time.perf_counter()
+            try:
+                first, last, range_id = self._reserve(config, pos_code, block_size, previous)
+            except UserError:
+                raise
+            except Exception:
+                metrics.inc(self.env.cr.dbname, 'hka_fiscal_number_failures_total', {'reason': 'reservation'})
+                raise
+            metrics.observe(self.env.cr.dbname, 'hka_fiscal_number_wait_seconds', time.perf_counter() - start)
+            _BLOCKS[key] = [first + 1, last, range_id, time.time()]
+        config.invalidate_recordset(['next_number'])
+        return str(first).zfill(10)
+
+    @api.model
+    def _reserve(self, config, pos_code, block_size, previous=None):
+        """Reserve block_size numbers from the configuration counter
+
+        Runs in its own short transaction so the configuration row is only
+        locked for the duration of the UPDATE, not for the whole invoice.
+        previous is an optional (range_id, state) to release in the same
+        transaction. Returns (first, last, range_id).
+        """
+        with self.env.registry.cursor() as cr:
+            # Never wait forever, e.g. on a lock held by the caller's own transaction
+            cr.execute("SET LOCAL lock_timeout = '10s'")
+            cr.execute("""
+                UPDATE isfehka_configuration
+                   SET next_number = lpad((next_number::bigint + %s)::text, 10, '0')
+                 WHERE id = %s AND next_number ~ '^[0-9]+$'
+                   AND next_number::bigint + %s <= %s
+             RETURNING next_number::bigint - %s
+            """, [block_size, config.id, block_size, MAX_FISCAL_NUMBER, block_size])
+            row = cr.fetchone()
+            if not row:
+                raise_no_fiscal_number(cr, config.id)
+            first = row[0]
+            last = first + block_size - 1
+
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            if previous:
+                env['hka.number.range'].browse(previous[0]).exists().filtered(lambda r: r.state == 'active').write({
+                    'state': previous[1],
+                    'date_released': fields.Datetime.now(),
+                })
+            rng = env['hka.number.range'].create({
+                'configuration_id': config.id,
+                'pos_code': pos_code,
+                'holder': _holder(),
+                'first_number': str(first).zfill(10),
+                'last_number': str(last).zfill(10),
+                'size': block_size,
+            })
+            _logger.info('Reserved fiscal numbers %s-%s for %s (%s)', rng.first_number, rng.last_number,
+                         pos_code or config.name, rng.holder)
+            return first, last, rng.id
+
+    @api.autovacuum
+    def _gc_expired_ranges(self):
+        """Release active ranges older than the TTL; workers stop using them too"""
+        hours = float(self.env['ir.config_parameter'].sudo().get_param(
+            'isfehka.number_range_ttl_hours', DEFAULT_RANGE_TTL_HOURS))
+        self.search([
+            ('state', '=', 'active'),
+            ('create_date', '<', fields.Datetime.now() - timedelta(hours=hours)),
+        ]).write({'state': 'expired', 'date_released': fields.Datetime.now()})
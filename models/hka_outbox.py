@@ -0,0 +1,208 @@
+from odoo import models, fields, api, _
+from datetime import timedelta
+import logging
+
+from ..tools.pool import run_in_new_cursors
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+MAX_ATTEMPTS = 5
+# Items stuck in 'processing' longer than this are assumed lost (worker killed)
+PROCESSING_TIMEOUT_MINUTES = 15
+
+
+class HkaOutbox(models.Model):
+    _name = 'hka.outbox'
+    _description = 'HKA Outbox'
+    _order = 'id desc'
+    _rec_name = 'move_id'
+
+    move_id = fields.Many2one(
+        'account.move',
+        string='Factura',
+        required=True,
+        index=True,
+        ondelete='cascade'
+    )
+    company_id = fields.Many2one(
+        related='move_id.company_id',
+        store=True
+    )
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('processing', 'Procesando'),
+        ('done', 'Enviado'),
+        ('error', 'Error'),
+        ('cancelled', 'Cancelado'),
+    ], string='Estado', default='pending', required=True, index=True)
+    attempts = fields.Integer(string='Intentos', default=0)
+    next_attempt = fields.Datetime(string='Próximo Intento')
+    date_started = fields.Datetime(string='Inicio de Procesamiento')
+    date_done = fields.Datetime(string='Fecha de Envío')
+    last_error = fields.Text(string='Último Error')
+    user_id = fields.Many2one('res.users', string='Solicitado por',
+                              help='Recibe una notificación cuando la factura se envía o falla.')
+
+    @api.model
+    def _enqueue(self, moves, notify_user=None):
+        """Queue invoices to be sent to HKA by the outbox workers
+
+        notify_user, if given, is told over the bus how each invoice went.
+        """
+        queued = self.search([
+            ('move_id', 'in', moves.ids),
+            ('state', 'in', ('pending', 'processing')),
+        ]).move_id
+        to_queue = moves - queued
+        items = self.create([{
+            'move_id': move.id,
+            'user_id': notify_user.id if notify_user else False,
+        } for move in to_queue])
+        if items:
+            self._trigger_processing()
+        return items
+
+    @api.model
+    def _trigger_processing(self, at=None):
+        cron = self.env.ref('isfehka.ir_cron_process_hka_outbox', raise_if_not_found=False)
+        if cron:
+            cron._trigger(at=at)
+
+    @api.model
+    def _get_concurrency(self):
+        value = self.env['ir.config_parameter'].sudo().get_param('isfehka.outbox_concurrency')
+        try:
+            return max(1, int(value or DEFAULT_CONCURRENCY))
+        except ValueError:
+            return DEFAULT_CONCURRENCY
+
+    @api.model
+    def _claim(self, limit):
+        """Atomically move up to ``limit`` due items to 'processing'
+
+        SKIP LOCKED lets several drainers run at the same time without
+        claiming the same item twice. Items left in 'processing' by a dead
+        worker are claimed again after PROCESSING_TIMEOUT_MINUTES, which gives
+        at-least-once delivery; _process_item() skips invoices already sent.
+        """
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE hka_outbox
+               SET state = 'processing',
+                   date_started = (now() at time zone 'UTC'),
+                   attempts = attempts + 1
+             WHERE id IN (
+                SELECT id FROM hka_outbox
+                 WHERE (state = 'pending'
+                        AND (next_attempt IS NULL OR next_attempt <= (now() at time zone 'UTC')))
+                    OR (state = 'processing'
+                        AND date_started < (now() at time zone 'UTC') - interval '1 minute' * %s)
+                 ORDER BY id
+                 LIMIT %s
+                 FOR UPDATE SKIP LOCKED)
+         RETURNING id
+        """, [PROCESSING_TIMEOUT_MINUTES, limit])
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        self.invalidate_model(['state', 'date_started', 'attempts'])
+        return ids
+
+    @api.model
+    def _cron_process_outbox(self):
+        """Drain the outbox with a bounded number of parallel senders"""
+        concurrency = self._get_concurrency()
+        item_ids = self._claim(concurrency * 5)
+        if not item_ids:
+            return
+        # Make the claim visible before the workers start
+        self.env.cr.commit()
+        _logger.info('[HKA OUTBOX] Processing %d items with %d workers', len(item_ids), concurrency)
+        run_in_new_cursors(self.env, self._process_item_in_env, item_ids, concurrency)
+        # The workers committed on their own cursors
+        self.invalidate_model()
+        self.browse(item_ids)._notify_batch()
+
+        if self.search_count([('state', '=', 'pending')], limit=1):
+            self._trigger_processing()
+
+    @api.model
+    def _process_item_in_env(self, env, item_id):
+        env['hka.outbox'].browse(item_id)._process_item()
+
+    def _process_item(self):
+        self.ensure_one()
+        move = self.move_id
+        if move.hka_status == 'sent':
+            self.write({'state': 'done', 'date_done': fields.Datetime.now(), 'last_error': False})
+            return
+        if move.state != 'posted':
+            self.write({'state': 'cancelled', 'last_error': _('La factura ya no está confirmada.')})
+            return
+
+        try:
+            move._send_to_hka()
+        except Exception as e:
+            # The transaction may be aborted or hold a half-applied send (a failure
+            # after HKA accepted is re-raised as is): drop it, the claim is committed
+            self.env.cr.rollback()
+            error = str(e)
+            _logger.warning('[HKA OUTBOX] Sending %s failed (attempt %d): %s',
+                            move.name or move.id, self.attempts, error)
+            vals = {'last_error': error}
+            if self.attempts >= MAX_ATTEMPTS:
+                vals['state'] = 'error'
+                # An accepted invoice is applied from its journal entry, never marked in error
+                if not self.env['hka.journal'].sudo()._find_pending(move):
+                    move.write({'hka_status': 'error', 'hka_message': error})
+            else:
+                vals.update({
+                    'state': 'pending',
+                    'next_attempt': fields.Datetime.now() + timedelta(minutes=2 ** self.attempts),
+                })
+            self.write(vals)
+            self._notify_user(error)
+            return
+
+        self.write({'state': 'done', 'date_done': fields.Datetime.now(), 'last_error': False})
+
+    def _notify_user(self, error):
+        """Tell the user who queued the invoice that the attempt failed"""
+        if not self.user_id:
+            return
+        if self.state == 'pending':
+            message = _('%s: %s (se reintentará)') % (self.move_id.name, error)
+        else:
+            message = _('%s: %s') % (self.move_id.name, error)
+        self.env['bus.bus']._sendone(self.user_id.partner_id, 'simple_notification', {
+            'title': _('Envío a HKA'),
+            'message': message,
+            'type': 'danger',
+            'sticky': self.state == 'error',
+        })
+
+    def _notify_batch(self):
+        """One summary per user of a processed batch, with what is left in their queue"""
+        items = self.filtered('user_id')
+        if not items:
+            return
+        remaining = dict(self._read_group(
+            [('user_id', 'in', items.user_id.ids), ('state', 'in', ('pending', 'processing'))],
+            ['user_id'], ['__count']))
+        for user in items.user_id:
+            user_items = items.filtered(lambda item: item.user_id == user)
+            self.env['bus.bus']._sendone(user.partner_id, 'simple_notification', {
+                'title': _('Envío a HKA (%s pendientes)') % remaining.get(user, 0),
+                'message': _('%s enviadas, %s con error.') % (
+                    len(user_items.filtered(lambda item: item.state == 'done')),
+                    len(user_items.filtered(lambda item: item.state in ('pending', 'error')))),
+                'type': 'info',
+                'sticky': False,
+            })
+
+    def action_retry(self):
+        self.filtered(lambda item: item.state in ('error', 'cancelled')).write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt': False,
+        })
+        self._trigger_processing()
@@ -1,11 +1,152 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 import zeep
+from zeep.transports import Transport
+import requests
+from requests.adapters import HTTPAdapter
 import logging
+import psycopg2
 import base64
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from odoo.tools import config as odoo_config
+
+from ..tools import tracing
 
 _logger = logging.getLogger(__name__)
 
+# Per-worker cache of SOAP clients:
+# {(dbname, config_id, wsdl_url, request_timeout, wsdl_checksum): zeep.Client}
+_CLIENT_CACHE = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+HTTP_POOL_SIZE = 10
+_DOCUMENT_LABELS = {'DescargaPDF': 'PDF', 'DescargaXML': 'XML'}
+
+# Retry policy per SOAP operation: (max retries, base delay in seconds).
+# Enviar and AnulacionDocumento are never retried: a request that reached HKA
+# before failing could otherwise create or cancel the document twice.
+RETRY_POLICIES = {
+    'ConsultarRucDV': (2, 0.5),
+    'DescargaPDF': (3, 0.5),
+    'DescargaXML': (3, 0.5),
+    'Enviar': (0, 0),
+    'AnulacionDocumento': (0, 0),
+}
+# Errors that mean HKA could not be reached, as opposed to a business error
+TRANSPORT_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    zeep.exceptions.TransportError,
+)
+# Consecutive transport failures that open the circuit breaker, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_OPEN_SECONDS = 60
+# Breaker updates give up quickly rather than stall HKA calls behind a lock on the configuration
+BREAKER_LOCK_TIMEOUT = '2s'
+
+
+def _build_transport(timeout=None):
+    """Build a zeep transport backed by a pooled, keep-alive HTTP session
+
+    timeout bounds both the WSDL download and every SOAP operation.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not timeout:
+        return Transport(session=session)
+    return Transport(session=session, timeout=timeout, operation_timeout=timeout)
+
+
+def _call_with_retry(client, operation, **kwargs):
+    """Call a SOAP operation, retrying transport errors per RETRY_POLICIES
+
+    Uses exponential backoff with full jitter. Does not touch the ORM.
+    """
+    retries, base_delay = RETRY_POLICIES.get(operation, (0, 0))
+    attempt = 0
+    while True:
+        try:
+            return getattr(client.service, operation)(**kwargs)
+        except TRANSPORT_EXCEPTIONS as e:
+            if attempt >= retries:
+                raise
+            delay = random.uniform(0, base_delay * 2 ** attempt)
+            _logger.warning('HKA %s failed (%s), retry %d/%d in %.2fs',
+                            operation, e, attempt + 1, retries, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+def wsdl_snapshot_path(checksum):
+    """Filesystem location of a WSDL snapshot, shared by all databases of the server"""
+    return Path(odoo_config['data_dir']) / 'isfehka_wsdl' / ('%s.wsdl' % checksum)
+
+
+def _download_document(client, credentials, operation, datos_documento, debug=False, dbname=None):
+    """Call DescargaPDF or DescargaXML and return the decoded document, or False
+
+    Does not touch the ORM so it can run outside of the request thread.
+    Transport errors are raised once retries are exhausted so the caller can
+    update the circuit breaker.
+    """
+    label = _DOCUMENT_LABELS[operation]
+    try:
+        # Log request data for debugging
+        if debug:
+            _logger.info('ISFEHKA %s Request Data: %s', label, {
+                'tokenEmpresa': credentials['tokenEmpresa'],
+                'datosDocumento': datos_documento
+            })
+
+        # According to WSDL, DescargaPDF/DescargaXML expect tokenEmpresa, tokenPassword and datosDocumento
+        with tracing.span(dbname, operation, kind='operation') as span:
+            response = _call_with_retry(
+                client, operation,
+                tokenEmpresa=credentials['tokenEmpresa'],
+                tokenPassword=credentials['tokenPassword'],
+                datosDocumento=datos_documento
+            )
+            span.result = getattr(response, 'codigo', None)
+
+        # Check response structure from WSDL
+        if response and hasattr(response, 'codigo') and response.codigo in ['200', '201']:
+            # Log success response
+            if debug:
+                _logger.info('ISFEHKA %s Response: %s', label, response)
+
+            # WSDL shows documento is base64 encoded string
+            if hasattr(response, 'documento') and response.documento:
+                # Convert from base64 string to bytes
+                try:
+                    return base64.b64decode(response.documento)
+                except Exception as e:
+                    _logger.error('Error decoding %s base64: %s', label, str(e))
+                    return False
+            _logger.warning('%s document not found in response', label)
+        else:
+            _logger.warning('Invalid response from HKA %s service: %s', label,
+                            getattr(response, 'mensaje', 'Unknown error'))
+        return False
+    except TRANSPORT_EXCEPTIONS:
+        raise
+    except Exception as e:
+        _logger.error('%s download error: %s', label, str(e))
+        return False
+
+
+def clear_client_cache(dbname, config_ids=None):
+    """Drop cached clients of a database, optionally only for some configurations"""
+    with _CLIENT_CACHE_LOCK:
+        for key in list(_CLIENT_CACHE):
+            if key[0] == dbname and (config_ids is None or key[1] in config_ids):
+                del _CLIENT_CACHE[key]
+
 class HKAService(models.AbstractModel):
     _name = 'hka.service'
     _description = 'HKA Web Service Integration'
@@ -22,18 +163,54 @@ class HKAService(models.AbstractModel):
         return config
 
     def get_client(self):
-        """Get configured SOAP client for HKA service"""
+        """Get configured SOAP client for HKA service
+
+        Clients are cached per worker and shared by all service methods. The
+        cache key holds what the client is built from (URL, timeout and WSDL
+        snapshot checksum), so changing any of them in any worker makes the
+        others rebuild their client. Clients are built from the
+        configuration's WSDL snapshot, saved on the first download, so a
+        fresh worker does not download it again.
+        """
         config = self._get_configuration()
         wsdl_url = config.wsdl_url
         if not wsdl_url:
             raise UserError(_('WSDL URL not configured. Please configure it in Electronic Invoice settings.'))
-        
+
+        dbname = self.env.cr.dbname
+        checksum = config.wsdl_snapshot_checksum if config.wsdl_snapshot_url == wsdl_url else False
+        key = (dbname, config.id, wsdl_url, config.request_timeout, checksum)
+        with _CLIENT_CACHE_LOCK:
+            client = _CLIENT_CACHE.get(key)
+        if client is not None:
+            return client
+
+        # Built without the lock: loading the WSDL must not block other configurations
         try:
-            return zeep.Client(wsdl=wsdl_url)
+            wsdl = config._get_wsdl_snapshot_path()
+            if not wsdl:
+                _logger.info('No local WSDL snapshot for HKA configuration %s, fetching %s',
+                             config.name, wsdl_url)
+                wsdl, checksum = config._save_wsdl_snapshot()
+            client = zeep.Client(wsdl=wsdl, transport=_build_transport(config.request_timeout))
         except Exception as e:
             _logger.error('Error creating SOAP client: %s', str(e))
             raise UserError(_('Could not connect to HKA service: %s') % str(e))
 
+        # A snapshot saved just now is only seen by later transactions: cache the
+        # client under their key too, so it is not built a second time
+        keys = {key, key[:4] + (checksum,)}
+        with _CLIENT_CACHE_LOCK:
+            # Another thread may have built one meanwhile: keep the first
+            if key in _CLIENT_CACHE:
+                return _CLIENT_CACHE[key]
+            # Forget clients built from an older version of this configuration
+            for stale_key in [k for k in _CLIENT_CACHE if k[:2] == (dbname, config.id) and k not in keys]:
+                del _CLIENT_CACHE[stale_key]
+            for new_key in keys:
+                _CLIENT_CACHE[new_key] = client
+            return client
+
     def get_credentials(self):
         """Get HKA credentials from settings"""
         config = self._get_configuration()
@@ -57,7 +234,8 @@ class HKAService(models.AbstractModel):
                     'ruc': ruc,
                 })
 
-            response = client.service.ConsultarRucDV(
+            response = self._call(
+                client, 'ConsultarRucDV',
                 consultarRucDVRequest={
                     'tokenEmpresa': credentials['tokenEmpresa'],
                     'tokenPassword': credentials['tokenPassword'],
@@ -90,7 +268,8 @@ class HKAService(models.AbstractModel):
             _logger.info('ISFEHKA Request Data: %s', json.dumps(log_data, indent=2, ensure_ascii=False, default=str))
 
             # Update request structure to match WSDL exactly
-            response = client.service.Enviar(
+            response = self._call(
+                client, 'Enviar',
                 tokenEmpresa=credentials['tokenEmpresa'],
                 tokenPassword=credentials['tokenPassword'],
                 documento=invoice_data.get('documento', {})  # Get the documento object directly
@@ -114,8 +293,7 @@ class HKAService(models.AbstractModel):
                 if self.env.user.has_group('base.group_no_one'):
                     _logger.info('ISFEHKA Extracted Document Data for PDF/XML: %s', datos_documento)
                 
-                result['xml'] = self.get_xml_document(datos_documento)
-                result['pdf'] = self.get_pdf_document(datos_documento)
+                result['xml'], result['pdf'] = self.get_documents(datos_documento)
             
             return result
         except Exception as e:
@@ -135,7 +313,8 @@ class HKAService(models.AbstractModel):
                     'documento': cancel_data
                 })
 
-            response = client.service.AnulacionDocumento(
+            response = self._call(
+                client, 'AnulacionDocumento',
                 tokenEmpresa=credentials['tokenEmpresa'],
                 tokenPassword=credentials['tokenPassword'],
                 motivoAnulacion=cancel_data.get('motivoAnulacion'),
@@ -145,8 +324,7 @@ class HKAService(models.AbstractModel):
             
             # If document was cancelled successfully, get XML and PDF of cancellation
             if result.get('success'):
-                result['xml'] = self.get_xml_document(cancel_data.get('datosDocumento'))
-                result['pdf'] = self.get_pdf_document(cancel_data.get('datosDocumento'))
+                result['xml'], result['pdf'] = self.get_documents(cancel_data.get('datosDocumento'))
             
             return result
         except Exception as e:
@@ -155,89 +333,141 @@ class HKAService(models.AbstractModel):
 
     def get_pdf_document(self, datos_documento):
         """Get PDF document from HKA service"""
-        client = self.get_client()
-        credentials = self.get_credentials()
-        
-        try:
-            # Log request data for debugging
-            if self.env.user.has_group('base.group_no_one'):
-                _logger.info('ISFEHKA PDF Request Data: %s', {
-                    'tokenEmpresa': credentials['tokenEmpresa'],
-                    'datosDocumento': datos_documento
-                })
-
-            # According to WSDL, DescargaPDF expects tokenEmpresa, tokenPassword and datosDocumento
-            response = client.service.DescargaPDF(
-                tokenEmpresa=credentials['tokenEmpresa'],
-                tokenPassword=credentials['tokenPassword'],
-                datosDocumento=datos_documento
-            )
-            
-            # Check response structure from WSDL
-            if response and hasattr(response, 'codigo') and response.codigo in ['200', '201']:
-                # Log success response
-                if self.env.user.has_group('base.group_no_one'):
-                    _logger.info('ISFEHKA PDF Response: %s', response)
-                
-                # WSDL shows documento is base64 encoded string
-                if hasattr(response, 'documento') and response.documento:
-                    # Convert from base64 string to bytes
-                    try:
-                        return base64.b64decode(response.documento)
-                    except Exception as e:
-                        _logger.error('Error decoding PDF base64: %s', str(e))
-                        return False
-                _logger.warning('PDF document not found in response')
-            else:
-                _logger.warning('Invalid response from HKA PDF service: %s', 
-                              getattr(response, 'mensaje', 'Unknown error'))
-            return False
-        except Exception as e:
-            _logger.error('PDF download error: %s', str(e))
-            return False
+        return self._get_document('DescargaPDF', datos_documento)
 
     def get_xml_document(self, datos_documento):
         """Get XML document from HKA service"""
+        return self._get_document('DescargaXML', datos_documento)
+
+    def get_documents(self, datos_documento):
+        """Get XML and PDF documents from HKA service concurrently
+
+        Returns a (xml, pdf) tuple; each item is False if its download failed.
+        """
         client = self.get_client()
         credentials = self.get_credentials()
-        
-        try:
-            # Log request data for debugging
-            if self.env.user.has_group('base.group_no_one'):
-                _logger.info('ISFEHKA XML Request Data: %s', {
-                    'tokenEmpresa': credentials['tokenEmpresa'],
-                    'datosDocumento': datos_documento
-                })
+        debug = self.env.user.has_group('base.group_no_one')
+        if not self._breaker_allows():
+            _logger.warning('HKA circuit breaker open, skipping document download')
+            return False, False
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(tracing.current_context().run, _download_document,
+                                client, credentials, operation, datos_documento, debug, self.env.cr.dbname)
+                for operation in ('DescargaXML', 'DescargaPDF')
+            ]
+        documents = []
+        reachable = True
+        for future in futures:
+            try:
+                documents.append(future.result())
+            except TRANSPORT_EXCEPTIONS as e:
+                _logger.error('Document download error: %s', str(e))
+                documents.append(False)
+                reachable = False
+        self._breaker_record(reachable)
+        return tuple(documents)
 
-            # According to WSDL, DescargaXML expects tokenEmpresa, tokenPassword and datosDocumento
-            response = client.service.DescargaXML(
-                tokenEmpresa=credentials['tokenEmpresa'],
-                tokenPassword=credentials['tokenPassword'],
-                datosDocumento=datos_documento
-            )
-            
-            # Check response structure from WSDL
-            if response and hasattr(response, 'codigo') and response.codigo in ['200', '201']:
-                # Log success response
-                if self.env.user.has_group('base.group_no_one'):
-                    _logger.info('ISFEHKA XML Response: %s', response)
-                
-                # WSDL shows documento is base64 encoded string
-                if hasattr(response, 'documento') and response.documento:
-                    # Convert from base64 string to bytes
-                    try:
-                        return base64.b64decode(response.documento)
-                    except Exception as e:
-                        _logger.error('Error decoding XML base64: %s', str(e))
-                        return False
-                _logger.warning('XML document not found in response')
-            else:
-                _logger.warning('Invalid response from HKA XML service: %s', 
-                              getattr(response, 'mensaje', 'Unknown error'))
+    def _get_document(self, operation, datos_documento):
+        client = self.get_client()
+        credentials = self.get_credentials()
+        debug = self.env.user.has_group('base.group_no_one')
+        if not self._breaker_allows():
+            _logger.warning('HKA circuit breaker open, skipping %s', operation)
             return False
-        except Exception as e:
-            _logger.error('XML download error: %s', str(e))
+        try:
+            document = _download_document(client, credentials, operation, datos_documento, debug,
+                                          self.env.cr.dbname)
+        except TRANSPORT_EXCEPTIONS as e:
+            _logger.error('Document download error: %s', str(e))
+            self._breaker_record(False)
             return False
+        self._breaker_record(True)
+        return document
+
+    # -------------------------------------------------------------------------
+    # Resilience
+    # -------------------------------------------------------------------------
+
+    def _call(self, client, operation, **kwargs):
+        """Call a SOAP operation through the retry policy and the circuit breaker"""
+        if not self._breaker_allows():
+            raise UserError(_('El servicio HKA no está disponible en este momento. '
+                              'Intente nuevamente en unos minutos.'))
+        try:
+            with tracing.span(self.env.cr.dbname, operation, kind='operation') as span:
+                response = _call_with_retry(client, operation, **kwargs)
+                span.result = getattr(response, 'codigo', None)
+        except TRANSPORT_EXCEPTIONS:
+            self._breaker_record(False)
+            raise
+        self._breaker_record(True)
+        return response
+
+    def _breaker_allows(self):
+        """Return False while the configuration's circuit breaker is open
+
+        The breaker state lives on the configuration row so all workers share
+        it. It is read with SQL to always see other workers' updates.
+        """
+        config = self._get_configuration()
+        self.env.cr.execute("""
+            SELECT breaker_open_until > (clock_timestamp() at time zone 'UTC')
+              FROM isfehka_configuration
+             WHERE id = %s
+        """, [config.id])
+        row = self.env.cr.fetchone()
+        return not (row and row[0])
+
+    def _breaker_record(self, reachable):
+        """Record whether HKA could be reached by the last call"""
+        if reachable:
+            self._breaker_record_success()
+        else:
+            self._breaker_record_failure()
+
+    def _breaker_record_failure(self):
+        config = self._get_configuration()
+        # Separate cursor: the failure must be recorded even if the caller rolls back
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute("SET LOCAL lock_timeout = %s", [BREAKER_LOCK_TIMEOUT])
+                cr.execute("""
+                    UPDATE isfehka_configuration
+                       SET breaker_failures = COALESCE(breaker_failures, 0) + 1,
+                           breaker_open_until = CASE
+                               WHEN COALESCE(breaker_failures, 0) + 1 >= %s
+                               THEN (clock_timestamp() at time zone 'UTC') + interval '1 second' * %s
+                               ELSE breaker_open_until
+                           END
+                     WHERE id = %s
+                 RETURNING breaker_failures
+                """, [BREAKER_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS, config.id])
+                failures = cr.fetchone()[0]
+        except psycopg2.OperationalError as e:
+            _logger.warning('Could not record an HKA failure for configuration %s: %s', config.name, e)
+            return
+        if failures >= BREAKER_FAILURE_THRESHOLD:
+            _logger.warning('HKA circuit breaker open for configuration %s after %d failures',
+                            config.name, failures)
+
+    def _breaker_record_success(self):
+        config = self._get_configuration()
+        # The cached value is enough: the row is only touched after failures
+        if not config.sudo().breaker_failures:
+            return
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute("SET LOCAL lock_timeout = %s", [BREAKER_LOCK_TIMEOUT])
+                cr.execute("""
+                    UPDATE isfehka_configuration
+                       SET breaker_failures = 0, breaker_open_until = NULL
+                     WHERE id = %s AND breaker_failures > 0
+                """, [config.id])
+        except psycopg2.OperationalError as e:
+            _logger.warning('Could not close the HKA circuit breaker for configuration %s: %s', config.name, e)
+            return
+        _logger.info('HKA circuit breaker closed for configuration %s', config.name)
 
     def _process_response(self, response):
         """Process HKA service response"""
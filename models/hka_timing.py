@@ -0,0 +1,77 @@
+from odoo import models, fields, api, tools
+from datetime import timedelta
+
+DEFAULT_RETENTION_DAYS = 30
+
+
+class HkaTiming(models.Model):
+    _name = 'hka.timing'
+    _description = 'HKA Latency Span'
+    _order = 'date desc, id desc'
+    _log_access = False
+
+    # Rows are inserted in batches with SQL by tools/tracing.py
+    date = fields.Datetime(string='Fecha', required=True, index=True)
+    kind = fields.Selection([
+        ('phase', 'Fase'),
+        ('operation', 'Operación HKA'),
+    ], string='Tipo', required=True)
+    operation = fields.Char(string='Operación', required=True, index=True)
+    # Not a many2one: the invoice may have been rolled back when the span is stored
+    move_id = fields.Integer(string='ID de Factura', index=True)
+    company_id = fields.Many2one('res.company', string='Compañía', ondelete='cascade')
+    duration_ms = fields.Float(string='Duración (ms)', digits=(16, 3))
+    status = fields.Char(string='Estado')
+    result = fields.Char(string='Código de Resultado')
+
+    @api.autovacuum
+    def _gc_timings(self):
+        days = int(self.env['ir.config_parameter'].sudo().get_param(
+            'isfehka.timing_retention_days', DEFAULT_RETENTION_DAYS))
+        self.env.cr.execute("DELETE FROM hka_timing WHERE date < %s",
+                            [fields.Datetime.now() - timedelta(days=days)])
+
+
+class HkaTimingReport(models.Model):
+    _name = 'hka.timing.report'
+    _description = 'HKA Latency Percentiles'
+    _auto = False
+    _order = 'day desc, kind, operation'
+
+    day = fields.Date(string='Día', readonly=True)
+    kind = fields.Selection([
+        ('phase', 'Fase'),
+        ('operation', 'Operación HKA'),
+    ], string='Tipo', readonly=True)
+    operation = fields.Char(string='Operación', readonly=True)
+    company_id = fields.Many2one('res.company', string='Compañía', readonly=True)
+    count = fields.Integer(string='Cantidad', readonly=True)
+    error_count = fields.Integer(string='Errores', readonly=True)
+    avg_ms = fields.Float(string='Promedio (ms)', readonly=True, group_operator='avg')
+    p50_ms = fields.Float(string='p50 (ms)', readonly=True, group_operator='max')
+    p95_ms = fields.Float(string='p95 (ms)', readonly=True, group_operator='max')
+    max_ms = fields.Float(string='Máximo (ms)', readonly=True, group_operator='max')
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE OR REPLACE VIEW %s AS (
+                SELECT row_number() OVER (ORDER BY day, kind, operation, company_id) AS id,
+                       day, kind, operation, company_id, count, error_count,
+                       avg_ms, p50_ms, p95_ms, max_ms
+                  FROM (
+                    SELECT date_trunc('day', date)::date AS day,
+                           kind,
+                           operation,
+                           company_id,
+                           count(*) AS count,
+                           count(*) FILTER (WHERE status = 'error') AS error_count,
+                           avg(duration_ms) AS avg_ms,
+                           percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms) AS p50_ms,
+                           percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) AS p95_ms,
+                           max(duration_ms) AS max_ms
+                      FROM hka_timing
+                     GROUP BY 1, 2, 3, 4
+                  ) AS stats
+            )
+        """ % self._table)
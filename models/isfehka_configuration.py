@@ -1,5 +1,26 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError, UserError
+import base64
+import hashlib
+import logging
+import os
+import time
+
+import requests
+
+from .hka_number_range import MAX_FISCAL_NUMBER, raise_no_fiscal_number
+from .hka_service import clear_client_cache, wsdl_snapshot_path
+from ..tools import metrics
+
+_logger = logging.getLogger(__name__)
+
+
+def _write_snapshot_file(path, content):
+    # Written aside and renamed, so other workers never read a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name('%s.%s.tmp' % (path.name, os.getpid()))
+    tmp_path.write_bytes(content)
+    tmp_path.replace(path)
 
 
 class IsfehkaConfiguration(models.Model):
@@ -49,6 +70,52 @@ class IsfehkaConfiguration(models.Model):
         copy=False,
         help='Número fiscal a utilizar en la siguiente emisión (10 dígitos).'
     )
+    number_block_size = fields.Integer(
+        string='Bloque de Números Fiscales',
+        default=1,
+        help='Cantidad de números fiscales que cada proceso reserva a la vez por punto de facturación. '
+             'Con 1 cada número se toma directamente de la configuración. Con bloques mayores no hay '
+             'bloqueo por factura, pero los números no usados de un bloque quedan como saltos.'
+    )
+    request_timeout = fields.Integer(
+        string='Tiempo de Espera (s)',
+        default=30,
+        help='Segundos máximos de espera por cada llamada al servicio de HKA.'
+    )
+    breaker_failures = fields.Integer(
+        string='Fallos Consecutivos',
+        readonly=True,
+        copy=False,
+        help='Fallos de conexión consecutivos con HKA.'
+    )
+    breaker_open_until = fields.Datetime(
+        string='Servicio Suspendido Hasta',
+        readonly=True,
+        copy=False,
+        help='Mientras el servicio está suspendido, las llamadas a HKA fallan de inmediato.'
+    )
+    wsdl_snapshot = fields.Binary(
+        string='Copia Local del WSDL',
+        attachment=True,
+        copy=False,
+        help='WSDL descargado desde la URL configurada. Los clientes SOAP se construyen '
+             'desde esta copia para no descargar el WSDL en cada worker.'
+    )
+    wsdl_snapshot_url = fields.Char(
+        string='URL de la Copia del WSDL',
+        readonly=True,
+        copy=False
+    )
+    wsdl_snapshot_checksum = fields.Char(
+        string='Checksum de la Copia del WSDL',
+        readonly=True,
+        copy=False
+    )
+    wsdl_snapshot_date = fields.Datetime(
+        string='Fecha de la Copia del WSDL',
+        readonly=True,
+        copy=False
+    )
     company_ids = fields.One2many(
         'res.company',
         'hka_configuration_id',
@@ -70,23 +137,134 @@ class IsfehkaConfiguration(models.Model):
                 if int(record.next_number) < 1:
                     raise ValidationError(_('El número fiscal debe ser mayor que 0.'))
 
-    def get_and_increment_next_number(self):
+    @api.constrains('number_block_size')
+    def _check_number_block_size(self):
+        for record in self:
+            if record.number_block_size < 1:
+                raise ValidationError(_('El bloque de números fiscales debe ser al menos 1.'))
+
+    def write(self, vals):
+        if vals.get('wsdl_url') and 'wsdl_snapshot' not in vals:
+            # A snapshot of another URL must not be used for the new one
+            if any(record.wsdl_snapshot_url and record.wsdl_snapshot_url != vals['wsdl_url'] for record in self):
+                vals = dict(vals, wsdl_snapshot=False, wsdl_snapshot_url=False,
+                            wsdl_snapshot_checksum=False, wsdl_snapshot_date=False)
+        res = super().write(vals)
+        clear_client_cache(self.env.cr.dbname, set(self.ids))
+        return res
+
+    def unlink(self):
+        config_ids = set(self.ids)
+        res = super().unlink()
+        clear_client_cache(self.env.cr.dbname, config_ids)
+        return res
+
+    def action_reset_breaker(self):
+        # The raw UPDATE bypasses the ORM access checks
+        self.check_access_rights('write')
+        self.check_access_rule('write')
+        # SQL skips write(), which would drop the cached clients of this configuration
+        self.env.cr.execute("""
+            UPDATE isfehka_configuration
+               SET breaker_failures = 0, breaker_open_until = NULL
+             WHERE id IN %s
+        """, [tuple(self.ids)])
+        self.invalidate_recordset(['breaker_failures', 'breaker_open_until'])
+
+    def _get_wsdl_snapshot_path(self):
+        """Return a local file holding the WSDL snapshot, or False if there is none"""
         self.ensure_one()
-        if not self.next_number:
-            raise UserError(_('Configure un próximo número fiscal en la configuración de HKA.'))
+        if not self.wsdl_snapshot_checksum or self.wsdl_snapshot_url != self.wsdl_url:
+            return False
+        path = wsdl_snapshot_path(self.wsdl_snapshot_checksum)
+        if not path.exists():
+            content = self.sudo().with_context(bin_size=False).wsdl_snapshot
+            if not content:
+                return False
+            _write_snapshot_file(path, base64.b64decode(content))
+        return str(path)
+
+    def _download_wsdl(self):
+        self.ensure_one()
+        try:
+            response = requests.get(self.wsdl_url, timeout=self.request_timeout or 60)
+            response.raise_for_status()
+        except Exception as e:
+            raise UserError(_('No se pudo descargar el WSDL de %s: %s') % (self.wsdl_url, e))
+        return response.content
 
-        table = self._table
-        self.env.cr.execute(f"SELECT next_number FROM {table} WHERE id = %s FOR UPDATE NOWAIT", [self.id])
-        row = self.env.cr.fetchone()
-        if not row or not row[0]:
-            raise UserError(_('No se encontró el próximo número fiscal configurado.'))
+    def _store_wsdl_snapshot(self, content, url):
+        self.ensure_one()
+        self.write({
+            'wsdl_snapshot': base64.b64encode(content),
+            'wsdl_snapshot_url': url,
+            'wsdl_snapshot_checksum': hashlib.sha256(content).hexdigest(),
+            'wsdl_snapshot_date': fields.Datetime.now(),
+        })
+        _logger.info('HKA WSDL snapshot saved for configuration %s (%d bytes)', self.name, len(content))
 
-        next_number = row[0]
-        if not next_number.isdigit():
-            raise UserError(_('El número fiscal configurado no es válido.'))
+    def _save_wsdl_snapshot(self):
+        """Download the WSDL, save it as the snapshot and return (local file, checksum)
+
+        Called when a client is built without a snapshot. The snapshot is
+        saved on its own cursor, so it is kept even if the calling
+        transaction rolls back; failing to save it only costs another
+        download later.
+        """
+        self.ensure_one()
+        content = self._download_wsdl()
+        try:
+            with self.pool.cursor() as cr:
+                self.with_env(self.env(cr=cr, su=True))._store_wsdl_snapshot(content, self.wsdl_url)
+        except Exception as e:
+            _logger.warning('Could not save the HKA WSDL snapshot of configuration %s: %s', self.name, e)
+        checksum = hashlib.sha256(content).hexdigest()
+        path = wsdl_snapshot_path(checksum)
+        if not path.exists():
+            _write_snapshot_file(path, content)
+        return str(path), checksum
+
+    def action_refresh_wsdl(self):
+        """Download the WSDL again and store it as the local snapshot"""
+        for record in self:
+            record._store_wsdl_snapshot(record._download_wsdl(), record.wsdl_url)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Éxito'),
+                'message': _('Copia local del WSDL actualizada'),
+                'type': 'success',
+                'sticky': False,
+            }
+        }
+
+    def get_and_increment_next_number(self, pos_code=False):
+        self.ensure_one()
+        if not self.next_number:
+            raise UserError(_('Configure un próximo número fiscal en la configuración de HKA.'))
+        if self.number_block_size > 1:
+            return self.env['hka.number.range'].sudo()._next_number(self, pos_code, self.number_block_size)
 
-        new_number = str(int(next_number) + 1).zfill(10)
-        self.env.cr.execute(f"UPDATE {table} SET next_number = %s WHERE id = %s", [new_number, self.id])
-        self.env.cr.commit()
+        # Own short transaction: the number is taken durably and the configuration row is
+        # only locked for the UPDATE, without committing the caller's transaction
+        start = time.perf_counter()
+        with self.env.registry.cursor() as cr:
+            cr.execute("SET LOCAL lock_timeout = '10s'")
+            try:
+                cr.execute("""
+                    UPDATE isfehka_configuration
+                       SET next_number = lpad((next_number::bigint + 1)::text, 10, '0')
+                     WHERE id = %s AND next_number ~ '^[0-9]+$'
+                       AND next_number::bigint < %s
+                 RETURNING next_number::bigint - 1
+                """, [self.id, MAX_FISCAL_NUMBER])
+            except Exception:
+                metrics.inc(self.env.cr.dbname, 'hka_fiscal_number_failures_total', {'reason': 'locked'})
+                raise
+            row = cr.fetchone()
+            if not row:
+                raise_no_fiscal_number(cr, self.id)
+        metrics.observe(self.env.cr.dbname, 'hka_fiscal_number_wait_seconds', time.perf_counter() - start)
         self.invalidate_recordset(['next_number'])
-        return next_number
+        return str(row[0]).zfill(10)
@@ -16,6 +16,18 @@ class PosConfig(models.Model):
         help='When enabled, the POS will use the PDF receipt from HKA instead of the default receipt format'
     )
 
+    hka_receipt_profile = fields.Selection([
+        ('58mm', '58 mm'),
+        ('80mm', '80 mm'),
+    ], string='Ancho del Recibo HKA', default='80mm', required=True,
+        help='Ancho del papel de la impresora térmica para la imagen del recibo HKA')
+
+    hka_partner_delta_sync = fields.Boolean(
+        string='Caché Local de Clientes',
+        default=True,
+        help='Al abrir la sesión solo se cargan los clientes frecuentes; el resto se guarda en el '
+             'navegador y se sincronizan en segundo plano únicamente los clientes modificados')
+
     hka_tipo_documento = fields.Selection([
         ('01', 'Factura de Operación Interna'),
         ('02', 'Factura de Importación'),
@@ -1,30 +1,146 @@
-from odoo import models, fields, api
+from odoo import models, fields, api, _
 import base64
-from PIL import Image
-import io
+import logging
+import time
+
+from ..tools import metrics
+from ..tools.receipt import RECEIPT_PROFILES, render_receipts
+
+_logger = logging.getLogger(__name__)
+
+RENDER_BATCH = 20
+RENDER_TIME_BUDGET = 120
+
 
 class PosHKAPDF(models.Model):
     _name = 'pos.hkapdf'
     _description = 'POS HKAPDF Data'
+    _order = 'id desc'
 
     name = fields.Char(string='Name', required=True)
-    pdf_data = fields.Binary(string='PDF Data')
-    image_data = fields.Binary(string='Image Data', compute='_compute_image_data', store=True)
-    
-    @api.depends('pdf_data')
-    def _compute_image_data(self):
+    move_id = fields.Many2one('account.move', string='Factura', index='btree_not_null', ondelete='cascade')
+    profile = fields.Selection([
+        ('58mm', '58 mm'),
+        ('80mm', '80 mm'),
+    ], string='Ancho del Recibo', default='80mm', required=True)
+    # Receipts of an invoice are rendered from its hka_pdf, not from a copy
+    pdf_data = fields.Binary(string='PDF Data', attachment=True)
+    # Rendered by _cron_render_pending only, never in a request
+    image_data = fields.Binary(string='Image Data', attachment=True, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Listo'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='pending', required=True, index=True)
+    error = fields.Char(string='Error', readonly=True)
+
+    _sql_constraints = [
+        ('move_profile_unique', 'unique(move_id, profile)', 'Ya existe un recibo de este ancho para la factura.'),
+    ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._trigger_render()
+        return records
+
+    def write(self, vals):
+        if vals.get('pdf_data') and 'state' not in vals:
+            vals = dict(vals, state='pending', image_data=False, error=False)
+        res = super().write(vals)
+        if vals.get('state') == 'pending':
+            self._trigger_render()
+        return res
+
+    @api.model
+    def _queue_for_moves(self, moves):
+        """(Re)render the receipt of the POS invoices among moves, in the background"""
+        moves = moves.filtered('pos_order_ids')
+        existing = self.search([('move_id', 'in', moves.ids)])
+        existing.write({'state': 'pending', 'image_data': False, 'error': False})
+        queued = {(receipt.move_id.id, receipt.profile) for receipt in existing}
+        vals_list = []
+        for move in moves:
+            profile = move._get_hka_receipt_profile()
+            if (move.id, profile) not in queued:
+                vals_list.append({'name': move.name, 'move_id': move.id, 'profile': profile})
+        self.create(vals_list)
+
+    @api.model
+    def _get_for_move(self, move, profile):
+        """Rendered receipt of move for profile, empty while the cron has not rendered it"""
+        return self.search([('move_id', '=', move.id), ('profile', '=', profile), ('state', '=', 'done')], limit=1)
+
+    def _get_image_attachment(self):
+        if not self:
+            return self.env['ir.attachment']
+        return self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'image_data'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+
+    def _get_pdf_data(self):
+        pdf = self.move_id.hka_pdf if self.move_id else self.pdf_data
+        return base64.b64decode(pdf) if pdf else False
+
+    def _trigger_render(self):
+        if self.filtered(lambda r: r.state == 'pending'):
+            cron = self.env.ref('isfehka.ir_cron_render_pos_hkapdf', raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+
+    @api.model
+    def _cron_render_pending(self):
+        """Render pending PDFs to images, RENDER_BATCH at a time"""
+        started = time.monotonic()
+        while time.monotonic() - started < RENDER_TIME_BUDGET:
+            records = self.search([('state', '=', 'pending')], order='id', limit=RENDER_BATCH)
+            if not records:
+                return
+            records._render()
+            self.env.cr.commit()
+            self.env.invalidate_all()
+        # Budget spent with renders left: continue in a new run
+        self.env.ref('isfehka.ir_cron_render_pos_hkapdf')._trigger()
+
+    def _render(self):
+        jobs = []
         for record in self:
-            if record.pdf_data:
-                # Convert PDF to image using your preferred method
-                # This is a placeholder - implement your PDF to image conversion here
-                # The result should be stored in record.image_data as base64
-                pass
+            pdf_data = record._get_pdf_data()
+            if pdf_data:
+                jobs.append((record.id, pdf_data, RECEIPT_PROFILES[record.profile]))
+            else:
+                record.write({'state': 'failed', 'error': _('Sin PDF')})
+        results = render_receipts(jobs)
+        for record in self.filtered(lambda r: r.id in results):
+            image, error, seconds = results[record.id]
+            metrics.observe(self.env.cr.dbname, 'hka_pos_pdf_render_seconds', seconds)
+            if error:
+                _logger.warning('Could not render HKA receipt %s: %s', record.name, error)
+                record.write({'state': 'failed', 'error': str(error)[:250]})
+            else:
+                record.write({'state': 'done', 'image_data': base64.b64encode(image), 'error': False})
+        # Push the image URL to the point of sale
+        self.filtered(lambda r: r.state == 'done').move_id._notify_hka_pos()
+
+    def _get_image_url(self):
+        self.ensure_one()
+        if self.move_id:
+            return '/pos/hka_receipt/%s/%s.png' % (self.move_id.id, self.profile)
+        # /web/image answers with an ETag; unique changes whenever the image does
+        return '/web/image/pos.hkapdf/%s/image_data?unique=%s' % (
+            self.id, fields.Datetime.to_string(self.write_date).replace(' ', '_'))
 
     def get_image_data(self):
-        """Method to retrieve image data for POS"""
+        """Method to retrieve image data for POS
+
+        Returns the metadata and the URL of the image, never the image itself.
+        """
         self.ensure_one()
         return {
             'id': self.id,
             'name': self.name,
-            'image_data': self.image_data,
+            'state': self.state,
+            'image_url': self._get_image_url() if self.state == 'done' else False,
         }
@@ -1,4 +1,4 @@
-from odoo import models, _
+from odoo import models, fields, api, _
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -77,3 +77,48 @@ class PosOrder(models.Model):
                 ) % error_msg)
         
         return moves
+
+    @api.model
+    def _get_hka_receipts_info(self, pos_references, profile=None):
+        """HKA status, CUFE, QR and receipt image URL of the orders' invoices
+
+        One lookup for the whole batch; the image URL is only given once the
+        receipt is rendered. Returns one dict per reference, in the given
+        order.
+        """
+        orders = self.search([('pos_reference', 'in', list(pos_references))])
+        by_reference = {order.pos_reference: order for order in orders}
+        invoices = orders.account_move
+        rendered = {
+            (receipt['move_id'][0], receipt['profile'])
+            for receipt in self.env['pos.hkapdf'].sudo().search_read(
+                [('move_id', 'in', invoices.ids), ('state', '=', 'done')], ['move_id', 'profile'])
+        }
+        result = []
+        for reference in pos_references:
+            order = by_reference.get(reference)
+            if not order:
+                result.append({'pos_reference': reference, 'error': 'Order not found'})
+                continue
+            invoice = order.account_move
+            if not invoice:
+                result.append({'pos_reference': reference, 'order_name': order.name,
+                               'error': 'No invoice found for order'})
+                continue
+            receipt_profile = profile or order.config_id.hka_receipt_profile
+            result.append({
+                'pos_reference': reference,
+                'order_name': order.name,
+                'invoice_id': invoice.id,
+                'hka_status': invoice.hka_status,
+                'hka_document_state': invoice.hka_document_state,
+                'numero_documento_fiscal': invoice.numero_documento_fiscal,
+                'cufe': invoice.hka_cufe,
+                'qr': invoice.hka_qr,
+                'qr_image_url': bool(invoice.hka_qr) and '/pos/hka_qr/%s.png' % invoice.id,
+                'nro_protocolo_autorizacion': invoice.hka_nro_protocolo_autorizacion,
+                'fecha_recepcion_dgi': fields.Datetime.to_string(invoice.hka_fecha_recepcion_dgi),
+                'image_url': (invoice.id, receipt_profile) in rendered and '/pos/hka_receipt/%s/%s.png' % (
+                    invoice.id, receipt_profile),
+            })
+        return result
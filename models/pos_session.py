@@ -1,92 +1,151 @@
 from odoo import models
+from odoo.osv import expression
+from odoo.tools import escape_psql
+from odoo.tools.misc import hmac
 import logging
+import re
 
 _logger = logging.getLogger(__name__)
 
+# HKA fields of res.partner the POS needs, in every partner load
+POS_PARTNER_HKA_FIELDS = [
+    'ruc', 'dv', 'tipo_contribuyente', 'tipo_cliente_fe',
+    'l10n_pa_distrito_id', 'l10n_pa_corregimiento_id',
+    'ruc_verified', 'ruc_verification_date',
+]
+PARTNER_BASE_FIELDS = [
+    'name', 'street', 'city', 'state_id', 'country_id', 'vat', 'lang',
+    'phone', 'zip', 'mobile', 'email', 'barcode', 'write_date',
+    'property_account_position_id', 'property_product_pricelist', 'parent_name',
+]
+# Largest page of get_hka_partners_delta
+PARTNER_DELTA_BATCH = 2000
+# Largest page of search_hka_partners
+PARTNER_SEARCH_LIMIT = 100
+# Queries searched as a RUC prefix: cédulas (8-123-456, 8AV-1-2, PE-1-23, E-8-123, N-19-22),
+# juridical RUCs (155612345-2-2021) and CF. Phones (6123-4567) and barcodes do not match.
+RUC_QUERY = re.compile(r'^(CF|(\d{1,2}(AV|PI)?|PE|E|N)-\d*(-\d*)?|\d+-\d+-\d*)$', re.IGNORECASE)
+# Fields of the stock POS partner search, for any other query
+PARTNER_SEARCH_FIELDS = ['name', 'parent_name', 'phone', 'mobile', 'email', 'barcode']
+
+
 class PosSession(models.Model):
     _inherit = 'pos.session'
 
-    def _get_pos_ui_pos_hkapdf(self, params):
-        return self.env['pos.hkapdf'].search_read(**params['search_params'])
+    def _get_hka_bus_channel(self):
+        """Bus channel of the session for HKA document notifications
+
+        Clients may listen to any channel name, so it is derived from the
+        database secret and cannot be guessed from the session id.
+        """
+        self.ensure_one()
+        return 'isfehka_pos_%s' % hmac(self.env(su=True), 'isfehka-pos-session', self.id)
 
     def _pos_data_process(self, loaded_data):
         result = super()._pos_data_process(loaded_data)
-        if 'res.partner' in loaded_data:
-            _logger.info("[ISFEHKA] Processing partners in _pos_data_process")
-            for partner in loaded_data['res.partner']:
-                if 'ruc' not in partner:
-                    partner['ruc'] = False
+        loaded_data['isfehka_bus_channel'] = self._get_hka_bus_channel()
+        # Distritos and corregimientos are fetched from this URL, cached by the browser
+        version = self.env['res.distrito.pa']._get_pos_location_catalog()[0]
+        loaded_data['isfehka_location_catalog_url'] = '/pos/hka_locations/%s.json' % version
         return result
 
     def _loader_params_res_partner(self):
         result = super()._loader_params_res_partner()
-        _logger.info("[ISFEHKA] _loader_params_res_partner before: %s", result)
-        new_fields = ['ruc', 'dv', 'tipo_contribuyente', 'tipo_cliente_fe',
-                     'l10n_pa_distrito_id', 'l10n_pa_corregimiento_id',
-                     'ruc_verified', 'ruc_verification_date']
-        for field in new_fields:
+        for field in POS_PARTNER_HKA_FIELDS:
             if field not in result['search_params']['fields']:
                 result['search_params']['fields'].append(field)
-        _logger.info("[ISFEHKA] _loader_params_res_partner after: %s", result)
         return result
 
     def _get_pos_ui_res_partner(self, params):
-        _logger.info("[ISFEHKA] _get_pos_ui_res_partner params: %s", params)
-        result = super()._get_pos_ui_res_partner(params)
-        _logger.info("[ISFEHKA] _get_pos_ui_res_partner result: %s", result)
-        return result
+        if not self.config_id.hka_partner_delta_sync:
+            return super()._get_pos_ui_res_partner(params)
+        # The client loads everyone else from its cache and get_hka_partners_delta
+        partner_ids = [res[0] for res in self.config_id.get_limited_partners_loading()]
+        return self.env['res.partner'].search_read([('id', 'in', partner_ids)],
+                                                   fields=params['search_params']['fields'])
 
-    def update_partner_from_ui(self, partner):
-        _logger.info("[ISFEHKA] Updating partner from UI with data: %s", partner)
-        result = super().update_partner_from_ui(partner)
-        _logger.info("[ISFEHKA] Partner update result: %s", result)
-        return result
+    def get_hka_partners_delta(self, cursor=None, limit=PARTNER_DELTA_BATCH):
+        """Partners changed since cursor, for the POS partner cache
 
-    def get_pos_ui_res_partner_by_params(self, params):
-        _logger.info("[ISFEHKA] get_pos_ui_res_partner_by_params params: %s", params)
-        fields_to_read = [
-            'name', 'street', 'city', 'state_id', 'country_id', 'vat', 'lang',
-            'phone', 'zip', 'mobile', 'email', 'barcode', 'write_date',
-            'property_account_position_id', 'property_product_pricelist', 'parent_name',
-            'ruc', 'dv', 'tipo_contribuyente', 'tipo_cliente_fe',
-            'l10n_pa_distrito_id', 'l10n_pa_corregimiento_id',
-            'ruc_verified', 'ruc_verification_date'
-        ]
-        params['fields'] = fields_to_read
-        result = self.env['res.partner'].search_read(**params)
-        _logger.info("[ISFEHKA] get_pos_ui_res_partner_by_params result length: %s", len(result))
-        return result
+        cursor is the value returned by the previous call, None for a full
+        sync. Partners are paged on (write_date, id), so rows sharing a
+        write_date are never skipped. Returns the partners in the loader's
+        format, the ids archived since the cursor, the next cursor, whether
+        more changes remain, and a signature of the field list: the client
+        drops its cache when the signature changes. The last page also gives
+        the number of partners the POS may load: when the client holds more,
+        some were deleted or left the domain, and it reconciles with
+        get_hka_partner_ids.
+        """
+        self.ensure_one()
+        params = self._loader_params_res_partner()['search_params']
+        limit = min(int(limit), PARTNER_DELTA_BATCH)
+        Partner = self.env['res.partner'].with_context(active_test=False)
+        query = Partner._search(params.get('domain') or [])
+        query.add_where('"res_partner"."write_date" IS NOT NULL')
+        if cursor:
+            query.add_where('("res_partner"."write_date", "res_partner"."id") > (%s, %s)',
+                            [cursor['write_date'], cursor['id']])
+        query.order = '"res_partner"."write_date", "res_partner"."id"'
+        query.limit = limit
+        self.env.cr.execute(query.select('"res_partner"."id"', '"res_partner"."write_date"', '"res_partner"."active"'))
+        rows = self.env.cr.fetchall()
 
-    def _pos_ui_models_to_load(self):
-        result = super()._pos_ui_models_to_load()
-        if 'res.distrito.pa' not in result:
-            result.append('res.distrito.pa')
-        if 'res.corregimiento.pa' not in result:
-            result.append('res.corregimiento.pa')
-        return result
-
-    def _loader_params_res_distrito_pa(self):
-        _logger.info("[ISFEHKA] Loading distrito params")
+        active_ids = [row[0] for row in rows if row[2]]
+        more = len(rows) == limit
         return {
-            'search_params': {
-                'fields': ['name', 'code', 'state_id'],
-                'domain': [],
-                'order': 'name asc',
-            },
+            'partners': self.env['res.partner'].browse(active_ids).read(params['fields']),
+            'archived_ids': [row[0] for row in rows if not row[2]],
+            'cursor': {'write_date': rows[-1][1].isoformat(' '), 'id': rows[-1][0]} if rows else cursor,
+            'more': more,
+            'count': None if more else self.env['res.partner'].search_count(self._get_hka_partner_cache_domain()),
+            'signature': ','.join(sorted(params['fields'])),
         }
 
-    def _loader_params_res_corregimiento_pa(self):
+    def get_hka_partner_ids(self):
+        """Ids of every partner the POS may keep in its cache
+
+        Only called when the cache holds partners the server no longer
+        counts, to drop those that were deleted or left the domain.
+        """
+        self.ensure_one()
+        return self.env['res.partner'].search(self._get_hka_partner_cache_domain()).ids
+
+    def _get_hka_partner_cache_domain(self):
+        # Active partners the delta can return (they have a write_date)
+        params = self._loader_params_res_partner()['search_params']
+        return list(params.get('domain') or []) + [('write_date', '!=', False)]
+
+    def search_hka_partners(self, query, dv=None, limit=30, offset=0):
+        """Search partners for the POS by RUC (and DV), one page at a time
+
+        A query shaped like a RUC matches it exactly or as a prefix, on the
+        text_pattern_ops index. Any other query searches the fields of the
+        stock POS search (name, served by the trigram index, phone, email,
+        barcode). Returns the partners in the loader's format and whether
+        more pages remain.
+        """
+        self.ensure_one()
+        params = self._loader_params_res_partner()['search_params']
+        limit = min(int(limit), PARTNER_SEARCH_LIMIT)
+        query = (query or '').strip()
+        if not query:
+            return {'partners': [], 'more': False}
+        domain = list(params.get('domain') or [])
+        if RUC_QUERY.match(query):
+            domain.append(('ruc', '=like', escape_psql(query.upper()) + '%'))
+            if dv:
+                domain.append(('dv', '=', dv.strip()))
+            order = 'ruc, id'
+        else:
+            domain += expression.OR([[(field, 'ilike', query)] for field in PARTNER_SEARCH_FIELDS])
+            order = 'name, id'
+        partners = self.env['res.partner'].search(domain, order=order, limit=limit + 1, offset=int(offset))
         return {
-            'search_params': {
-                'fields': ['name', 'code', 'distrito_id'],
-                'domain': [],
-                'order': 'name asc',
-            },
+            'partners': partners[:limit].read(params['fields']),
+            'more': len(partners) > limit,
         }
 
-    def _get_pos_ui_res_distrito_pa(self, params):
-        _logger.info("[ISFEHKA] Getting distrito data")
-        return self.env['res.distrito.pa'].search_read(**params['search_params'])
-
-    def _get_pos_ui_res_corregimiento_pa(self, params):
-        return self.env['res.corregimiento.pa'].search_read(**params['search_params'])
+    def get_pos_ui_res_partner_by_params(self, params):
+        params['fields'] = PARTNER_BASE_FIELDS + POS_PARTNER_HKA_FIELDS
+        return self.env['res.partner'].search_read(**params)
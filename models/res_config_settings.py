@@ -34,6 +34,18 @@ class ResConfigSettings(models.TransientModel):
         readonly=False,
         help='Enviar automáticamente facturas de cliente a HKA al confirmarlas.')
 
+    isfehka_outbox_concurrency = fields.Integer(
+        string='Envíos Simultáneos a HKA',
+        config_parameter='isfehka.outbox_concurrency',
+        default=4,
+        help='Número de facturas de la cola de envío que se envían a HKA en paralelo.')
+
+    isfehka_document_concurrency = fields.Integer(
+        string='Descargas Simultáneas de Documentos',
+        config_parameter='isfehka.document_concurrency',
+        default=4,
+        help='Número de facturas cuyos PDF y XML se descargan de HKA en paralelo.')
+
     isfehka_next_number = fields.Char(
         string='Próximo Número Fiscal HKA',
         help='Próximo número de documento fiscal a utilizar (10 dígitos). '
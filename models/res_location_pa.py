@@ -1,7 +1,46 @@
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
+import gzip
+import hashlib
+import json
+
+CATALOG_VERSION_PARAM = 'isfehka.location_catalog_version'
+
+
+class LocationCatalogMixin(models.AbstractModel):
+    _name = 'res.location.pa.mixin'
+    _description = 'Panama Location Catalog Invalidation'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._bump_location_catalog_version()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self._bump_location_catalog_version()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._bump_location_catalog_version()
+        return res
+
+    def _bump_location_catalog_version(self):
+        """Make every worker rebuild the POS location catalog, once per operation
+
+        Skipped while module data is loaded: the registry is reloaded afterwards.
+        """
+        if not self or self.env.context.get('install_mode') or self.pool._init:
+            return
+        params = self.env['ir.config_parameter'].sudo()
+        version = int(params.get_param(CATALOG_VERSION_PARAM, 0))
+        params.set_param(CATALOG_VERSION_PARAM, version + 1)
+
 
 class ResDistritoPa(models.Model):
     _name = 'res.distrito.pa'
+    _inherit = ['res.location.pa.mixin']
     _description = 'Distritos de Panamá'
     _order = 'state_id, code'
 
@@ -11,8 +50,31 @@ class ResDistritoPa(models.Model):
         domain="[('country_id.code', '=', 'PA')]")
     corregimiento_ids = fields.One2many('res.corregimiento.pa', 'distrito_id', 'Corregimientos')
 
+    @api.model
+    def _get_pos_location_catalog(self):
+        """(version, gzipped JSON) of every distrito and corregimiento, for the POS
+
+        Built once per worker and rebuilt after any change to either model;
+        the version is the content hash, so clients may cache it forever.
+        """
+        version = self.env['ir.config_parameter'].sudo().get_param(CATALOG_VERSION_PARAM, '0')
+        return self._build_pos_location_catalog(version)
+
+    @api.model
+    @tools.ormcache('version')
+    def _build_pos_location_catalog(self, version):
+        catalog = {
+            'distritos': self.sudo().search_read([], ['name', 'code', 'state_id'], order='name asc'),
+            'corregimientos': self.env['res.corregimiento.pa'].sudo().search_read(
+                [], ['name', 'code', 'distrito_id'], order='name asc'),
+        }
+        data = json.dumps(catalog, separators=(',', ':'), sort_keys=True).encode()
+        return hashlib.sha256(data).hexdigest()[:16], gzip.compress(data, mtime=0)
+
+
 class ResCorregimientoPa(models.Model):
     _name = 'res.corregimiento.pa'
+    _inherit = ['res.location.pa.mixin']
     _description = 'Corregimientos de Panamá'
     _order = 'distrito_id, code'
 
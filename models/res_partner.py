@@ -48,6 +48,21 @@ class ResPartner(models.Model):
         domain="[('distrito_id', '=', l10n_pa_distrito_id)]")
     codigo_ubicacion = fields.Char('Código de Ubicación', compute='_compute_codigo_ubicacion', store=True)
 
+    def init(self):
+        super().init()
+        # RUC lookups are exact or by prefix (=like 'abc%'), which needs text_pattern_ops
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS res_partner_ruc_pattern_index
+                ON res_partner (ruc text_pattern_ops, dv)
+             WHERE ruc IS NOT NULL
+        """)
+        # Name lookups are ilike '%abc%'; without --unaccent the ORM compares the plain column
+        if self.env.registry.has_trigram:
+            self.env.cr.execute("""
+                CREATE INDEX IF NOT EXISTS res_partner_name_trigram_index
+                    ON res_partner USING gin (name gin_trgm_ops)
+            """)
+
     @api.depends('state_id', 'l10n_pa_distrito_id', 'l10n_pa_corregimiento_id')
     def _compute_codigo_ubicacion(self):
         """Compute location code in format provincia-distrito-corregimiento"""
@@ -168,12 +183,13 @@ class ResPartner(models.Model):
     def create(self, vals_list):
         for vals in vals_list:
             if vals.get('ruc'):
-                vals['ruc'] = vals['ruc'].strip()
+                # Stored upper case: the POS RUC search is a case-sensitive prefix match
+                vals['ruc'] = vals['ruc'].strip().upper()
         return super().create(vals_list)
 
     def write(self, vals):
         if vals.get('ruc'):
-            vals['ruc'] = vals['ruc'].strip()
+            vals['ruc'] = vals['ruc'].strip().upper()
             # Only reset verification fields if they're not being explicitly set
             if 'ruc_verified' not in vals:
                 vals['ruc_verified'] = False
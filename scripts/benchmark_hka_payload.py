@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Benchmark HKA payload construction on large synthetic invoices
+
+Builds draft customer invoices of 10/100/1k/5k lines (explicit discounts,
+pricelist discounts, loyalty lines and rounding) in an Odoo database, with
+and without POS payments, and measures account.move._prepare_hka_data():
+median wall time, peak Python memory (tracemalloc) and SQL query count.
+Everything is rolled back at the end, nothing is posted or sent to HKA.
+
+Usage (with the Python environment Odoo runs in):
+    python3 scripts/benchmark_hka_payload.py -c /etc/odoo/odoo.conf -d mydb
+    python3 scripts/benchmark_hka_payload.py -c /etc/odoo/odoo.conf -d mydb --update-baseline
+
+Results are compared to scripts/benchmark_hka_payload_baseline.json. The run
+exits with status 1 when a metric exceeds its baseline by more than
+--tolerance, or when the payload itself changed (payload_sha256, computed
+without the emission dates), and with status 2 when there is no baseline. Baselines are machine specific: record them
+with --update-baseline on the machine that runs the comparison.
+"""
+import argparse
+import hashlib
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BASELINE_FILE = Path(__file__).with_name('benchmark_hka_payload_baseline.json')
+DEFAULT_SIZES = (10, 100, 1000, 5000)
+SCENARIOS = ('invoice', 'pos')
+# Fields that change on every run and are left out of the payload fingerprint
+VOLATILE_KEYS = ('fechaEmision', 'fechaSalida')
+
+
+def _strip_volatile(value):
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+
+def payload_fingerprint(data):
+    dump = json.dumps(_strip_volatile(data), sort_keys=True, default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+class PayloadBenchmark:
+    """Creates the synthetic records inside the given environment"""
+
+    def __init__(self, env):
+        self.env = env
+        self.company = env.company
+        self.products = env['product.product']
+        self._setup()
+
+    def _setup(self):
+        env = self.env
+        self.company.write({
+            'hka_branch_code': self.company.hka_branch_code or '0000',
+            'hka_pos_code': self.company.hka_pos_code or '001',
+        })
+        self.partner = env['res.partner'].create({
+            'name': 'Consumidor Final Benchmark',
+            'ruc': 'CF',
+            'tipo_cliente_fe': '02',
+            'country_id': env.ref('base.pa').id,
+        })
+        self.tax = env['account.tax'].create({
+            'name': 'ITBMS 7% Benchmark',
+            'amount': 7,
+            'amount_type': 'percent',
+            'type_tax_use': 'sale',
+            'company_id': self.company.id,
+        })
+        self.discount_product = self._product('Descuento Lealtad Benchmark', 0.0)
+
+    def _product(self, name, price):
+        return self.env['product.product'].create({
+            'name': name,
+            'lst_price': price,
+            'taxes_id': [(6, 0, self.tax.ids)],
+        })
+
+    def _ensure_products(self, count):
+        missing = count - len(self.products)
+        if missing > 0:
+            offset = len(self.products)
+            self.products |= self.env['product.product'].create([{
+                'name': 'Producto Benchmark %05d' % (offset + i),
+                'lst_price': 1.0 + ((offset + i) % 97) * 0.37,
+                'taxes_id': [(6, 0, self.tax.ids)],
+            } for i in range(missing)])
+        return self.products[:count]
+
+    def _line_vals(self, size):
+        lines = []
+        for index, product in enumerate(self._ensure_products(size)):
+            vals = {
+                'product_id': product.id,
+                'name': product.name,
+                'quantity': 1 + index % 5,
+                'price_unit': product.lst_price,
+                'tax_ids': [(6, 0, self.tax.ids)],
+            }
+            if index % 10 == 3:
+                vals['discount'] = 15.0
+            elif index % 10 == 7:
+                # Sold below list price, as a pricelist would
+                vals['price_unit'] = round(product.lst_price * 0.9, 2)
+            lines.append(vals)
+        # One loyalty/coupon line per 50 regular lines
+        for index in range(max(size // 50, 1)):
+            lines.append({
+                'product_id': self.discount_product.id,
+                'name': 'Cupon [BENCH-%d] 5%% descuento' % index,
+                'quantity': 1,
+                'price_unit': -1.25,
+                'tax_ids': [(6, 0, self.tax.ids)],
+            })
+        return lines
+
+    def _attach_pos_order(self, move):
+        config = self.env['pos.config'].search([('company_id', '=', self.company.id)], limit=1)
+        methods = config.payment_method_ids[:2]
+        if not methods:
+            return False
+        session = config.current_session_id or self.env['pos.session'].create({'config_id': config.id})
+        total = move.amount_total
+        order = self.env['pos.order'].create({
+            'session_id': session.id,
+            'partner_id': self.partner.id,
+            'account_move': move.id,
+            'amount_tax': move.amount_tax,
+            'amount_total': total,
+            'amount_paid': total + 5,
+            'amount_return': 5,
+        })
+        # Split payment plus change returned in cash, as the POS records it
+        first = round(total / 2, 2)
+        self.env['pos.payment'].create([
+            {'pos_order_id': order.id, 'payment_method_id': methods[0].id, 'amount': first + 5},
+            {'pos_order_id': order.id, 'payment_method_id': methods[-1].id, 'amount': total - first},
+            {'pos_order_id': order.id, 'payment_method_id': methods[0].id, 'amount': -5, 'is_change': True},
+        ])
+        return True
+
+    def build_invoice(self, size, scenario):
+        move = self.env['account.move'].create({
+            'move_type': 'out_invoice',
+            'partner_id': self.partner.id,
+            'tipo_documento': '01',
+            'naturaleza_operacion': '01',
+            'invoice_line_ids': [(0, 0, vals) for vals in self._line_vals(size)],
+        })
+        if scenario == 'pos' and not self._attach_pos_order(move):
+            return None
+        return move
+
+    def measure(self, move, repeat):
+        """Median time, peak memory and query count of _prepare_hka_data"""
+        cr = self.env.cr
+        timings = []
+        for _run in range(repeat):
+            # Cold ORM cache every run, so field fetches are part of the cost
+            self.env.invalidate_all()
+            started = time.perf_counter()
+            data = move._prepare_hka_data()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        self.env.invalidate_all()
+        queries_before = cr.sql_log_count
+        tracemalloc.start()
+        move._prepare_hka_data()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        queries = cr.sql_log_count - queries_before
+
+        return {
+            'lines': len(move.invoice_line_ids),
+            'time_ms': round(statistics.median(timings), 2),
+            'peak_kib': round(peak / 1024, 1),
+            'queries': queries,
+            'payload_sha256': payload_fingerprint(data),
+        }
+
+
+def compare(results, baseline, tolerance):
+    """Return the list of regressions of results against baseline"""
+    failures = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric in ('time_ms', 'peak_kib', 'queries'):
+            limit = previous[metric] * (1 + tolerance)
+            if current[metric] > limit:
+                failures.append('%s: %s %s > %s (baseline %s)' % (
+                    key, metric, current[metric], round(limit, 2), previous[metric]))
+        if current['payload_sha256'] != previous['payload_sha256']:
+            failures.append('%s: payload changed (sha256 %s, baseline %s)' % (
+                key, current['payload_sha256'][:12], previous['payload_sha256'][:12]))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-c', '--config', help='Odoo configuration file')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated invoice line counts (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per invoice, the median is kept')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative increase over the baseline (default: %(default)s)')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true', help='store this run as the new baseline')
+    args = parser.parse_args()
+    if not args.update_baseline and not args.baseline.exists():
+        # A comparison without a baseline must not pass silently
+        print('No baseline at %s, run with --update-baseline to record one' % args.baseline, file=sys.stderr)
+        return 2
+
+    from odoo import SUPERUSER_ID, api, netsvc
+    from odoo.modules.registry import Registry
+    from odoo.tools import config
+
+    config.parse_config(['-c', args.config] if args.config else [])
+    netsvc.init_logger()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    results = {}
+    with Registry(args.database).cursor() as cr:
+        try:
+            env = api.Environment(cr, SUPERUSER_ID, {'tracking_disable': True})
+            bench = PayloadBenchmark(env)
+            for scenario in SCENARIOS:
+                for size in sizes:
+                    move = bench.build_invoice(size, scenario)
+                    if move is None:
+                        print('%-14s skipped: no POS configuration with payment methods' % scenario)
+                        break
+                    key = '%s-%d' % (scenario, size)
+                    results[key] = bench.measure(move, args.repeat)
+                    print('%-14s %6d lines %10.2f ms %10.1f KiB %6d queries' % (
+                        key, results[key]['lines'], results[key]['time_ms'],
+                        results[key]['peak_kib'], results[key]['queries']))
+        finally:
+            cr.rollback()
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps({
+            'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'processor': platform.processor()},
+            'results': results,
+        }, indent=2, sort_keys=True) + '\n')
+        print('Baseline written to %s' % args.baseline)
+        return 0
+
+    failures = compare(results, json.loads(args.baseline.read_text())['results'], args.tolerance)
+    for failure in failures:
+        print('REGRESSION %s' % failure)
+    if not failures:
+        print('No regressions against %s' % args.baseline)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""Local stand-in for the HKA SOAP service
+
+Serves scripts/hka_mock_service.wsdl and answers Enviar, DescargaPDF,
+DescargaXML, AnulacionDocumento and ConsultarRucDV so that throughput and
+failure handling of hka.service can be measured without network access and
+without consuming folios on HKA's demo environment.
+
+Usage:
+    python3 scripts/hka_mock_server.py --port 8070 --latency 300 --error-rate 0.05
+
+Then point the HKA configuration's WSDL URL at
+    http://127.0.0.1:8070/ws/obj/v1.0/Service.svc?singleWsdl
+
+Counters per operation are available as JSON at /stats (add ?reset=1 to clear
+them between runs).
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+WSDL_FILE = Path(__file__).with_name('hka_mock_service.wsdl')
+SERVICE_PATH = '/ws/obj/v1.0/Service.svc'
+TNS = 'http://tempuri.org/'
+OPERATIONS = ('Enviar', 'DescargaPDF', 'DescargaXML', 'AnulacionDocumento', 'ConsultarRucDV')
+PANAMA_TZ = timezone(timedelta(hours=-5))
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _find_text(element, name, default=''):
+    """First descendant named `name` regardless of namespace"""
+    for child in element.iter():
+        if _local(child.tag) == name:
+            return child.text or default
+    return default
+
+
+def _envelope(operation, fields):
+    """Wrap a flat or nested dict in an <operation>Response/<operation>Result envelope"""
+    def render(value):
+        if isinstance(value, dict):
+            return ''.join('<%s>%s</%s>' % (k, render(v), k) for k, v in value.items() if v is not None)
+        return escape(str(value))
+
+    return (
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>'
+        '<{op}Response xmlns="{ns}"><{op}Result>{body}</{op}Result></{op}Response>'
+        '</s:Body></s:Envelope>'
+    ).format(op=operation, ns=TNS, body=render(fields)).encode()
+
+
+def _fault(message):
+    return (
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body><s:Fault>'
+        '<faultcode>s:Server</faultcode><faultstring>%s</faultstring>'
+        '</s:Fault></s:Body></s:Envelope>' % escape(message)
+    ).encode()
+
+
+class MockState:
+    """Settings, issued documents and counters shared by all handler threads"""
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.latency = {op: options.latency for op in OPERATIONS}
+        for override in options.op_latency:
+            op, _sep, value = override.partition('=')
+            if op not in self.latency:
+                raise SystemExit('Unknown operation in --op-latency: %s' % op)
+            self.latency[op] = float(value)
+        self.issued = {}
+        self.pdf_payload = self._padded(b'%PDF-1.4\n% hka mock\n', options.pdf_size * 1024, b'%%EOF\n')
+        self.xml_payload = self._padded(b'<?xml version="1.0" encoding="UTF-8"?><rFE><!-- ', options.xml_size * 1024, b' --></rFE>')
+        self.reset_stats()
+
+    @staticmethod
+    def _padded(head, size, tail):
+        return head + b' ' * max(size - len(head) - len(tail), 0) + tail
+
+    def reset_stats(self):
+        with self.lock:
+            self.started = time.time()
+            self.stats = {op: {'calls': 0, 'ok': 0, 'errors': 0, 'faults': 0, 'drops': 0, 'hangs': 0, 'seconds': 0.0}
+                          for op in OPERATIONS}
+
+    def count(self, operation, outcome, seconds=0.0):
+        with self.lock:
+            entry = self.stats[operation]
+            entry['calls'] += 1
+            entry[outcome] += 1
+            entry['seconds'] += seconds
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def delay(self, operation):
+        with self.lock:
+            jitter = self.random.uniform(-self.options.jitter, self.options.jitter)
+        return max(self.latency[operation] + jitter, 0) / 1000.0
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {
+                'elapsed_seconds': round(elapsed, 3),
+                'issued_documents': len(self.issued),
+                'operations': {
+                    op: dict(entry, seconds=round(entry['seconds'], 3),
+                             per_second=round(entry['calls'] / elapsed, 2) if elapsed else 0.0)
+                    for op, entry in self.stats.items()
+                },
+            }
+
+
+class HkaMockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'HkaMock/1.0'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        if not self.state.options.quiet:
+            super().log_message(format, *args)
+
+    def _reply(self, status, body, content_type='text/xml; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        if url.path == '/stats':
+            if query.get('reset'):
+                self.state.reset_stats()
+            return self._reply(200, json.dumps(self.state.snapshot(), indent=2).encode(), 'application/json')
+        if url.path == SERVICE_PATH and ('wsdl' in query or 'singleWsdl' in query):
+            host = self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]
+            wsdl = WSDL_FILE.read_text(encoding='utf-8').replace(
+                'http://localhost:8070' + SERVICE_PATH, 'http://%s%s' % (host, SERVICE_PATH))
+            return self._reply(200, wsdl.encode())
+        return self._reply(404, b'Not found\n', 'text/plain')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = self.rfile.read(length)
+        try:
+            body = ET.fromstring(payload).find('{http://schemas.xmlsoap.org/soap/envelope/}Body')
+            request = body[0]
+            operation = _local(request.tag)
+        except (ET.ParseError, TypeError, IndexError):
+            return self._reply(400, _fault('Malformed SOAP request'))
+        if operation not in OPERATIONS:
+            return self._reply(500, _fault('Unknown operation %s' % operation))
+
+        options = self.state.options
+        started = time.monotonic()
+        if self.state.roll(options.hang_rate):
+            # Longer than any sane client timeout: exercises request_timeout
+            time.sleep(options.hang_seconds)
+            self.state.count(operation, 'hangs', time.monotonic() - started)
+            self.close_connection = True
+            return
+        time.sleep(self.state.delay(operation))
+        if self.state.roll(options.drop_rate):
+            self.state.count(operation, 'drops', time.monotonic() - started)
+            self.close_connection = True
+            return
+        if self.state.roll(options.fault_rate):
+            self.state.count(operation, 'faults', time.monotonic() - started)
+            return self._reply(500, _fault('Simulated server error'))
+
+        if self.state.roll(options.error_rate):
+            fields = {'codigo': '500', 'resultado': 'error', 'mensaje': 'Error simulado por el servidor de pruebas'}
+        else:
+            fields = getattr(self, '_op_%s' % operation)(request)
+        outcome = 'ok' if fields.get('codigo') in ('200', '201') else 'errors'
+        self._reply(200, _envelope(operation, fields))
+        self.state.count(operation, outcome, time.monotonic() - started)
+
+    # Operations
+
+    @staticmethod
+    def _document_key(element):
+        return tuple(_find_text(element, name) for name in (
+            'codigoSucursalEmisor', 'puntoFacturacionFiscal', 'tipoDocumento', 'numeroDocumentoFiscal'))
+
+    def _op_Enviar(self, request):
+        key = self._document_key(request)
+        cufe = 'FE01%s' % hashlib.sha256('|'.join(key).encode()).hexdigest()[:62].upper()
+        with self.state.lock:
+            duplicate = key in self.state.issued and not self.state.options.allow_duplicates
+            if not duplicate:
+                self.state.issued[key] = cufe
+        if duplicate:
+            return {'codigo': '102', 'resultado': 'error',
+                    'mensaje': 'El documento %s ya fue enviado' % key[3]}
+        now = datetime.now(PANAMA_TZ)
+        return {
+            'codigo': '200',
+            'resultado': 'procesado',
+            'mensaje': 'Documento procesado por el servidor de pruebas',
+            'cufe': cufe,
+            'qr': 'https://dgi-fep-test.mef.gob.pa/Consultas/FacturasPorQR?chFE=%s' % cufe,
+            'fechaRecepcionDGI': now.strftime('%Y-%m-%dT%H:%M:%S-05:00'),
+            'nroProtocoloAutorizacion': str(int(now.timestamp() * 1000)),
+            'fechaLimite': (now + timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%S-05:00'),
+        }
+
+    def _download(self, payload):
+        return {
+            'codigo': '200',
+            'resultado': 'procesado',
+            'mensaje': 'Descarga exitosa',
+            'documento': base64.b64encode(payload).decode(),
+        }
+
+    def _op_DescargaPDF(self, request):
+        return self._download(self.state.pdf_payload)
+
+    def _op_DescargaXML(self, request):
+        return self._download(self.state.xml_payload)
+
+    def _op_AnulacionDocumento(self, request):
+        key = self._document_key(request)
+        with self.state.lock:
+            cancelled = self.state.issued.pop(key, None)
+        if not cancelled and not self.state.options.allow_duplicates:
+            return {'codigo': '103', 'resultado': 'error', 'mensaje': 'Documento %s no encontrado' % key[3]}
+        return {'codigo': '200', 'resultado': 'procesado', 'mensaje': 'Documento anulado'}
+
+    def _op_ConsultarRucDV(self, request):
+        ruc = _find_text(request, 'ruc')
+        dv = '%02d' % (sum(ord(c) for c in ruc) % 100)
+        return {
+            'infoRuc': {
+                'tipoRuc': _find_text(request, 'tipoRuc'),
+                'ruc': ruc,
+                'dv': dv,
+                'razonSocial': 'CONTRIBUYENTE DE PRUEBA %s' % ruc,
+                'afiliadoFE': 'SI',
+            },
+            'codigo': '200',
+            'resultado': 'procesado',
+            'mensaje': 'Consulta exitosa',
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8070)
+    parser.add_argument('--latency', type=float, default=150.0, help='base latency per call in ms')
+    parser.add_argument('--jitter', type=float, default=50.0, help='uniform +/- jitter added to the latency in ms')
+    parser.add_argument('--op-latency', action='append', default=[], metavar='OP=MS',
+                        help='latency override for one operation, e.g. Enviar=800 (repeatable)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered with codigo 500')
+    parser.add_argument('--fault-rate', type=float, default=0.0, help='share of calls answered with a SOAP fault (HTTP 500)')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='share of calls whose connection is closed without reply')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='share of calls that stall for --hang-seconds')
+    parser.add_argument('--hang-seconds', type=float, default=120.0)
+    parser.add_argument('--pdf-size', type=int, default=60, help='size of DescargaPDF documents in KiB')
+    parser.add_argument('--xml-size', type=int, default=16, help='size of DescargaXML documents in KiB')
+    parser.add_argument('--allow-duplicates', action='store_true',
+                        help='accept a fiscal number more than once instead of answering codigo 102')
+    parser.add_argument('--seed', type=int, help='seed for reproducible error injection')
+    parser.add_argument('--quiet', action='store_true', help='do not log every request')
+    options = parser.parse_args()
+
+    server = ThreadingHTTPServer((options.host, options.port), HkaMockHandler)
+    server.daemon_threads = True
+    server.state = MockState(options)
+    print('HKA mock listening on http://%s:%s%s?singleWsdl' % (options.host, options.port, SERVICE_PATH))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.state.snapshot(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
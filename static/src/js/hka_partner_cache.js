@@ -0,0 +1,140 @@
+/** @odoo-module */
+
+import { patch } from "@web/core/utils/patch";
+import { PosStore } from "@point_of_sale/app/store/pos_store";
+import { session } from "@web/session";
+
+// Partners are kept in IndexedDB between sessions; on open only the
+// partners changed since the last sync are downloaded, in the background.
+
+const CACHE_VERSION = 1;
+
+function promisify(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function openCache(name) {
+    const request = indexedDB.open(name, CACHE_VERSION);
+    request.onupgradeneeded = () => {
+        request.result.createObjectStore("partners", { keyPath: "id" });
+        request.result.createObjectStore("meta");
+    };
+    return promisify(request);
+}
+
+function transactionDone(transaction) {
+    return new Promise((resolve, reject) => {
+        transaction.oncomplete = () => resolve();
+        transaction.onerror = () => reject(transaction.error);
+        transaction.onabort = () => reject(transaction.error);
+    });
+}
+
+patch(PosStore.prototype, {
+    async afterProcessServerData() {
+        await super.afterProcessServerData(...arguments);
+        if (this.config.hka_partner_delta_sync && window.indexedDB) {
+            // Not awaited: the session opens with the frequent partners only
+            this._syncHkaPartners().catch((error) => {
+                console.warn("[ISFEHKA] Partner cache sync failed:", error);
+            });
+        }
+    },
+
+    async _syncHkaPartners() {
+        const db = await openCache(`isfehka_partners_${session.db}_${this.config.id}`);
+        const read = db.transaction(["partners", "meta"], "readonly");
+        let [partners, state] = await Promise.all([
+            promisify(read.objectStore("partners").getAll()),
+            promisify(read.objectStore("meta").get("state")),
+        ]);
+        if (partners.length) {
+            this.db.add_partners(partners);
+        }
+
+        let cursor = state && state.cursor;
+        let more = true;
+        while (more) {
+            const delta = await this.orm.call("pos.session", "get_hka_partners_delta", [
+                [this.pos_session.id],
+                cursor,
+            ]);
+            if (state && state.signature !== delta.signature) {
+                // The loaded fields changed: start over with a full sync
+                const reset = db.transaction(["partners", "meta"], "readwrite");
+                reset.objectStore("partners").clear();
+                reset.objectStore("meta").clear();
+                await transactionDone(reset);
+                this._removeHkaPartners(partners.map((partner) => partner.id));
+                partners = [];
+                state = null;
+                cursor = null;
+                continue;
+            }
+            if (delta.partners.length) {
+                this.db.add_partners(delta.partners);
+            }
+            if (delta.archived_ids.length) {
+                this._removeHkaPartners(delta.archived_ids);
+            }
+            const write = db.transaction(["partners", "meta"], "readwrite");
+            const store = write.objectStore("partners");
+            for (const partner of delta.partners) {
+                store.put(partner);
+            }
+            for (const id of delta.archived_ids) {
+                store.delete(id);
+            }
+            state = { cursor: delta.cursor, signature: delta.signature };
+            write.objectStore("meta").put(state, "state");
+            await transactionDone(write);
+            cursor = delta.cursor;
+            more = delta.more;
+            if (!more) {
+                await this._reconcileHkaPartners(db, delta.count);
+            }
+        }
+        db.close();
+    },
+
+    async _reconcileHkaPartners(db, count) {
+        // Deletions and partners leaving the domain never show up in the
+        // delta; the cache holding more partners than the server gives them away
+        const read = db.transaction("partners", "readonly");
+        const cachedIds = await promisify(read.objectStore("partners").getAllKeys());
+        if (count === null || cachedIds.length <= count) {
+            return;
+        }
+        const validIds = new Set(
+            await this.orm.call("pos.session", "get_hka_partner_ids", [[this.pos_session.id]])
+        );
+        const staleIds = cachedIds.filter((id) => !validIds.has(id));
+        if (!staleIds.length) {
+            return;
+        }
+        const write = db.transaction("partners", "readwrite");
+        const store = write.objectStore("partners");
+        for (const id of staleIds) {
+            store.delete(id);
+        }
+        await transactionDone(write);
+        this._removeHkaPartners(staleIds);
+    },
+
+    _removeHkaPartners(ids) {
+        // PosDB cannot remove partners: rebuild its indexes from the others
+        const removed = new Set(ids);
+        const loaded = Object.values(this.db.partner_by_id);
+        const remaining = loaded.filter((partner) => !removed.has(partner.id));
+        if (remaining.length === loaded.length) {
+            return;
+        }
+        this.db.partner_sorted = [];
+        this.db.partner_by_id = {};
+        this.db.partner_write_date = null;
+        this.db.add_partners(remaining);
+    },
+});
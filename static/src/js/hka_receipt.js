@@ -0,0 +1,44 @@
+/** @odoo-module */
+
+import { patch } from "@web/core/utils/patch";
+import { PosStore } from "@point_of_sale/app/store/pos_store";
+import { Order } from "@point_of_sale/app/store/models";
+
+// The fiscal section of the receipt is built from the data HKA returns on
+// sending (CUFE, protocol, QR); the HKA PDF is only kept for archival.
+
+patch(PosStore.prototype, {
+    async _save_to_server(orders, options) {
+        const result = await super._save_to_server(...arguments);
+        const references = orders
+            .filter((order) => order.data.to_invoice && !this.getHkaReceipt(order.data.name))
+            .map((order) => order.data.name);
+        if (references.length) {
+            // One call for the whole batch; later changes arrive over the bus
+            try {
+                const response = await this.env.services.rpc("/pos/hka_receipts", {
+                    pos_references: references,
+                });
+                for (const receipt of response.receipts || []) {
+                    if (receipt.invoice_id) {
+                        this._onHkaDocument(receipt);
+                    }
+                }
+            } catch (error) {
+                console.warn("[ISFEHKA] Could not fetch HKA receipt data:", error);
+            }
+        }
+        return result;
+    },
+});
+
+patch(Order.prototype, {
+    export_for_printing() {
+        const result = super.export_for_printing(...arguments);
+        const receipt = this.hka_receipt || this.pos.getHkaReceipt(this.name);
+        if (receipt && receipt.cufe) {
+            result.hka = receipt;
+        }
+        return result;
+    },
+});
@@ -10,20 +10,84 @@ import { _t } from "@web/core/l10n/translation";
 
 console.log("[ISFEHKA] Loading partner RUC extension");
 
+// Same as RUC_QUERY in models/pos_session.py
+const RUC_QUERY = /^(CF|(\d{1,2}(AV|PI)?|PE|E|N)-\d*(-\d*)?|\d+-\d+-\d*)$/i;
+// A RUC followed by its DV: "155612345-2-2021 DV 45" or "8-123-456 45"
+const RUC_DV_QUERY = /^(\S+)\s+(?:DV\s*)?(\d{1,2})$/i;
+
+function parseRucQuery(query) {
+    const trimmed = (query || "").trim();
+    if (RUC_QUERY.test(trimmed)) {
+        return { ruc: trimmed, dv: null };
+    }
+    const match = trimmed.match(RUC_DV_QUERY);
+    if (match && RUC_QUERY.test(match[1])) {
+        return { ruc: match[1], dv: match[2] };
+    }
+    return null;
+}
+
 patch(PosStore.prototype, {
     async _processData(loadedData) {
         await super._processData(...arguments);
         
-        if (loadedData['res.distrito.pa']) {
-            this.distritos = loadedData['res.distrito.pa'];
-            console.log("[ISFEHKA] Loaded distritos:", this.distritos);
+        // Content-hashed URL: after the first session the browser cache answers
+        this.distritos = [];
+        this.corregimientos = [];
+        if (loadedData['isfehka_location_catalog_url']) {
+            try {
+                const response = await fetch(loadedData['isfehka_location_catalog_url']);
+                const catalog = await response.json();
+                this.distritos = catalog.distritos;
+                this.corregimientos = catalog.corregimientos;
+            } catch (error) {
+                console.warn("[ISFEHKA] Could not load the location catalog:", error);
+            }
         }
+        this._indexHkaLocations();
 
-        if (loadedData['res.corregimiento.pa']) {
-            this.corregimientos = loadedData['res.corregimiento.pa'];
-            console.log("[ISFEHKA] Loaded corregimientos:", this.corregimientos);
+        // HKA data of this session's invoices is pushed by the server, no polling
+        this.hkaReceipts = {};
+        if (loadedData['isfehka_bus_channel']) {
+            const bus = this.env.services.bus_service;
+            bus.addChannel(loadedData['isfehka_bus_channel']);
+            bus.subscribe("isfehka/hka_document", (payload) => this._onHkaDocument(payload));
         }
-    }
+    },
+
+    _indexHkaLocations() {
+        // Built once, so the partner editor never scans the whole catalog
+        this.distritoById = new Map();
+        this.distritosByState = new Map();
+        this.corregimientosByDistrito = new Map();
+        for (const distrito of this.distritos) {
+            this.distritoById.set(distrito.id, distrito);
+            const stateId = distrito.state_id && distrito.state_id[0];
+            if (!this.distritosByState.has(stateId)) {
+                this.distritosByState.set(stateId, []);
+            }
+            this.distritosByState.get(stateId).push(distrito);
+        }
+        for (const corregimiento of this.corregimientos) {
+            const distritoId = corregimiento.distrito_id && corregimiento.distrito_id[0];
+            if (!this.corregimientosByDistrito.has(distritoId)) {
+                this.corregimientosByDistrito.set(distritoId, []);
+            }
+            this.corregimientosByDistrito.get(distritoId).push(corregimiento);
+        }
+    },
+
+    _onHkaDocument(payload) {
+        this.hkaReceipts[payload.pos_reference] = payload;
+        const order = this.get_order_list().find((o) => o.name === payload.pos_reference);
+        if (order) {
+            order.hka_receipt = payload;
+        }
+    },
+
+    getHkaReceipt(posReference) {
+        return this.hkaReceipts[posReference];
+    },
 });
 
 patch(PartnerListScreen.prototype, {
@@ -59,6 +123,24 @@ patch(PartnerListScreen.prototype, {
             ruc_verification_date: this.partner?.ruc_verification_date || false,
         };
     },
+
+    async getNewPartners() {
+        // Only RUC-shaped queries use the indexed RUC search; names, phones, emails
+        // and barcodes keep the stock search
+        const rucQuery = parseRucQuery(this.state.query);
+        if (!rucQuery) {
+            return super.getNewPartners(...arguments);
+        }
+        const result = await this.orm.silent.call("pos.session", "search_hka_partners", [
+            [this.pos.pos_session.id],
+            rucQuery.ruc,
+        ], {
+            dv: rucQuery.dv,
+            limit: 30,
+            offset: this.state.currentOffset || 0,
+        });
+        return result.partners;
+    },
 });
 
 patch(PartnerDetailsEdit.prototype, {
@@ -154,23 +236,22 @@ patch(PartnerDetailsEdit.prototype, {
             return;
         }
 
-        // Filter distritos by state
-        this.state.filteredDistritos = (this.pos.distritos || []).filter(
-            distrito => distrito.state_id && distrito.state_id[0] === parseInt(stateId)
-        );
+        this.state.filteredDistritos = this.pos.distritosByState.get(parseInt(stateId)) || [];
 
-        // If current distrito is not in filtered list, clear it
+        // If current distrito is not in the state, clear it
         if (this.changes.l10n_pa_distrito_id) {
-            const isValidDistrito = this.state.filteredDistritos.some(
-                d => d.id === parseInt(this.changes.l10n_pa_distrito_id)
-            );
-            if (!isValidDistrito) {
+            const distrito = this.pos.distritoById.get(parseInt(this.changes.l10n_pa_distrito_id));
+            if (!distrito || distrito.state_id[0] !== parseInt(stateId)) {
                 this.changes.l10n_pa_distrito_id = false;
                 this.changes.l10n_pa_corregimiento_id = false;
             }
         }
     },
 
+    get filteredCorregimientos() {
+        return this.pos.corregimientosByDistrito.get(parseInt(this.changes.l10n_pa_distrito_id)) || [];
+    },
+
     async verifyRUC() {
         console.log("[ISFEHKA] Starting RUC verification");
         console.log("[ISFEHKA] Initial verification state:", {
@@ -378,7 +459,8 @@ patch(PartnerDetailsEdit.prototype, {
         
         // Update local partner data if save was successful
         if (result !== false && partnerId) {
-            const partner = this.pos.partners.find(p => p.id === partnerId);
+            // partner_by_id of the POS database, kept current as partners are synced
+            const partner = this.pos.db.get_partner_by_id(partnerId);
             if (partner) {
                 Object.assign(partner, processedChanges);
             }
@@ -0,0 +1,7 @@
+from . import test_hka_outbox
+from . import test_hka_payload
+from . import test_hka_number_range
+from . import test_hka_journal
+from . import test_pos_hka_receipts
+from . import test_pos_partner_delta
+from . import test_pos_partner_search
@@ -0,0 +1,41 @@
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import HttpCase
+
+
+class IsfehkaTestCommon(AccountTestInvoicingCommon):
+    """Company with an HKA configuration; invoices are only sent when a test says so"""
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.company = cls.company_data['company']
+        cls.hka_config = cls._create_hka_configuration()
+        cls.company.write({
+            'hka_configuration_id': cls.hka_config.id,
+            'hka_auto_send_on_post': False,
+        })
+
+    @classmethod
+    def _create_hka_configuration(cls, **vals):
+        return cls.env['isfehka.configuration'].create({
+            'name': 'HKA Pruebas',
+            'token_empresa': 'empresa',
+            'token_password': 'password',
+            'next_number': '0000000001',
+            **vals,
+        })
+
+    @classmethod
+    def _create_pos_session(cls, **config_vals):
+        config = cls.env['pos.config'].create({'name': 'Caja HKA', **config_vals})
+        return cls.env['pos.session'].create({'config_id': config.id, 'user_id': cls.env.uid})
+
+    def _enter_registry_test_mode(self):
+        """Let the cursors opened by the code under test see this test's transaction"""
+        self.env.flush_all()
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+
+class IsfehkaHttpTestCommon(IsfehkaTestCommon, HttpCase):
+    pass
@@ -0,0 +1,118 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.isfehka.models.hka_journal import RECOVERY_DELAY_MINUTES
+from .common import IsfehkaTestCommon
+
+HKA_DATA = {
+    'cufe': 'FE0120000155612345-2-2021-0000000042',
+    'qr': 'https://dgi-fep.mef.gob.pa/Consultas/FacturasPorQR?chFE=FE0120000155612345',
+    'nroProtocoloAutorizacion': '20240000000000001234',
+    'fechaRecepcionDGI': '2024-01-15T10:30:00-05:00',
+}
+
+
+@tagged('post_install', '-at_install')
+class TestHkaJournal(IsfehkaTestCommon):
+
+    def setUp(self):
+        super().setUp()
+        self.invoice = self.init_invoice('out_invoice', products=self.product_a, post=True)
+        self.invoice.numero_documento_fiscal = '0000000042'
+        self.Journal = self.env['hka.journal']
+        self._enter_registry_test_mode()
+
+    def _record(self, move, data=HKA_DATA, age_minutes=RECOVERY_DELAY_MINUTES + 1):
+        self.env.flush_all()
+        entry = self.Journal.browse(self.Journal._record(move, data))
+        entry.date = fields.Datetime.now() - timedelta(minutes=age_minutes)
+        return entry
+
+    def _recover(self):
+        self.Journal._cron_recover_journal()
+        self.env.invalidate_all()
+
+    def test_find_pending(self):
+        entry = self._record(self.invoice)
+        pending = self.Journal._find_pending(self.invoice)
+        self.assertEqual(pending['id'], entry.id)
+        self.assertEqual(pending['cufe'], HKA_DATA['cufe'])
+        self.assertEqual(pending['numero_documento_fiscal'], '0000000042')
+
+        # An entry whose CUFE the invoice already has is not pending for it
+        self.invoice.hka_cufe = HKA_DATA['cufe']
+        self.env.flush_all()
+        self.assertIsNone(self.Journal._find_pending(self.invoice))
+
+    def test_recover_lost_acceptance(self):
+        entry = self._record(self.invoice)
+        self.invoice.numero_documento_fiscal = False
+
+        self._recover()
+        self.assertRecordValues(self.invoice, [{
+            'hka_status': 'sent',
+            'hka_cufe': HKA_DATA['cufe'],
+            'hka_qr': HKA_DATA['qr'],
+            'hka_nro_protocolo_autorizacion': HKA_DATA['nroProtocoloAutorizacion'],
+            'numero_documento_fiscal': '0000000042',
+        }])
+        self.assertEqual(self.invoice.hka_fecha_recepcion_dgi, fields.Datetime.to_datetime('2024-01-15 10:30:00'))
+        self.assertEqual(entry.state, 'applied')
+        self.assertTrue(entry.date_applied)
+
+    def test_recent_entry_waits(self):
+        """The sending transaction may still commit"""
+        entry = self._record(self.invoice, age_minutes=0)
+        self._recover()
+        self.assertEqual(entry.state, 'pending')
+        self.assertNotEqual(self.invoice.hka_status, 'sent')
+
+    def test_already_applied_entry(self):
+        entry = self._record(self.invoice)
+        self.invoice.write({'hka_status': 'sent', 'hka_cufe': HKA_DATA['cufe'], 'hka_message': 'Enviado'})
+
+        self._recover()
+        self.assertEqual(entry.state, 'applied')
+        self.assertEqual(self.invoice.hka_message, 'Enviado')
+
+    def test_conflicting_entry(self):
+        entry = self._record(self.invoice)
+        self.invoice.write({'hka_status': 'sent', 'hka_cufe': 'FE-OTRO-CUFE'})
+
+        self._recover()
+        self.assertEqual(entry.state, 'conflict')
+        self.assertIn('FE-OTRO-CUFE', entry.note)
+        self.assertEqual(self.invoice.hka_cufe, 'FE-OTRO-CUFE')
+
+    def test_orphan_entry(self):
+        draft = self.init_invoice('out_invoice', products=self.product_a)
+        entry = self._record(draft)
+        draft.unlink()
+
+        self._recover()
+        self.assertEqual(entry.state, 'orphan')
+
+    def test_mark_applied_on_commit(self):
+        entry = self._record(self.invoice)
+        self.Journal._mark_applied_on_commit(entry.id)
+        self.assertEqual(entry.state, 'pending')
+
+        self.env.cr.postcommit.run()
+        entry.invalidate_recordset()
+        self.assertEqual(entry.state, 'applied')
+
+    def test_send_applies_pending_entry(self):
+        """A new send applies HKA's earlier acceptance instead of sending again"""
+        def send_invoice(service, *args, **kwargs):
+            raise AssertionError('The invoice must not be sent again')
+        self.patch(self.registry['hka.service'], 'send_invoice', send_invoice)
+        entry = self._record(self.invoice, age_minutes=0)
+
+        self.invoice._send_to_hka()
+        self.assertRecordValues(self.invoice, [{'hka_status': 'sent', 'hka_cufe': HKA_DATA['cufe']}])
+
+        self.env.cr.postcommit.run()
+        entry.invalidate_recordset()
+        self.assertEqual(entry.state, 'applied')
@@ -0,0 +1,118 @@
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from odoo.addons.isfehka.models.hka_number_range import _BLOCKS
+from .common import IsfehkaTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestHkaNumberRange(IsfehkaTestCommon):
+
+    def setUp(self):
+        super().setUp()
+        self._enter_registry_test_mode()
+        # Blocks live in the worker's memory, keyed on the configuration id
+        self.addCleanup(lambda: [_BLOCKS.pop(key) for key in list(_BLOCKS)
+                                 if key[0] == self.cr.dbname and key[1] == self.hka_config.id])
+
+    def _take(self, count=1):
+        self.env.flush_all()
+        numbers = [self.hka_config.get_and_increment_next_number('001') for dummy in range(count)]
+        self.env.invalidate_all()
+        return numbers
+
+    def _ranges(self):
+        return self.env['hka.number.range'].search([('configuration_id', '=', self.hka_config.id)], order='id')
+
+    def test_single_numbers(self):
+        self.assertEqual(self._take(2), ['0000000001', '0000000002'])
+        self.assertEqual(self.hka_config.next_number, '0000000003')
+        self.assertFalse(self._ranges())
+
+    def test_block_reservation(self):
+        self.hka_config.write({'next_number': '0000000010', 'number_block_size': 5})
+
+        self.assertEqual(self._take(), ['0000000010'])
+        self.assertEqual(self.hka_config.next_number, '0000000015')
+        self.assertRecordValues(self._ranges(), [
+            {'first_number': '0000000010', 'last_number': '0000000014', 'size': 5, 'state': 'active', 'pos_code': '001'},
+        ])
+
+        # The rest of the block is served from memory
+        self.assertEqual(self._take(4), ['0000000011', '0000000012', '0000000013', '0000000014'])
+        self.assertEqual(self.hka_config.next_number, '0000000015')
+        self.assertEqual(len(self._ranges()), 1)
+
+        self.assertEqual(self._take(), ['0000000015'])
+        self.assertRecordValues(self._ranges(), [
+            {'first_number': '0000000010', 'last_number': '0000000014', 'state': 'exhausted'},
+            {'first_number': '0000000015', 'last_number': '0000000019', 'state': 'active'},
+        ])
+
+    def test_blocks_per_pos_code(self):
+        self.hka_config.write({'next_number': '0000000010', 'number_block_size': 5})
+        self.env.flush_all()
+        self.assertEqual(self.hka_config.get_and_increment_next_number('001'), '0000000010')
+        self.assertEqual(self.hka_config.get_and_increment_next_number('002'), '0000000015')
+        self.assertEqual(self.hka_config.get_and_increment_next_number('001'), '0000000011')
+
+    def test_expired_block_gaps(self):
+        self.hka_config.write({'next_number': '0000000010', 'number_block_size': 5})
+        self.assertEqual(self._take(2), ['0000000010', '0000000011'])
+        invoice = self.init_invoice('out_invoice', products=self.product_a)
+        invoice.numero_documento_fiscal = '0000000010'
+
+        # Past the TTL the block is released and its leftover numbers are reported
+        self.env['ir.config_parameter'].sudo().set_param('isfehka.number_range_ttl_hours', '0')
+        self.assertEqual(self._take(), ['0000000015'])
+        expired, active = self._ranges()
+        self.assertRecordValues(expired + active, [
+            {'state': 'expired', 'used_count': 1, 'unused_count': 4, 'unused_numbers': '0000000011 - 0000000014'},
+            {'state': 'active', 'used_count': 0, 'unused_count': 5, 'unused_numbers': False},
+        ])
+        self.assertTrue(expired.date_released)
+
+        self.env['account.move'].create({
+            'move_type': 'out_invoice',
+            'partner_id': self.partner_a.id,
+            'numero_documento_fiscal': '0000000013',
+        })
+        self.env.flush_all()
+        expired.invalidate_recordset()
+        self.assertEqual(expired.unused_numbers, '0000000011 - 0000000012\n0000000014')
+
+    def test_gc_expired_ranges(self):
+        self.hka_config.number_block_size = 5
+        self._take()
+        rng = self._ranges()
+        self.env['ir.config_parameter'].sudo().set_param('isfehka.number_range_ttl_hours', '-1')
+        rng._gc_expired_ranges()
+        self.assertEqual(rng.state, 'expired')
+
+    def test_single_number_exhaustion(self):
+        self.hka_config.next_number = '9999999998'
+        self.assertEqual(self._take(), ['9999999998'])
+        with self.assertRaisesRegex(UserError, 'Se agotaron'):
+            self._take()
+        self.assertEqual(self.hka_config.next_number, '9999999999')
+
+    def test_block_exhaustion(self):
+        self.hka_config.write({'next_number': '9999999996', 'number_block_size': 5})
+        with self.assertRaisesRegex(UserError, 'Se agotaron'):
+            self._take()
+        self.env.invalidate_all()
+        self.assertEqual(self.hka_config.next_number, '9999999996')
+        self.assertFalse(self._ranges())
+
+        # A smaller block still fits
+        self.hka_config.number_block_size = 3
+        self.assertEqual(self._take(3), ['9999999996', '9999999997', '9999999998'])
+
+    def test_invalid_counter(self):
+        self.env.flush_all()
+        # Bypasses the constraint, like a counter edited in the database
+        self.cr.execute("UPDATE isfehka_configuration SET next_number = '00000000AB' WHERE id = %s",
+                        [self.hka_config.id])
+        self.env.invalidate_all()
+        with self.assertRaisesRegex(UserError, 'válido'):
+            self._take()
@@ -0,0 +1,144 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from odoo.addons.isfehka.models.hka_outbox import MAX_ATTEMPTS
+from .common import IsfehkaTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestHkaOutbox(IsfehkaTestCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.invoice_a = cls.init_invoice('out_invoice', products=cls.product_a, post=True)
+        cls.invoice_b = cls.init_invoice('out_invoice', products=cls.product_a, post=True)
+        cls.Outbox = cls.env['hka.outbox']
+
+    def _patch_send(self, error=None):
+        """Replace the HKA call; returns the list of invoices it was called for"""
+        calls = []
+
+        def _send_to_hka(move):
+            calls.append(move.id)
+            if error:
+                raise UserError(error)
+        self.patch(self.registry['account.move'], '_send_to_hka', _send_to_hka)
+        return calls
+
+    def _process(self, item):
+        """Run _process_item on its own cursor, like the outbox workers"""
+        self.env.flush_all()
+        with self.registry.cursor() as cr:
+            item.with_env(item.env(cr=cr))._process_item()
+        self.env.invalidate_all()
+
+    def _claim_and_process(self, item):
+        item.next_attempt = fields.Datetime.now() - timedelta(days=1)
+        self.assertEqual(self.Outbox._claim(10), [item.id])
+        self._process(item)
+
+    def test_claim_due_items(self):
+        item_a, item_b = self.Outbox._enqueue(self.invoice_a + self.invoice_b)
+        item_b.next_attempt = fields.Datetime.now() + timedelta(hours=1)
+
+        self.assertEqual(self.Outbox._claim(10), [item_a.id])
+        self.assertRecordValues(item_a + item_b, [
+            {'state': 'processing', 'attempts': 1},
+            {'state': 'pending', 'attempts': 0},
+        ])
+        # Claimed items are not claimed again while their worker may be running
+        self.assertEqual(self.Outbox._claim(10), [])
+
+    def test_claim_limit(self):
+        item_a, item_b = self.Outbox._enqueue(self.invoice_a + self.invoice_b)
+        self.assertEqual(self.Outbox._claim(1), [item_a.id])
+        self.assertEqual(self.Outbox._claim(1), [item_b.id])
+
+    def test_enqueue_skips_queued_invoices(self):
+        item = self.Outbox._enqueue(self.invoice_a)
+        self.assertFalse(self.Outbox._enqueue(self.invoice_a))
+        self.Outbox._claim(10)
+        self.assertFalse(self.Outbox._enqueue(self.invoice_a))
+        self.assertEqual(self.Outbox.search([('move_id', '=', self.invoice_a.id)]), item)
+
+    def test_claim_stale_processing_items(self):
+        item = self.Outbox._enqueue(self.invoice_a)
+        self.Outbox._claim(10)
+        # The worker died long ago
+        item.date_started = fields.Datetime.now() - timedelta(days=1)
+
+        self.assertEqual(self.Outbox._claim(10), [item.id])
+        self.assertRecordValues(item, [{'state': 'processing', 'attempts': 2}])
+
+    def test_process_success(self):
+        calls = self._patch_send()
+        item = self.Outbox._enqueue(self.invoice_a)
+        self._enter_registry_test_mode()
+
+        self._claim_and_process(item)
+        self.assertEqual(calls, [self.invoice_a.id])
+        self.assertRecordValues(item, [{'state': 'done', 'attempts': 1, 'last_error': False}])
+        self.assertTrue(item.date_done)
+
+    def test_process_sent_invoice(self):
+        calls = self._patch_send()
+        item = self.Outbox._enqueue(self.invoice_a)
+        self.invoice_a.hka_status = 'sent'
+        self._enter_registry_test_mode()
+
+        self._claim_and_process(item)
+        self.assertEqual(calls, [])
+        self.assertEqual(item.state, 'done')
+
+    def test_process_cancelled_invoice(self):
+        calls = self._patch_send()
+        item = self.Outbox._enqueue(self.invoice_a)
+        self.invoice_a.button_draft()
+        self._enter_registry_test_mode()
+
+        self._claim_and_process(item)
+        self.assertEqual(calls, [])
+        self.assertEqual(item.state, 'cancelled')
+
+    def test_retry_backoff(self):
+        self._patch_send(error='HKA no responde')
+        item = self.Outbox._enqueue(self.invoice_a)
+        self._enter_registry_test_mode()
+
+        for attempt in range(1, MAX_ATTEMPTS):
+            before = fields.Datetime.now()
+            self._claim_and_process(item)
+            self.assertRecordValues(item, [{
+                'state': 'pending',
+                'attempts': attempt,
+                'last_error': 'HKA no responde',
+            }])
+            self.assertAlmostEqual(item.next_attempt, before + timedelta(minutes=2 ** attempt),
+                                   delta=timedelta(minutes=1))
+            self.assertNotEqual(self.invoice_a.hka_status, 'error')
+
+        self._claim_and_process(item)
+        self.assertRecordValues(item, [{'state': 'error', 'attempts': MAX_ATTEMPTS}])
+        self.assertRecordValues(self.invoice_a, [{'hka_status': 'error', 'hka_message': 'HKA no responde'}])
+
+    def test_last_attempt_keeps_journaled_invoice(self):
+        """An invoice HKA accepted is recovered from the journal, not marked in error"""
+        self._patch_send(error='Error al guardar la respuesta')
+        self.patch(self.registry['hka.journal'], '_find_pending', lambda journal, move: {'id': 1})
+        item = self.Outbox._enqueue(self.invoice_a)
+        item.attempts = MAX_ATTEMPTS - 1
+        self._enter_registry_test_mode()
+
+        self._claim_and_process(item)
+        self.assertEqual(item.state, 'error')
+        self.assertNotEqual(self.invoice_a.hka_status, 'error')
+
+    def test_retry_action(self):
+        item = self.Outbox._enqueue(self.invoice_a)
+        item.write({'state': 'error', 'attempts': MAX_ATTEMPTS})
+        item.action_retry()
+        self.assertRecordValues(item, [{'state': 'pending', 'attempts': 0, 'next_attempt': False}])
@@ -0,0 +1,178 @@
+from odoo import Command
+from odoo.tests import tagged
+
+from .common import IsfehkaTestCommon
+
+
+def _previous_items(move):
+    """HKA items as built before _compile_hka_lines, the reference for the parity tests"""
+    items = []
+    for line in move.invoice_line_ids:
+        if not line.quantity or move._is_discount_line(line):
+            continue
+        original_price = line.price_unit
+        discount_amount = 0.0
+        if line.discount:
+            discount_amount = (line.price_unit * line.discount) / 100
+        elif line.product_id and line.product_id.lst_price > 0:
+            list_price = line.product_id.lst_price
+            if line.price_unit < list_price:
+                original_price = list_price
+                discount_amount = list_price - line.price_unit
+        precio_item = (original_price - discount_amount) * line.quantity
+        valor_itbms = line.price_total - line.price_subtotal
+        items.append({
+            'descripcion': move._sanitize_hka_text(line.name),
+            'cantidad': '{:.3f}'.format(line.quantity),
+            'precioUnitario': '{:.3f}'.format(original_price),
+            'precioUnitarioDescuento': '{:.3f}'.format(discount_amount),
+            'precioItem': '{:.2f}'.format(precio_item),
+            'valorTotal': '{:.2f}'.format(precio_item + valor_itbms),
+            'tasaITBMS': move._get_tax_rate(line),
+            'valorITBMS': '{:.2f}'.format(valor_itbms),
+        })
+    rounding_amount = move.amount_total - sum(line.price_total for line in move.invoice_line_ids)
+    if abs(rounding_amount) >= 0.01 and rounding_amount > 0:
+        items.append({
+            'descripcion': 'Ajuste por Redondeo',
+            'cantidad': '1.000',
+            'precioUnitario': '{:.3f}'.format(abs(rounding_amount)),
+            'precioUnitarioDescuento': '0.000',
+            'precioItem': '{:.2f}'.format(abs(rounding_amount)),
+            'valorTotal': '{:.2f}'.format(abs(rounding_amount)),
+            'tasaITBMS': '00',
+            'valorITBMS': '0.00',
+        })
+    return items
+
+
+def _previous_totals(move):
+    """Totals computed from the previous items, as before _compile_hka_lines"""
+    items = _previous_items(move)
+    rounding_amount = move.amount_total - sum(line.price_total for line in move.invoice_line_ids)
+    total_todos_items = sum(float(item['valorTotal']) for item in items)
+    total_precio_neto = sum(float(item['precioItem']) for item in items)
+    total_itbms = sum(float(item['valorITBMS']) for item in items)
+    discount_lines = move.invoice_line_ids.filtered(move._is_discount_line)
+    total_discounts = abs(sum(discount_lines.mapped('price_total')))
+    if rounding_amount < -0.01:
+        total_discounts += abs(rounding_amount)
+    regular_items = len(move.invoice_line_ids.filtered(
+        lambda line: line.quantity > 0 and not move._is_discount_line(line)))
+    discounts = [{
+        'descDescuento': move._sanitize_hka_text(line.name or line.product_id.name or 'Descuento')[:30],
+        'montoDescuento': '{:.2f}'.format(abs(line.price_total)),
+    } for line in discount_lines]
+    if rounding_amount < -0.01:
+        discounts.append({
+            'descDescuento': 'Ajuste por Redondeo',
+            'montoDescuento': '{:.2f}'.format(abs(rounding_amount)),
+        })
+    return {
+        'totalPrecioNeto': '{:.2f}'.format(total_precio_neto),
+        'totalITBMS': '{:.2f}'.format(total_itbms),
+        'totalMontoGravado': '{:.2f}'.format(total_itbms),
+        'totalDescuento': '{:.2f}'.format(total_discounts) if total_discounts > 0 else '',
+        'totalFactura': '{:.2f}'.format(total_todos_items - total_discounts),
+        'nroItems': str(regular_items + (1 if rounding_amount > 0.01 else 0)),
+        'totalTodosItems': '{:.2f}'.format(total_todos_items),
+        'listaDescBonificacion': discounts and {'descuentoBonificacion': discounts},
+    }
+
+
+@tagged('post_install', '-at_install')
+class TestHkaPayload(IsfehkaTestCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.tax_7 = cls.env['account.tax'].create({
+            'name': 'ITBMS 7%',
+            'amount': 7,
+            'type_tax_use': 'sale',
+            'company_id': cls.company.id,
+        })
+        cls.loyalty_product = cls.env['product.product'].create({
+            'name': 'Descuento Lealtad',
+            'type': 'service',
+            'lst_price': 0.0,
+        })
+
+    def _create_invoice(self, lines, **vals):
+        return self.env['account.move'].create({
+            'move_type': 'out_invoice',
+            'partner_id': self.partner_a.id,
+            'invoice_date': '2024-01-15',
+            'invoice_line_ids': [Command.create({'tax_ids': [Command.set(self.tax_7.ids)], **line})
+                                 for line in lines],
+            **vals,
+        })
+
+    def _create_cash_rounding(self, method):
+        return self.env['account.cash.rounding'].create({
+            'name': 'Redondeo 0.05',
+            'rounding': 0.05,
+            'strategy': 'add_invoice_line',
+            'rounding_method': method,
+            'profit_account_id': self.company_data['default_account_revenue'].id,
+            'loss_account_id': self.company_data['default_account_expense'].id,
+        })
+
+    def assertPayloadParity(self, invoice):
+        items = invoice._prepare_hka_items_data()
+        self.assertEqual(items, _previous_items(invoice))
+        totals = invoice._prepare_hka_totals_data()
+        expected = _previous_totals(invoice)
+        self.assertEqual(totals.get('listaDescBonificacion', []), expected.pop('listaDescBonificacion'))
+        self.assertEqual({key: totals[key] for key in expected}, expected)
+        # The single pass gives the same totals as the separate calls
+        compiled = invoice._compile_hka_lines()
+        self.assertEqual(compiled['items'], items)
+        self.assertEqual(invoice._prepare_hka_totals_data(compiled), totals)
+        return items, totals
+
+    def test_discounts_parity(self):
+        invoice = self._create_invoice([
+            # Explicit discount
+            {'product_id': self.product_a.id, 'quantity': 2, 'price_unit': 1000.0, 'discount': 10},
+            # Pricelist discount: sold under the list price
+            {'product_id': self.product_b.id, 'quantity': 3, 'price_unit': self.product_b.lst_price - 12.5},
+            # Loyalty reward
+            {'product_id': self.loyalty_product.id, 'name': 'Recompensa [LOY] ñandú', 'quantity': 1,
+             'price_unit': -25.0},
+            # Skipped, but its price still counts for the rounding
+            {'product_id': self.product_a.id, 'quantity': 0, 'price_unit': 1000.0},
+        ])
+        items, totals = self.assertPayloadParity(invoice)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0]['precioUnitarioDescuento'], '100.000')
+        self.assertEqual(items[1]['precioUnitarioDescuento'], '12.500')
+        self.assertEqual(totals['nroItems'], '2')
+        self.assertEqual(totals['totalDescuento'], '26.75')
+
+    def test_rounding_up_parity(self):
+        invoice = self._create_invoice(
+            [{'product_id': self.product_a.id, 'quantity': 1, 'price_unit': 10.03}],
+            invoice_cash_rounding_id=self._create_cash_rounding('UP').id,
+        )
+        items, totals = self.assertPayloadParity(invoice)
+        self.assertEqual(items[-1]['descripcion'], 'Ajuste por Redondeo')
+        self.assertEqual(totals['nroItems'], '2')
+
+    def test_rounding_down_parity(self):
+        invoice = self._create_invoice(
+            [{'product_id': self.product_a.id, 'quantity': 1, 'price_unit': 10.03}],
+            invoice_cash_rounding_id=self._create_cash_rounding('DOWN').id,
+        )
+        items, totals = self.assertPayloadParity(invoice)
+        self.assertEqual(len(items), 1)
+        self.assertEqual(totals['listaDescBonificacion']['descuentoBonificacion'][-1]['descDescuento'],
+                         'Ajuste por Redondeo')
+
+    def test_many_lines_parity(self):
+        invoice = self._create_invoice([
+            {'product_id': self.product_a.id, 'quantity': 1 + index % 3, 'price_unit': 0.33 * (index + 1),
+             'discount': index % 4 * 5}
+            for index in range(40)
+        ])
+        self.assertPayloadParity(invoice)
@@ -0,0 +1,103 @@
+from odoo import Command
+from odoo.tests import tagged
+
+from odoo.addons.isfehka.controllers.main import MAX_RECEIPTS_PER_CALL
+from .common import IsfehkaHttpTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPosHkaReceipts(IsfehkaHttpTestCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.env.ref('base.user_admin').write({
+            'company_ids': [Command.link(cls.company.id)],
+            'company_id': cls.company.id,
+        })
+        cls.pos_session = cls._create_pos_session()
+        cls.invoice_sent = cls.init_invoice('out_invoice', products=cls.product_a, post=True)
+        cls.invoice_sent.write({
+            'hka_status': 'sent',
+            'numero_documento_fiscal': '0000000042',
+            'hka_cufe': 'FE0120000155612345-2-2021-0000000042',
+            'hka_qr': 'https://dgi-fep.mef.gob.pa/Consultas/FacturasPorQR?chFE=FE0120000155612345',
+        })
+        cls.invoice_pending = cls.init_invoice('out_invoice', products=cls.product_a, post=True)
+        cls.order_sent = cls._create_order('Orden 00001-001-0001', cls.invoice_sent)
+        cls.order_pending = cls._create_order('Orden 00001-001-0002', cls.invoice_pending)
+        cls.order_no_invoice = cls._create_order('Orden 00001-001-0003')
+        cls.env['pos.hkapdf'].create({
+            'name': 'Recibo %s' % cls.invoice_sent.name,
+            'move_id': cls.invoice_sent.id,
+            'profile': '80mm',
+            'state': 'done',
+        })
+
+    @classmethod
+    def _create_order(cls, reference, invoice=None):
+        return cls.env['pos.order'].create({
+            'session_id': cls.pos_session.id,
+            'partner_id': cls.partner_a.id,
+            'pos_reference': reference,
+            'amount_tax': 0.0,
+            'amount_total': 0.0,
+            'amount_paid': 0.0,
+            'amount_return': 0.0,
+            'account_move': invoice.id if invoice else False,
+        })
+
+    def _get_receipts(self, pos_references, **params):
+        self.authenticate('admin', 'admin')
+        return self.make_jsonrpc_request('/pos/hka_receipts', {'pos_references': pos_references, **params})
+
+    def test_batch_in_request_order(self):
+        references = [self.order_pending.pos_reference, 'Orden 99999-999-9999',
+                      self.order_sent.pos_reference, self.order_no_invoice.pos_reference]
+        result = self._get_receipts(references)
+        self.assertTrue(result['success'])
+        receipts = result['receipts']
+        self.assertEqual([receipt['pos_reference'] for receipt in receipts], references)
+
+        pending, unknown, sent, no_invoice = receipts
+        self.assertEqual(unknown['error'], 'Order not found')
+        self.assertEqual(no_invoice['error'], 'No invoice found for order')
+        self.assertEqual(no_invoice['order_name'], self.order_no_invoice.name)
+        self.assertEqual(sent, {
+            'pos_reference': self.order_sent.pos_reference,
+            'order_name': self.order_sent.name,
+            'invoice_id': self.invoice_sent.id,
+            'hka_status': 'sent',
+            'hka_document_state': self.invoice_sent.hka_document_state,
+            'numero_documento_fiscal': '0000000042',
+            'cufe': self.invoice_sent.hka_cufe,
+            'qr': self.invoice_sent.hka_qr,
+            'qr_image_url': '/pos/hka_qr/%s.png' % self.invoice_sent.id,
+            'nro_protocolo_autorizacion': False,
+            'fecha_recepcion_dgi': False,
+            'image_url': '/pos/hka_receipt/%s/80mm.png' % self.invoice_sent.id,
+        })
+        # Not sent nor rendered yet: nothing for the POS to show
+        self.assertEqual(pending['invoice_id'], self.invoice_pending.id)
+        self.assertFalse(pending['cufe'])
+        self.assertFalse(pending['qr_image_url'])
+        self.assertFalse(pending['image_url'])
+
+    def test_receipt_profile(self):
+        receipts = self._get_receipts([self.order_sent.pos_reference], profile='58mm')['receipts']
+        # Only the 80 mm receipt is rendered
+        self.assertFalse(receipts[0]['image_url'])
+
+        result = self._get_receipts([self.order_sent.pos_reference], profile='110mm')
+        self.assertEqual(result, {'error': 'Unknown receipt profile'})
+
+    def test_batch_limit(self):
+        references = ['Orden %05d' % index for index in range(MAX_RECEIPTS_PER_CALL + 1)]
+        result = self._get_receipts(references)
+        self.assertEqual(result, {'error': 'At most %d references per call' % MAX_RECEIPTS_PER_CALL})
+
+        result = self._get_receipts(references[:MAX_RECEIPTS_PER_CALL])
+        self.assertEqual(len(result['receipts']), MAX_RECEIPTS_PER_CALL)
+
+    def test_empty_batch(self):
+        self.assertEqual(self._get_receipts([]), {'success': True, 'receipts': []})
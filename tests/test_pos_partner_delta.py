@@ -0,0 +1,89 @@
+from odoo.tests import tagged
+
+from .common import IsfehkaTestCommon
+
+# Later than every other partner of the database, so the tests page over their own partners only
+FUTURE = '2100-01-01 00:00:00'
+START = {'write_date': '2099-12-31 00:00:00', 'id': 0}
+
+
+@tagged('post_install', '-at_install')
+class TestPosPartnerDelta(IsfehkaTestCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.pos_session = cls._create_pos_session()
+        cls.partners = cls.env['res.partner'].create([
+            {'name': 'Cliente %s' % index, 'ruc': '8-100-%s' % index, 'dv': '1%s' % index}
+            for index in range(5)
+        ])
+
+    def _set_write_date(self, partners, write_date):
+        self.env.flush_all()
+        self.env.cr.execute("UPDATE res_partner SET write_date = %s WHERE id IN %s", [write_date, tuple(partners.ids)])
+        self.env.invalidate_all()
+
+    def _sync(self, cursor, limit):
+        """Every page of the delta from cursor"""
+        pages = []
+        while True:
+            page = self.pos_session.get_hka_partners_delta(cursor, limit)
+            pages.append(page)
+            cursor = page['cursor']
+            if not page['more']:
+                return pages
+
+    def test_pages_share_write_date(self):
+        """Partners with the same write_date are split over pages without skipping any"""
+        self._set_write_date(self.partners, FUTURE)
+        pages = self._sync(START, 2)
+
+        self.assertEqual([page['more'] for page in pages], [True, True, False])
+        self.assertEqual([partner['id'] for page in pages for partner in page['partners']], self.partners.ids)
+        self.assertEqual(pages[0]['cursor'], {'write_date': FUTURE, 'id': self.partners[1].id})
+        self.assertEqual(pages[-1]['cursor'], {'write_date': FUTURE, 'id': self.partners[4].id})
+        self.assertEqual(pages[0]['partners'][0]['ruc'], '8-100-0')
+        self.assertTrue(all(page['archived_ids'] == [] for page in pages))
+
+    def test_count_on_last_page(self):
+        self._set_write_date(self.partners, FUTURE)
+        pages = self._sync(START, 2)
+        self.assertEqual([page['count'] for page in pages[:-1]], [None, None])
+        self.assertEqual(pages[-1]['count'], len(self.pos_session.get_hka_partner_ids()))
+        self.assertTrue(set(self.partners.ids) <= set(self.pos_session.get_hka_partner_ids()))
+
+    def test_changes_since_cursor(self):
+        self._set_write_date(self.partners, FUTURE)
+        cursor = self._sync(START, 10)[-1]['cursor']
+
+        # Nothing changed: same cursor, nothing to load
+        page = self.pos_session.get_hka_partners_delta(cursor, 10)
+        self.assertEqual((page['partners'], page['archived_ids'], page['cursor'], page['more']),
+                         ([], [], cursor, False))
+
+        changed, archived = self.partners[3], self.partners[0]
+        archived.active = False
+        self._set_write_date(changed + archived, '2100-01-02 00:00:00')
+        page = self.pos_session.get_hka_partners_delta(cursor, 10)
+        self.assertEqual([partner['id'] for partner in page['partners']], changed.ids)
+        self.assertEqual(page['archived_ids'], archived.ids)
+        self.assertNotIn(archived.id, self.pos_session.get_hka_partner_ids())
+
+    def test_partner_ids_follow_deletions(self):
+        partner = self.partners[2]
+        self.assertIn(partner.id, self.pos_session.get_hka_partner_ids())
+        partner.unlink()
+        self.assertNotIn(partner.id, self.pos_session.get_hka_partner_ids())
+
+    def test_limit_is_capped(self):
+        self._set_write_date(self.partners, FUTURE)
+        page = self.pos_session.get_hka_partners_delta(START, 10 ** 6)
+        self.assertFalse(page['more'])
+        self.assertEqual(len(page['partners']), 5)
+
+    def test_signature(self):
+        page = self.pos_session.get_hka_partners_delta(START, 1)
+        fields = self.pos_session._loader_params_res_partner()['search_params']['fields']
+        self.assertEqual(page['signature'], ','.join(sorted(fields)))
+        self.assertIn('ruc', page['signature'].split(','))
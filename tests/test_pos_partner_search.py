@@ -0,0 +1,62 @@
+from odoo.tests import tagged
+
+from .common import IsfehkaTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPosPartnerSearch(IsfehkaTestCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.pos_session = cls._create_pos_session()
+        Partner = cls.env['res.partner']
+        cls.cedula = Partner.create({'name': 'Ana Batista', 'ruc': '8-923-456', 'dv': '12'})
+        cls.cedula_other_dv = Partner.create({'name': 'Ana Batista Jr', 'ruc': '8-923-4567', 'dv': '45'})
+        cls.foreigner = Partner.create({'name': 'John Smith', 'ruc': ' pe-91-23 ', 'dv': '3'})
+        cls.company_ruc = Partner.create({'name': 'Comercial Istmo', 'ruc': '155699999-2-2021', 'dv': '07',
+                                          'phone': '6123-9876', 'email': 'ventas@istmo.example.com'})
+
+    def _search(self, query, **kwargs):
+        result = self.pos_session.search_hka_partners(query, **kwargs)
+        return self.env['res.partner'].browse([partner['id'] for partner in result['partners']]), result['more']
+
+    def test_ruc_prefix(self):
+        partners, more = self._search('8-923-456')
+        self.assertEqual(partners, self.cedula + self.cedula_other_dv)
+        self.assertFalse(more)
+        self.assertEqual(self._search('155699999-2-')[0], self.company_ruc)
+
+    def test_ruc_is_stored_upper(self):
+        self.assertEqual(self.foreigner.ruc, 'PE-91-23')
+        self.foreigner.ruc = 'pe-91-24'
+        self.assertEqual(self.foreigner.ruc, 'PE-91-24')
+        self.assertEqual(self._search('pe-91')[0], self.foreigner)
+
+    def test_ruc_with_dv(self):
+        self.assertEqual(self._search('8-923-456', dv='45')[0], self.cedula_other_dv)
+        self.assertEqual(self._search('8-923-456', dv=' 12 ')[0], self.cedula)
+        self.assertFalse(self._search('8-923-456', dv='99')[0])
+
+    def test_other_queries(self):
+        """Phones, emails and names go through the stock POS search fields"""
+        self.assertEqual(self._search('6123-9876')[0], self.company_ruc)
+        self.assertEqual(self._search('ventas@istmo')[0], self.company_ruc)
+        self.assertIn(self.cedula, self._search('batista')[0])
+
+    def test_empty_query(self):
+        self.assertEqual(self.pos_session.search_hka_partners('  '), {'partners': [], 'more': False})
+
+    def test_paging(self):
+        first, more = self._search('8-923', limit=1)
+        self.assertEqual(first, self.cedula)
+        self.assertTrue(more)
+        second, more = self._search('8-923', limit=1, offset=1)
+        self.assertEqual(second, self.cedula_other_dv)
+        self.assertFalse(more)
+
+    def test_loader_format(self):
+        result = self.pos_session.search_hka_partners('8-923-4567')
+        fields = self.pos_session._loader_params_res_partner()['search_params']['fields']
+        self.assertEqual(set(result['partners'][0]), set(fields) | {'id'})
+        self.assertEqual(result['partners'][0]['dv'], '45')
@@ -0,0 +1,4 @@
+from . import metrics
+from . import pool
+from . import tracing
+from . import receipt
@@ -0,0 +1,107 @@
+"""Prometheus-style counters and histograms for the HKA integration
+
+Increments are aggregated in memory per database and merged into the
+``hka_metric`` table with one UPSERT, through their own cursor, by a timer
+started with the first increment: they are stored within FLUSH_INTERVAL
+seconds even if the worker then goes idle. Scraping only reads that small
+table.
+"""
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 10  # seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name: (type, help)
+METRICS = {
+    'hka_calls_total': ('counter', 'HKA SOAP calls by operation and result code.'),
+    'hka_call_duration_seconds': ('histogram', 'HKA SOAP call latency by operation.'),
+    'hka_send_phase_duration_seconds': ('histogram', 'Latency of each phase of the invoice send pipeline.'),
+    'hka_fiscal_number_wait_seconds': ('histogram', 'Time spent allocating a fiscal number.'),
+    'hka_fiscal_number_failures_total': ('counter', 'Fiscal number allocations that failed.'),
+    'hka_pos_pdf_render_seconds': ('histogram', 'Time to render an HKA PDF receipt for the POS.'),
+    'hka_invoices': ('gauge', 'Customer invoices by HKA status.'),
+    'hka_invoices_waiting_documents': ('gauge', 'Sent invoices still missing their PDF or XML.'),
+}
+
+_BUFFER = {}
+_TIMERS = {}
+_LOCK = threading.Lock()
+
+
+def format_labels(labels):
+    """Canonical Prometheus label string, e.g. 'operation="Enviar",result="200"'"""
+    if not labels:
+        return ''
+    return ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+
+
+def inc(dbname, name, labels=None, amount=1):
+    _add(dbname, [((name, format_labels(labels)), amount)])
+
+
+def observe(dbname, name, value, labels=None, buckets=DEFAULT_BUCKETS):
+    """Record ``value`` (in seconds) in a cumulative histogram"""
+    labels = dict(labels or {})
+    # Every bucket is written, even with 0, so all series of a histogram exist
+    deltas = [
+        ((name + '_bucket', format_labels(dict(labels, le=bucket))), 1 if value <= bucket else 0)
+        for bucket in buckets
+    ]
+    deltas += [
+        ((name + '_bucket', format_labels(dict(labels, le='+Inf'))), 1),
+        ((name + '_sum', format_labels(labels)), value),
+        ((name + '_count', format_labels(labels)), 1),
+    ]
+    _add(dbname, deltas)
+
+
+def _add(dbname, deltas):
+    if not dbname:
+        return
+    with _LOCK:
+        values = _BUFFER.setdefault(dbname, {})
+        for key, amount in deltas:
+            values[key] = values.get(key, 0) + amount
+        _schedule_flush(dbname)
+
+
+def _schedule_flush(dbname):
+    # Called with _LOCK held
+    if dbname not in _TIMERS:
+        timer = threading.Timer(FLUSH_INTERVAL, flush, [dbname])
+        timer.daemon = True
+        _TIMERS[dbname] = timer
+        timer.start()
+
+
+def flush(dbname):
+    """Write the buffered increments of a database now"""
+    with _LOCK:
+        values = _BUFFER.pop(dbname, {})
+        timer = _TIMERS.pop(dbname, None)
+    if timer:
+        timer.cancel()
+    _write(dbname, values)
+
+
+def _write(dbname, values):
+    if not values:
+        return
+    from odoo.modules.registry import Registry
+    try:
+        with Registry(dbname).cursor() as cr:
+            cr.execute("""
+                INSERT INTO hka_metric (name, labels, value)
+                VALUES %s
+                ON CONFLICT (name, labels) DO UPDATE SET value = hka_metric.value + EXCLUDED.value
+            """ % ', '.join(['%s'] * len(values)),
+                [(name, labels, amount) for (name, labels), amount in values.items()])
+    except Exception as e:
+        # Metrics must never break invoicing
+        _logger.warning('Could not store %d HKA metric increments: %s', len(values), e)
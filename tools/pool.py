@@ -0,0 +1,47 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from odoo import api
+
+_logger = logging.getLogger(__name__)
+
+
+def run_in_new_cursors(env, func, items, max_workers, on_done=None):
+    """Run ``func(env, item)`` for every item in a bounded thread pool
+
+    Every call gets its own cursor and environment (same user and context as
+    ``env``); the cursor is committed when the call returns and rolled back
+    when it raises. ``on_done(item, result, error)`` is called from the
+    calling thread as each item completes.
+
+    Returns a list of ``(item, result, error)`` tuples in completion order.
+    """
+    registry = env.registry
+    uid, context = env.uid, dict(env.context)
+    if registry.in_test_mode():
+        # Test cursors are shared, run sequentially
+        max_workers = 1
+
+    def _run(item):
+        thread = threading.current_thread()
+        thread.dbname = registry.db_name
+        thread.uid = uid
+        with registry.cursor() as cr:
+            return func(api.Environment(cr, uid, context), item)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(_run, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            result, error = None, None
+            try:
+                result = future.result()
+            except Exception as e:
+                _logger.warning('Parallel task failed for %s: %s', item, e)
+                error = e
+            if on_done:
+                on_done(item, result, error)
+            results.append((item, result, error))
+    return results
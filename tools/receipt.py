@@ -0,0 +1,58 @@
+"""Rendering of HKA PDF receipts to PNG images for thermal printers"""
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+# Printable width in dots of 203 dpi thermal printers, per paper width
+RECEIPT_PROFILES = {
+    '58mm': 384,
+    '80mm': 576,
+}
+DEFAULT_RECEIPT_PROFILE = '80mm'
+
+RENDER_WORKERS = 2
+RENDER_TIMEOUT = 30
+
+# Standalone script, it does not import Odoo
+RENDERER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'receipt_renderer.py')
+
+
+def render_receipt_png(pdf_data, width, timeout=RENDER_TIMEOUT):
+    """Render the first page of pdf_data as a grayscale PNG width pixels wide
+
+    Runs in a new renderer process: it is started with fork + exec, which
+    is safe from the threads of an Odoo worker, and a crash of the PDF
+    library only fails this receipt. Requires PyMuPDF.
+    """
+    result = subprocess.run(
+        [sys.executable, RENDERER, str(width)],
+        input=pdf_data, capture_output=True, timeout=timeout, check=False)
+    if result.returncode:
+        message = result.stderr.decode(errors='replace').strip().splitlines()
+        raise RuntimeError(message[-1] if message else 'renderer exited with %s' % result.returncode)
+    return result.stdout
+
+
+def render_receipts(jobs, timeout=RENDER_TIMEOUT):
+    """Render [(key, pdf_data, width)], RENDER_WORKERS at a time
+
+    Returns {key: (png, error, seconds)}.
+    """
+    def render(job):
+        key, pdf_data, width = job
+        start = time.perf_counter()
+        try:
+            return key, (render_receipt_png(pdf_data, width, timeout), None, time.perf_counter() - start)
+        except subprocess.TimeoutExpired:
+            error = TimeoutError('rendering took more than %ss' % timeout)
+        except Exception as e:
+            error = e
+        return key, (None, error, time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+        return dict(executor.map(render, jobs))
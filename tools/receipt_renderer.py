@@ -0,0 +1,22 @@
+"""Render a PDF read from stdin to a grayscale PNG written to stdout
+
+Usage: receipt_renderer.py WIDTH
+
+Run by receipt.render_receipt_png in its own process; it must not import
+Odoo. The zoom, and so the effective DPI, follows from the page width: the
+receipt always fills the printable width of the paper.
+"""
+import sys
+
+
+def render(pdf_data, width):
+    import fitz  # PyMuPDF
+    with fitz.open(stream=pdf_data, filetype='pdf') as doc:
+        page = doc[0]
+        zoom = width / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+        return pix.tobytes('png')
+
+
+if __name__ == '__main__':
+    sys.stdout.buffer.write(render(sys.stdin.buffer.read(), int(sys.argv[1])))
@@ -0,0 +1,149 @@
+"""Lightweight latency tracing for the HKA pipeline
+
+Spans are buffered per database in memory and written in batches to the
+``hka_timing`` table through their own cursor, when FLUSH_SIZE spans are
+buffered or by a timer at most FLUSH_INTERVAL seconds after the first one,
+even if the worker then goes idle. Tracing never adds a write
+to the traced transaction nor is lost when it rolls back. Every span is also
+emitted as a JSON debug log record on the ``odoo.addons.isfehka.tools.tracing``
+logger and feeds the HKA latency metrics (see metrics.py).
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from . import metrics
+
+_logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = 100
+FLUSH_INTERVAL = 10  # seconds
+
+# Tags (move_id, company_id) of the pipeline being traced
+_TAGS = contextvars.ContextVar('isfehka_trace_tags', default={})
+
+_BUFFER = {}
+_TIMERS = {}
+_LOCK = threading.Lock()
+
+
+class Span:
+    __slots__ = ('kind', 'operation', 'result')
+
+    def __init__(self, kind, operation):
+        self.kind = kind
+        self.operation = operation
+        self.result = None
+
+
+@contextmanager
+def trace_context(**tags):
+    """Attach tags (e.g. move_id, company_id) to the spans recorded inside"""
+    token = _TAGS.set(dict(_TAGS.get(), **tags))
+    try:
+        yield
+    finally:
+        _TAGS.reset(token)
+
+
+def current_context():
+    """Copy of the tracing context, to run a callable in another thread with the same tags"""
+    return contextvars.copy_context()
+
+
+@contextmanager
+def span(dbname, operation, kind='phase'):
+    """Time the enclosed block and record it as a span
+
+    ``kind`` is 'phase' for steps of the invoice pipeline and 'operation' for
+    HKA SOAP operations. Callers may set ``span.result`` (e.g. the HKA result
+    code) on the yielded object.
+    """
+    current = Span(kind, operation)
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield current
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        tags = _TAGS.get()
+        row = {
+            'date': datetime.utcnow().replace(microsecond=0),
+            'kind': kind,
+            'operation': operation,
+            'move_id': tags.get('move_id'),
+            'company_id': tags.get('company_id'),
+            'duration_ms': round(duration_ms, 3),
+            'status': status,
+            'result': current.result and str(current.result),
+        }
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('hka_span %s', json.dumps(row, default=str))
+        if dbname:
+            _record(dbname, row)
+            _observe(dbname, row)
+
+
+def _observe(dbname, row):
+    seconds = row['duration_ms'] / 1000
+    if row['kind'] == 'operation':
+        metrics.inc(dbname, 'hka_calls_total', {
+            'operation': row['operation'],
+            'result': row['result'] or row['status'],
+        })
+        metrics.observe(dbname, 'hka_call_duration_seconds', seconds, {'operation': row['operation']})
+    else:
+        metrics.observe(dbname, 'hka_send_phase_duration_seconds', seconds, {'phase': row['operation']})
+
+
+def _record(dbname, row):
+    with _LOCK:
+        rows = _BUFFER.setdefault(dbname, [])
+        rows.append(row)
+        if len(rows) < FLUSH_SIZE:
+            _schedule_flush(dbname)
+            return
+    flush(dbname)
+
+
+def _schedule_flush(dbname):
+    # Called with _LOCK held
+    if dbname not in _TIMERS:
+        timer = threading.Timer(FLUSH_INTERVAL, flush, [dbname])
+        timer.daemon = True
+        _TIMERS[dbname] = timer
+        timer.start()
+
+
+def flush(dbname):
+    """Write the buffered spans of a database now"""
+    with _LOCK:
+        rows = _BUFFER.pop(dbname, [])
+        timer = _TIMERS.pop(dbname, None)
+    if timer:
+        timer.cancel()
+    _write(dbname, rows)
+
+
+def _write(dbname, rows):
+    if not rows:
+        return
+    from odoo.modules.registry import Registry
+    columns = ('date', 'kind', 'operation', 'move_id', 'company_id', 'duration_ms', 'status', 'result')
+    try:
+        with Registry(dbname).cursor() as cr:
+            cr.execute(
+                'INSERT INTO hka_timing (%s) VALUES %s' % (
+                    ', '.join(columns), ', '.join(['%s'] * len(rows))),
+                [tuple(row[column] for column in columns) for row in rows],
+            )
+    except Exception as e:
+        # Tracing must never break invoicing
+        _logger.warning('Could not store %d HKA timing spans: %s', len(rows), e)
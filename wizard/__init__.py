@@ -1,2 +1,3 @@
 from . import account_move_cancel_reason
 from . import account_move_register_hka
+from . import account_move_send_hka
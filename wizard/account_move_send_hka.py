@@ -0,0 +1,102 @@
+from odoo import models, fields, api, _
+
+
+class AccountMoveSendHka(models.TransientModel):
+    _name = 'account.move.send.hka'
+    _description = 'Send Invoices to HKA'
+
+    move_ids = fields.Many2many('account.move', string='Facturas')
+    state = fields.Selection([
+        ('draft', 'Borrador'),
+        ('done', 'Terminado'),
+    ], default='draft')
+    line_ids = fields.One2many('account.move.send.hka.line', 'wizard_id', string='Resultados')
+    queued_count = fields.Integer(compute='_compute_counts')
+    skipped_count = fields.Integer(compute='_compute_counts')
+    sent_count = fields.Integer(compute='_compute_counts')
+    error_count = fields.Integer(compute='_compute_counts')
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if 'move_ids' in fields_list and not res.get('move_ids') \
+                and self.env.context.get('active_model') == 'account.move':
+            res['move_ids'] = [(6, 0, self.env.context.get('active_ids', []))]
+        return res
+
+    @api.depends('line_ids.state', 'line_ids.outbox_state')
+    def _compute_counts(self):
+        for wizard in self:
+            states = wizard.line_ids.mapped('state')
+            outbox_states = wizard.line_ids.mapped('outbox_state')
+            wizard.queued_count = states.count('queued')
+            wizard.skipped_count = states.count('skipped')
+            wizard.sent_count = outbox_states.count('done')
+            wizard.error_count = outbox_states.count('error') + outbox_states.count('cancelled')
+
+    def _is_sendable(self, move):
+        return (move.move_type in ('out_invoice', 'out_refund')
+                and move.state == 'posted'
+                and move.hka_status in ('draft', 'error'))
+
+    def action_send(self):
+        """Queue the selected invoices in the HKA outbox
+
+        The outbox workers send them in the background, each in its own
+        transaction and under a row lock, so a large batch never runs into
+        the request time limit or races another sender. The user gets a bus
+        notification as each invoice is sent or fails.
+        """
+        self.ensure_one()
+        to_send = self.move_ids.filtered(self._is_sendable)
+        lines = [{
+            'move_id': move.id,
+            'state': 'skipped',
+            'message': _('La factura no está confirmada o ya fue enviada a HKA.'),
+        } for move in self.move_ids - to_send]
+
+        Outbox = self.env['hka.outbox'].sudo()
+        Outbox._enqueue(to_send, notify_user=self.env.user)
+        # Invoices already in the queue keep their item
+        items = Outbox.search([('move_id', 'in', to_send.ids), ('state', 'in', ('pending', 'processing'))])
+        item_by_move = {item.move_id.id: item.id for item in items}
+        lines += [{
+            'move_id': move.id,
+            'state': 'queued',
+            'outbox_id': item_by_move.get(move.id, False),
+        } for move in to_send]
+
+        self.write({
+            'state': 'done',
+            'line_ids': [(5, 0, 0)] + [(0, 0, vals) for vals in lines],
+        })
+        return self.action_refresh()
+
+    def action_refresh(self):
+        """Reopen the wizard with the current outcome of each queued invoice"""
+        self.ensure_one()
+        return {
+            'name': _('Enviar a HKA'),
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+
+class AccountMoveSendHkaLine(models.TransientModel):
+    _name = 'account.move.send.hka.line'
+    _description = 'Send Invoices to HKA Result'
+
+    wizard_id = fields.Many2one('account.move.send.hka', required=True, ondelete='cascade')
+    move_id = fields.Many2one('account.move', string='Factura', readonly=True)
+    state = fields.Selection([
+        ('queued', 'En Cola'),
+        ('skipped', 'Omitida'),
+    ], string='Resultado', readonly=True)
+    message = fields.Text(string='Mensaje', readonly=True)
+    outbox_id = fields.Many2one('hka.outbox', string='Envío', readonly=True)
+    # Read back from the outbox, so reopening the wizard shows how each send went
+    outbox_state = fields.Selection(related='outbox_id.state', string='Estado del Envío')
+    outbox_error = fields.Text(related='outbox_id.last_error', string='Error')